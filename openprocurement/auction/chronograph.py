@@ -17,7 +17,7 @@ import argparse
 from yaml import load
 from zope.interface import implementer
 from pytz import timezone
-from gevent import sleep
+from gevent import sleep, spawn
 from gevent.pywsgi import WSGIServer
 from datetime import datetime, timedelta
 from urlparse import urlparse
@@ -29,11 +29,13 @@ from openprocurement.auction.interfaces import (
 )
 from openprocurement.auction.design import sync_design_chronograph
 from openprocurement.auction.helpers.chronograph import (
-    get_server_name, AuctionScheduler
+    get_server_name, AuctionScheduler, start_date_row,
+    save_schedule_snapshot, load_schedule_snapshot, sequence_number,
+    SNAPSHOT_INTERVAL
 )
 from openprocurement.auction.helpers.chronograph_http import chronograph_webapp
 from openprocurement.auction.helpers.couch import (
-    iterview, couchdb_dns_query_settings
+    iterview, iterchanges, couchdb_dns_query_settings
 )
 from openprocurement.auction.helpers.system import get_lisener
 
@@ -50,6 +52,9 @@ class AuctionsChronograph(object):
         self.timezone = timezone(config['main']['timezone'])
         self.mapper = components.qA(self, IAuctionsManager)
         self.server_name = get_server_name()
+        self.snapshot_path = config['main'].get('schedule_snapshot')
+        self.last_key = 0
+        self.scheduled_rows = {}
         LOGGER.info('Init node: {}'.format(self.server_name))
         self.init_database()
         self.init_scheduler()
@@ -92,39 +97,129 @@ class AuctionsChronograph(object):
             )
         self.server.start()
 
+    def auctions_feed(self, since=0):
+        """Rows of the ``chronograph/start_date`` view, including new ones
+
+        The view is polled by default, ``chronograph_feed: changes`` in
+        config switches to the continuous changes feed of the view. Only
+        rows with keys after ``since`` are read, the view keys are integer
+        sequences, so the view is read from start after a sequence string
+        of the changes feed.
+        """
+        if self.config['main'].get('chronograph_feed') == 'changes':
+            return iterchanges(self.config['main']["couch_url"],
+                               self.config['main']['auctions_db'],
+                               'chronograph/start_date',
+                               since=since, wrapper=start_date_row)
+        if not isinstance(since, (int, long)):
+            since = 0
+        return iterview(self.config['main']["couch_url"],
+                        self.config['main']['auctions_db'],
+                        'chronograph/start_date',
+                        start_key=since + 1 if since else 0)
+
+    def schedule(self, auction_item):
+        datestamp = (
+            datetime.now(self.timezone) + timedelta(minutes=1)
+        ).isoformat()
+        # ADD FILTER BY VALUE
+        # {start: '2016-09-10T14:36:40.378777+03:00', test: false}
+        if datestamp < auction_item['value']['start']:
+            worker_cmd_provider = \
+                self.mapper(FeedItem(auction_item['value']))
+            if not worker_cmd_provider:
+                return
+            self.scheduler.schedule_auction(
+                auction_item['id'], auction_item['value'],
+                args=worker_cmd_provider(auction_item['id'])
+            )
+            if self.snapshot_path:
+                self.scheduled_rows[auction_item['id']] = {
+                    'id': auction_item['id'],
+                    'key': auction_item['key'],
+                    'value': auction_item['value'],
+                }
+
+    def save_schedule(self):
+        """Save rows of the scheduled auctions and the last read key"""
+        if not self.snapshot_path:
+            return
+        for auction_id in list(self.scheduled_rows):
+            if not self.scheduler.get_job(auction_id):
+                del self.scheduled_rows[auction_id]
+        try:
+            save_schedule_snapshot(self.snapshot_path, self.last_key,
+                                   self.scheduled_rows.values())
+        except (IOError, OSError) as e:
+            LOGGER.error('Failed to save schedule snapshot: {}'.format(e))
+            return
+        LOGGER.info('Saved schedule snapshot of {} auctions at {}'.format(
+            len(self.scheduled_rows), self.last_key))
+
+    def restore_schedule(self):
+        """Schedule auctions from the snapshot
+
+        Auctions changed after the snapshot are not restored, the feed
+        reads them again if they are still in the view.
+
+        :return: view key to continue reading from, ``0`` to read all
+        """
+        if not self.snapshot_path:
+            return 0
+        last_key, rows = load_schedule_snapshot(self.snapshot_path)
+        if not last_key:
+            return 0
+        db = couchdb_dns_query_settings(
+            self.config['main']["couch_url"],
+            self.config['main']['auctions_db']
+        )
+        if sequence_number(db.info()['update_seq']) < \
+                sequence_number(last_key):
+            LOGGER.warning('Schedule snapshot is ahead of the database, '
+                           'reading all auctions')
+            return 0
+        changed = set(change['id'] for change in
+                      db.changes(since=last_key)['results'])
+        rows = [row for row in rows if row['id'] not in changed]
+        for row in rows:
+            self.schedule(row)
+        LOGGER.info('Restored {} auctions from snapshot at {}, {} changed '
+                    'since'.format(len(rows), last_key, len(changed)))
+        self.last_key = last_key
+        return last_key
+
+    def save_schedule_periodically(self):
+        interval = self.config['main'].get('schedule_snapshot_interval',
+                                           SNAPSHOT_INTERVAL)
+        while not self.scheduler.exit:
+            sleep(interval)
+            self.save_schedule()
+
     def run(self):
 
         LOGGER.info('Starting node: {}'.format(self.server_name))
 
         def sigterm():
             LOGGER.info('Starting SIGTERM')
+            self.save_schedule()
             self.scheduler.shutdown(True)
 
         gevent_signal(signal.SIGTERM, sigterm)
 
         def sigusr1():
             LOGGER.info('Starting SIGUSR1')
+            self.save_schedule()
             self.scheduler.shutdown()
 
         gevent_signal(signal.SIGUSR1, sigusr1)
 
-        for auction_item in iterview(self.config['main']["couch_url"],
-                                     self.config['main']['auctions_db'],
-                                     'chronograph/start_date'):
-            datestamp = (
-                datetime.now(self.timezone) + timedelta(minutes=1)
-            ).isoformat()
-            # ADD FILTER BY VALUE
-            # {start: '2016-09-10T14:36:40.378777+03:00', test: false}
-            if datestamp < auction_item['value']['start']:
-                worker_cmd_provider = \
-                    self.mapper(FeedItem(auction_item['value']))
-                if not worker_cmd_provider:
-                    continue
-                self.scheduler.schedule_auction(
-                    auction_item['id'], auction_item['value'],
-                    args=worker_cmd_provider(auction_item['id'])
-                )
+        since = self.restore_schedule()
+        if self.snapshot_path:
+            spawn(self.save_schedule_periodically)
+
+        for auction_item in self.auctions_feed(since):
+            self.schedule(auction_item)
+            self.last_key = auction_item['key']
 
             if self.scheduler.exit:
                 break
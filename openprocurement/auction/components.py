@@ -1,6 +1,6 @@
 import logging
 from zope import interface
-from zope.interface import registry
+from zope.interface import registry, providedBy
 from walkabout import PredicateDomain, PredicateMismatch
 
 from openprocurement.auction.interfaces import IComponents, IAuctionType, IFeedItem
@@ -15,19 +15,83 @@ class AuctionComponents(registry.Components):
     def __init__(self, *args, **kw):
         super(AuctionComponents, self).__init__(*args, **kw)
         self._dispatch = PredicateDomain(IAuctionType, self)
+        self._predicates = []
+        self._match_cache = {}
+        self._factory_cache = {}
 
-    def add_predicate(self, *args, **kw):
-        self._dispatch.add_predicate(*args, **kw)
+    def add_predicate(self, name, factory, *args, **kw):
+        self._dispatch.add_predicate(name, factory, *args, **kw)
+        self._predicates.append(factory)
+        self.invalidate()
 
     def add_auction(self, iface, **preds):
         self._dispatch.add_candidate(iface, IFeedItem, **preds)
+        self.invalidate()
+
+    def registerAdapter(self, *args, **kw):
+        super(AuctionComponents, self).registerAdapter(*args, **kw)
+        self.invalidate()
+
+    def unregisterAdapter(self, *args, **kw):
+        result = super(AuctionComponents, self).unregisterAdapter(*args, **kw)
+        self.invalidate()
+        return result
+
+    def invalidate(self):
+        """Drop memoized dispatch results after registry changes"""
+        self._match_cache.clear()
+        self._factory_cache.clear()
+
+    def dispatch_key(self, inst):
+        """Values of all dispatch predicates for ``inst``
+
+        Returns ``None`` if some predicate does not provide ``key``, so
+        its result can not be memoized.
+        """
+        try:
+            return tuple(predicate.key(inst) for predicate in self._predicates)
+        except AttributeError:
+            return None
 
     def match(self, inst):
+        key = self.dispatch_key(inst)
+        if key is None:
+            return self._match(inst)
+        try:
+            return self._match_cache[key]
+        except KeyError:
+            iface = self._match_cache[key] = self._match(inst)
+            return iface
+
+    def _match(self, inst):
         try:
             return self._dispatch.lookup(inst)
         except PredicateMismatch:
             pass
 
+    def query_auction(self, for_, inst):
+        """Adapt ``(for_, inst)`` to the auction type of ``inst``
+
+        The adapter factory is memoized by the dispatch key of ``inst``
+        and the interfaces of both objects, misses included.
+        """
+        key = self.dispatch_key(inst)
+        if key is None:
+            iface = self.match(inst)
+            if not iface:
+                return
+            return self.queryMultiAdapter((for_, inst), iface)
+        required = (providedBy(for_), providedBy(inst))
+        try:
+            factory = self._factory_cache[key, required]
+        except KeyError:
+            iface = self.match(inst)
+            factory = iface and self.adapters.lookup(required, iface)
+            self._factory_cache[key, required] = factory
+        if factory is None:
+            return
+        return factory(for_, inst)
+
     def adapter(self, provides, adapts, name=""):
         """ TODO: create decorator for such thinks """
 
@@ -1,8 +1,6 @@
 import logging.config
-import iso8601
 
-from datetime import datetime
-from time import mktime, time
+from time import time
 from gevent.subprocess import check_call
 from pkg_resources import iter_entry_points
 
@@ -14,15 +12,14 @@ from openprocurement.auction.systemd_msgs_ids import (
     DATA_BRIDGE_RE_PLANNING_TENDER_ALREADY_PLANNED,
     DATA_BRIDGE_RE_PLANNING_LOT_ALREADY_PLANNED,
 )
-from openprocurement.auction.design import endDate_view, startDate_view,\
-    PreAnnounce_view
+from openprocurement.auction.helpers.planning import parse_start_date
 from openprocurement.auction.utils import do_until_success, \
     prepare_auction_worker_cmd
 from openprocurement.auction.auctions_server import auctions_server
 from openprocurement.auction.components import AuctionComponents
 from openprocurement.auction.predicates import ProcurementMethodType
 from openprocurement.auction.interfaces import IAuctionsManager,\
-    IAuctionsChronograph, IAuctionDatabridge, IAuctionsServer
+    IAuctionsChronograph, IAuctionDatabridge, IAuctionsServer, IAuctionPlanner
 
 
 SIMPLE_AUCTION_TYPE = 0
@@ -55,13 +52,7 @@ class AuctionManager(object):
     __str__ = __repr__
 
     def __call__(self, raw_data):
-        auction_iface = components.match(raw_data)
-        if not auction_iface:
-            return
-        return components.queryMultiAdapter(
-            (self.for_, raw_data),
-            auction_iface
-        )
+        return components.query_auction(self.for_, raw_data)
 
 
 @components.adapter(provides=IAuctionsManager, adapts=IAuctionDatabridge)
@@ -119,26 +110,21 @@ class Planning(object):
     def __iter__(self):
         status = self.item.get('status', None)
         if status == "active.auction":
+            now = time() * 1000
             if 'lots' not in self.item and 'auctionPeriod' in self.item and 'startDate' in self.item['auctionPeriod'] \
                     and 'endDate' not in self.item['auctionPeriod']:
 
-                start_date = iso8601.parse_date(self.item['auctionPeriod']['startDate'])
-                start_date = start_date.astimezone(self.bridge.tz)
-                auctions_start_in_date = startDate_view(
-                    self.bridge.db,
-                    key=(mktime(start_date.timetuple()) + start_date.microsecond / 1E6) * 1000
-                )
-                if datetime.now(self.bridge.tz) > start_date:
+                _, start_key = parse_start_date(self.item['auctionPeriod']['startDate'])
+                if now > start_key:
                     LOGGER.info("Tender {} start date in past. Skip it for planning".format(self.item['id']),
                                 extra={'MESSAGE_ID': DATA_BRIDGE_PLANNING_TENDER_SKIP})
                     raise StopIteration
-                # TODO: Find out about the value of field tenders_ids_list
-                # TODO: It is not initialized but used.
-                if self.bridge.re_planning and self.item['id'] in self.tenders_ids_list:
+                if self.bridge.re_planning and self.item['id'] in self.bridge.tenders_ids_list:
                     LOGGER.info("Tender {} already planned while replanning".format(self.item['id']),
                                 extra={'MESSAGE_ID': DATA_BRIDGE_RE_PLANNING_TENDER_ALREADY_PLANNED})
                     raise StopIteration
-                if not self.bridge.re_planning and [row.id for row in auctions_start_in_date.rows if row.id == self.item['id']]:
+                if not self.bridge.re_planning and \
+                        self.bridge.planned_auctions.is_planned(self.item['id'], start_key):
                     LOGGER.info("Tender {} already planned on the same date".format(self.item['id']),
                                 extra={'MESSAGE_ID': DATA_BRIDGE_PLANNING_TENDER_ALREADY_PLANNED})
                     raise StopIteration
@@ -147,13 +133,8 @@ class Planning(object):
                 for lot in self.item['lots']:
                     if lot["status"] == "active" and 'auctionPeriod' in lot \
                             and 'startDate' in lot['auctionPeriod'] and 'endDate' not in lot['auctionPeriod']:
-                        start_date = iso8601.parse_date(lot['auctionPeriod']['startDate'])
-                        start_date = start_date.astimezone(self.bridge.tz)
-                        auctions_start_in_date = startDate_view(
-                            self.bridge.db,
-                            key=(mktime(start_date.timetuple()) + start_date.microsecond / 1E6) * 1000
-                        )
-                        if datetime.now(self.bridge.tz) > start_date:
+                        _, start_key = parse_start_date(lot['auctionPeriod']['startDate'])
+                        if now > start_key:
                             LOGGER.info(
                                 "Start date for lot {} in tender {} is in past. Skip it for planning".format(
                                     lot['id'], self.item['id']),
@@ -161,36 +142,43 @@ class Planning(object):
                             )
                             raise StopIteration
                         auction_id = MULTILOT_AUCTION_ID.format(self.item, lot)
-                        if self.bridge.re_planning and auction_id in self.tenders_ids_list:
+                        if self.bridge.re_planning and auction_id in self.bridge.tenders_ids_list:
                             LOGGER.info("Tender {} already planned while replanning".format(auction_id),
                                         extra={'MESSAGE_ID': DATA_BRIDGE_RE_PLANNING_LOT_ALREADY_PLANNED})
                             raise StopIteration
-                        elif not self.bridge.re_planning and [row.id for row in auctions_start_in_date.rows if row.id == auction_id]:
+                        elif not self.bridge.re_planning and \
+                                self.bridge.planned_auctions.is_planned(auction_id, start_key):
                             LOGGER.info("Tender {} already planned on same date".format(auction_id),
                                         extra={'MESSAGE_ID': DATA_BRIDGE_PLANNING_LOT_ALREADY_PLANNED})
                             raise StopIteration
                         yield ("planning", str(self.item["id"]), str(lot["id"]))
         if status == "active.qualification" and 'lots' in self.item:
-            for lot in self.item['lots']:
-                if lot["status"] == "active":
-                    is_pre_announce = PreAnnounce_view(self.bridge.db)
-                    auction_id = MULTILOT_AUCTION_ID.format(self.item, lot)
-                    if [row.id for row in is_pre_announce.rows if row.id == auction_id]:
-                        yield ('announce', self.item['id'], lot['id'])
+            active_lots = [lot for lot in self.item['lots']
+                           if lot["status"] == "active"]
+            if not active_lots:
+                raise StopIteration
+            pre_announce_ids = self.bridge.planned_auctions.pre_announced(
+                [MULTILOT_AUCTION_ID.format(self.item, lot)
+                 for lot in active_lots]
+            )
+            for lot in active_lots:
+                auction_id = MULTILOT_AUCTION_ID.format(self.item, lot)
+                if auction_id in pre_announce_ids:
+                    yield ('announce', self.item['id'], lot['id'])
             raise StopIteration
         if status == "cancelled":
-            future_auctions = endDate_view(
-                self.bridge.db, startkey=time() * 1000
+            future_auctions = self.bridge.planned_auctions.future_auctions(
+                self.item['id'], time() * 1000
             )
             if 'lots' in self.item:
                 for lot in self.item['lots']:
                     auction_id = MULTILOT_AUCTION_ID.format(self.item, lot)
-                    if auction_id in [i.id for i in future_auctions]:
+                    if auction_id in future_auctions:
                         LOGGER.info('Tender {0} selected for cancellation'.format(self.item['id']))
                         yield ('cancel', self.item['id'], lot['id'])
                 raise StopIteration
             else:
-                if self.item["id"] in [i.id for i in future_auctions]:
+                if self.item["id"] in future_auctions:
                     LOGGER.info('Tender {0} selected for cancellation'.format(self.item['id']))
                     yield ('cancel', self.item['id'], "")
                 raise StopIteration
@@ -202,6 +190,24 @@ class Planning(object):
     __str__ = __repr__
 
     def __call__(self, cmd, tender_id, with_api_version=None, lot_id=None):
+        planner = components.queryUtility(
+            IAuctionPlanner,
+            name=self.item.get('procurementMethodType', 'default') or 'default'
+        )
+        if planner is not None:
+            try:
+                result = planner(self.bridge, cmd, tender_id, self.item,
+                                 lot_id=lot_id,
+                                 with_api_version=with_api_version)
+            except Exception as e:
+                LOGGER.error(
+                    "In-process auction command {} for {} failed: {}. "
+                    "Fallback to auction worker".format(cmd, tender_id, repr(e))
+                )
+            else:
+                LOGGER.info("Auction command {} result: {}".format(cmd, result))
+                return result
+
         params = prepare_auction_worker_cmd(
             self.bridge,
             tender_id,
@@ -215,5 +221,10 @@ class Planning(object):
             check_call,
             args=(params,),
         )
+        if result is None:
+            # retries are exhausted
+            raise RuntimeError("Auction command {} for {} failed".format(
+                params[1], tender_id))
 
         LOGGER.info("Auction command {} result: {}".format(params[1], result))
+        return result
@@ -7,11 +7,19 @@ try:
 except ImportError:
     pass
 
+import json
 import logging
 import logging.config
 import os
+import sys
+import signal
 import argparse
-from urlparse import urljoin
+import requests
+from gevent import spawn, sleep, joinall, signal as gevent_signal
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+from time import time
+from urlparse import urljoin, urlparse
 from zope.interface import implementer
 from yaml import load
 from couchdb import Database, Session
@@ -20,12 +28,19 @@ from dateutil.tz import tzlocal
 from openprocurement.auction.interfaces import\
     IAuctionDatabridge, IAuctionsManager
 from openprocurement.auction.core import components
-from openprocurement.auction.utils import FeedItem
+from openprocurement.auction.utils import FeedItem, get_tender_data
 
 from openprocurement.auction.systemd_msgs_ids import\
-    DATA_BRIDGE_PLANNING_DATA_SYNC, DATA_BRIDGE_PLANNING_START_BRIDGE
-from openprocurement_client.sync import ResourceFeeder
-from openprocurement.auction.design import sync_design
+    DATA_BRIDGE_PLANNING_DATA_SYNC, DATA_BRIDGE_PLANNING_START_BRIDGE,\
+    DATA_BRIDGE_RE_PLANNING_START_BRIDGE, DATA_BRIDGE_RE_PLANNING_FINISHED
+from openprocurement.auction.design import sync_design, startDate_view
+from openprocurement.auction.helpers.planning import PlannedAuctionsIndex,\
+    BoundedSet, shard_of, auction_start_date, parse_start_date
+from openprocurement.auction.helpers.feeder import CheckpointResourceFeeder,\
+    FeedCheckpoint, FeedMarker, CHECKPOINT_DOC_ID, coalesce
+from openprocurement.auction.helpers.metrics import BridgeMetrics
+from openprocurement.auction.helpers.databridge_http import databridge_webapp
+from openprocurement.auction.helpers.system import get_lisener
 
 
 LOGGER = logging.getLogger(__name__)
@@ -39,6 +54,12 @@ DEFAULT_RETRIEVERS_PARAMS = {
     'up_wait_sleep_min': 5,
     'queue_size': 501
 }
+DEFAULT_PLANNING_CONCURRENCY = 1
+DEFAULT_FEED_CHECKPOINT_INTERVAL = 30
+DEFAULT_RE_PLANNING_CONCURRENCY = 10
+DEFAULT_FEED_COALESCE_SIZE = 100
+RE_PLANNING_BATCH = 1000
+RE_PLANNING_SEEN_SIZE = 100000
 
 
 @implementer(IAuctionDatabridge)
@@ -46,10 +67,17 @@ class AuctionsDataBridge(object):
 
     """Auctions Data Bridge"""
 
-    def __init__(self, config, re_planning=False, debug=False):
+    def __init__(self, config, re_planning=False, debug=False, resync=False,
+                 shard=0, shards=1, dry_run=None):
         super(AuctionsDataBridge, self).__init__()
         self.config = config
-        self.tenders_ids_list = []
+        # file object for the planning plan, workers are not called
+        self.dry_run = dry_run
+        # dry run replays the whole feed and does not move its position
+        self.resync = resync or dry_run is not None
+        self.shard = shard
+        self.shards = shards
+        self.tenders_ids_list = BoundedSet(RE_PLANNING_SEEN_SIZE)
         self.tz = tzlocal()
         self.debug = debug
         self.mapper = components.qA(self, IAuctionsManager)
@@ -63,17 +91,56 @@ class AuctionsDataBridge(object):
         self.db = Database(self.couch_url,
                            session=Session(retry_delays=range(10)))
         sync_design(self.db)
-        self.feeder = ResourceFeeder(
+        # shared with in-process planners
+        self.api_session = requests.Session()
+        self.planned_auctions = PlannedAuctionsIndex(self.db)
+        self.planning_pool = Pool(self.config['main'].get(
+            'planning_concurrency', DEFAULT_PLANNING_CONCURRENCY))
+        self.planning_tasks = {}
+        self.acknowledgement = None
+        self.feed_worker = None
+        checkpoint_id = self.config['main'].get('feed_checkpoint_id',
+                                                CHECKPOINT_DOC_ID)
+        if self.shards > 1:
+            checkpoint_id = '{}_{}_of_{}'.format(checkpoint_id, self.shard,
+                                                 self.shards)
+        self.feed_checkpoint = FeedCheckpoint(self.db, checkpoint_id)
+        self.feed_checkpoint_interval = self.config['main'].get(
+            'feed_checkpoint_interval', DEFAULT_FEED_CHECKPOINT_INTERVAL)
+        self.feeder = CheckpointResourceFeeder(
             host=self.config_get('resource_api_server'),
             resource=self.config_get('resource_name'),
             version=self.config_get('resource_api_version'), key='',
             extra_params=API_EXTRA,
             retrievers_params=DEFAULT_RETRIEVERS_PARAMS
         )
+        self.metrics = BridgeMetrics(self)
+        if self.config['main'].get('web_app', None):
+            self.init_web_app()
 
     def config_get(self, name):
         return self.config['main'][name]
 
+    def owns(self, tender_id):
+        return self.shards == 1 or \
+            shard_of(tender_id, self.shards) == self.shard
+
+    def init_web_app(self):
+        """Serve the web app on the configured port plus the shard number,
+        so the shards started from one config do not share a port"""
+        self.web_application = databridge_webapp
+        self.web_application.bridge = self
+        location = self.config['main'].get('web_app')
+        if ':' in str(location):
+            if not location.startswith('//'):
+                location = "//{}".format(location)
+            o = urlparse(location)
+            listener = get_lisener(o.port + self.shard, o.hostname)
+        else:
+            listener = get_lisener(int(location) + self.shard)
+        self.server = WSGIServer(listener, self.web_application, spawn=10)
+        self.server.start()
+
     def run(self):
         if self.re_planning:
             self.run_re_planning()
@@ -81,50 +148,222 @@ class AuctionsDataBridge(object):
 
         LOGGER.info('Start Auctions Bridge',
                     extra={'MESSAGE_ID': DATA_BRIDGE_PLANNING_START_BRIDGE})
+        self.planned_auctions.start()
         LOGGER.info('Start data sync...',
                     extra={'MESSAGE_ID': DATA_BRIDGE_PLANNING_DATA_SYNC})
-        for item in self.feeder.get_resource_items():
-            # magic goes here
-            feed = FeedItem(item)
-            planning = self.mapper(feed)
-            if not planning:
-                continue
-            for cmd, item_id, lot_id in planning:
-                if lot_id:
-                    LOGGER.info('Lot {} of tender {} selected for {}'.format(
-                        lot_id, item_id, cmd))
-                else:
-                    LOGGER.info('Tender {} selected for {}'.format(item_id,
-                                                                   cmd))
+        gevent_signal(signal.SIGTERM, self.shutdown)
+        if not self.resync:
+            self.feeder.resume_from = self.feed_checkpoint.load()
+        checkpoint_worker = spawn(self.save_feed_checkpoint_periodically)
+        self.feed_worker = spawn(self.sync)
+        self.feed_worker.join()
+        LOGGER.info('Wait for {} planning commands'.format(
+            len(self.planning_pool)))
+        self.planning_pool.join()
+        if self.acknowledgement is not None:
+            self.acknowledgement.join()
+        checkpoint_worker.kill()
+        self.save_feed_checkpoint()
+        self.planned_auctions.stop()
+        # re-raise the feed error, so the process exits with failure
+        self.feed_worker.get()
+
+    def save_feed_checkpoint(self):
+        if self.dry_run is not None:
+            return
+        checkpoint = self.feeder.get_checkpoint()
+        if checkpoint:
+            self.feed_checkpoint.save(checkpoint)
+
+    def save_feed_checkpoint_periodically(self):
+        while True:
+            sleep(self.feed_checkpoint_interval)
+            self.save_feed_checkpoint()
+
+    def sync(self):
+        batches = coalesce(
+            self.feeder.get_resource_items(),
+            window=self.config['main'].get('feed_coalesce_window', 0),
+            size=self.config['main'].get('feed_coalesce_size',
+                                         DEFAULT_FEED_COALESCE_SIZE)
+        )
+        for batch in batches:
+            self.planned_auctions.prefetch([
+                item for item in batch if not isinstance(item, FeedMarker)
+                and 'id' in item and self.owns(item['id'])
+            ])
+            for item in batch:
+                self.process_item(item)
+
+    def process_item(self, item):
+        if isinstance(item, FeedMarker):
+            self.acknowledge(item)
+            return
+        if 'id' in item and not self.owns(item['id']):
+            return
+        self.metrics.item_received(item)
+        # magic goes here
+        feed = FeedItem(item)
+        planning = self.mapper(feed)
+        if not planning:
+            return
+        for cmd, item_id, lot_id in planning:
+            if lot_id:
+                LOGGER.info('Lot {} of tender {} selected for {}'.format(
+                    lot_id, item_id, cmd))
+            else:
+                LOGGER.info('Tender {} selected for {}'.format(item_id,
+                                                               cmd))
+            self.schedule_planning(planning, cmd, item_id, lot_id)
+
+    def acknowledge(self, marker):
+        """Acknowledge feed marker once the planning commands queued
+        before it are done
+
+        Markers are acknowledged in the order they were received.
+        """
+        waits = list(self.planning_tasks.values())
+        if self.acknowledgement is not None and \
+                not self.acknowledgement.ready():
+            waits.append(self.acknowledgement)
+        if not waits:
+            self.feeder.acknowledge(marker)
+            return
+        self.acknowledgement = spawn(self._acknowledge, waits, marker)
+
+    def _acknowledge(self, waits, marker):
+        joinall(waits)
+        self.feeder.acknowledge(marker)
+
+    def schedule_planning(self, planning, cmd, item_id, lot_id):
+        """Run planning command in the pool
+
+        Commands for the same auction are chained, so they run in the
+        order they were selected. While the last command of the auction
+        is queued or running, its start is treated as planned and the
+        same planning is not queued again. Blocks while the pool is full.
+        """
+        auction_id = '_'.join(filter(None, (item_id, lot_id)))
+        start_key = self.planning_start_key(planning, cmd, lot_id)
+        previous = self.planning_tasks.get(auction_id)
+        if start_key is not None and \
+                self.planned_auctions.pending.get(auction_id) == start_key:
+            LOGGER.debug('Auction {} is already being planned on the same '
+                         'date'.format(auction_id))
+            return previous
+        task = self.planning_pool.spawn(
+            self._run_planning, previous, planning, cmd, item_id, lot_id
+        )
+        self.planning_tasks[auction_id] = task
+        if start_key is None:
+            self.planned_auctions.pending.pop(auction_id, None)
+        else:
+            self.planned_auctions.pending[auction_id] = start_key
+
+        def release(task):
+            if self.planning_tasks.get(auction_id) is task:
+                del self.planning_tasks[auction_id]
+                self.planned_auctions.pending.pop(auction_id, None)
+
+        task.link(release)
+        return task
+
+    def planning_start_key(self, planning, cmd, lot_id):
+        """``auctions/by_startDate`` key the command plans the auction on"""
+        if cmd != 'planning':
+            return None
+        start = auction_start_date(getattr(planning, 'item', None) or {},
+                                   lot_id)
+        return parse_start_date(start)[1] if start else None
+
+    def _run_planning(self, previous, planning, cmd, item_id, lot_id):
+        if previous is not None:
+            previous.join()
+        self.run_planning(planning, cmd, item_id, lot_id)
+
+    def run_planning(self, planning, cmd, item_id, lot_id):
+        item = getattr(planning, 'item', None) or {}
+        started = time()
+        try:
+            if self.dry_run is not None:
+                self.write_plan(item, cmd, item_id, lot_id)
+            else:
                 planning(cmd, item_id, lot_id=lot_id)
+        except Exception as e:
+            LOGGER.error('Planning command {} for {} failed: {}'.format(
+                cmd, '_'.join(filter(None, (item_id, lot_id))), repr(e)))
+            self.metrics.planning_done(item, cmd, time() - started,
+                                       error=True)
+            return
+        self.metrics.planning_done(item, cmd, time() - started)
+        start_key = self.planning_start_key(planning, cmd, lot_id)
+        if start_key is not None:
+            # as if the worker saved the auction, so later feed items
+            # of the tender are not planned again
+            self.planned_auctions.mark_planned(
+                '_'.join(filter(None, (item_id, lot_id))), start_key)
+
+    def write_plan(self, item, cmd, item_id, lot_id):
+        start = auction_start_date(item, lot_id)
+        self.dry_run.write(json.dumps({
+            'cmd': cmd,
+            'tender_id': item_id,
+            'lot_id': lot_id or '',
+            'start': start,
+        }, sort_keys=True) + '\n')
+        self.dry_run.flush()
+
+    def shutdown(self):
+        LOGGER.info('Stop data sync')
+        if self.feed_worker is not None:
+            self.feed_worker.kill()
 
     def run_re_planning(self):
-        pass
-        # self.re_planning = True
-        # self.offset = ''
-        # LOGGER.info(
-        #     'Start Auctions Bridge for re-planning...',
-        #     extra={'MESSAGE_ID': DATA_BRIDGE_RE_PLANNING_START_BRIDGE})
-        # for tender_item in self.get_teders_list(re_planning=True):
-        #     LOGGER.debug('Tender {} selected for re-planning'.format(
-        #         tender_item))
-        #     for planning_data in self.get_teders_list():
-        #         if len(planning_data) == 1:
-        #             LOGGER.info('Tender {0} selected for planning'.format(
-        #                 *planning_data))
-        #             self.start_auction_worker_cmd('planning',
-        #                                           planning_data[0])
-        #         elif len(planning_data) == 2:
-        #             LOGGER.info(
-        #                 'Lot {1} of tender {0} selected for planning'.format(
-        #                     *planning_data))
-        #             self.start_auction_worker_cmd('planning',
-        #                                           planning_data[0],
-        #                                           lot_id=planning_data[1])
-        #         self.tenders_ids_list.append(tender_item['id'])
-        #     sleep(1)
-        # LOGGER.info("Re-planning auctions finished",
-        #             extra={'MESSAGE_ID': DATA_BRIDGE_RE_PLANNING_FINISHED})
+        LOGGER.info(
+            'Start Auctions Bridge for re-planning...',
+            extra={'MESSAGE_ID': DATA_BRIDGE_RE_PLANNING_START_BRIDGE})
+        re_planning_pool = Pool(self.config['main'].get(
+            're_planning_concurrency', DEFAULT_RE_PLANNING_CONCURRENCY))
+        in_progress = set()
+        for row in self.db.iterview(startDate_view.design + '/' +
+                                    startDate_view.name,
+                                    RE_PLANNING_BATCH,
+                                    startkey=time() * 1000):
+            tender_id = row.id.split('_')[0]
+            if tender_id in self.tenders_ids_list or \
+                    tender_id in in_progress or not self.owns(tender_id):
+                continue
+            in_progress.add(tender_id)
+            task = re_planning_pool.spawn(self.re_plan_tender, tender_id)
+            task.link(lambda task, tender_id=tender_id:
+                      in_progress.discard(tender_id))
+        re_planning_pool.join()
+        LOGGER.info("Re-planning auctions finished",
+                    extra={'MESSAGE_ID': DATA_BRIDGE_RE_PLANNING_FINISHED})
+
+    def re_plan_tender(self, tender_id):
+        LOGGER.debug('Tender {} selected for re-planning'.format(tender_id))
+        tender_url = '{}/api/{}/{}/{}'.format(
+            self.config_get('resource_api_server').rstrip('/'),
+            self.config_get('resource_api_version'),
+            self.config_get('resource_name'),
+            tender_id
+        )
+        tender = get_tender_data(tender_url, session=self.api_session)
+        if not tender:
+            return
+        planning = self.mapper(FeedItem(tender['data']))
+        if not planning:
+            return
+        for cmd, item_id, lot_id in planning:
+            if lot_id:
+                LOGGER.info('Lot {} of tender {} selected for {}'.format(
+                    lot_id, item_id, cmd))
+                self.tenders_ids_list.add('_'.join((item_id, lot_id)))
+            else:
+                LOGGER.info('Tender {} selected for {}'.format(item_id, cmd))
+            self.run_planning(planning, cmd, item_id, lot_id)
+        self.tenders_ids_list.add(tender_id)
 
 
 def main():
@@ -133,12 +372,34 @@ def main():
     parser.add_argument(
         '--re-planning', action='store_true', default=False,
         help='Not ignore auctions which already scheduled')
+    parser.add_argument(
+        '--resync', action='store_true', default=False,
+        help='Ignore saved feed position and sync all tenders')
+    parser.add_argument(
+        '--shards', type=int, default=1,
+        help='Number of bridge processes sharing the feed')
+    parser.add_argument(
+        '--shard', type=int, default=0,
+        help='Shard of the tenders handled by this process, '
+             'from 0 to shards - 1')
+    parser.add_argument(
+        '--dry-run', default=None, metavar='FILE',
+        help='Sync all tenders and write planning commands as JSON lines '
+             'to file ("-" for stdout) instead of running auction workers')
     params = parser.parse_args()
+    if not 0 <= params.shard < params.shards:
+        parser.error('--shard must be less than --shards')
     if os.path.isfile(params.config):
         with open(params.config) as config_file_obj:
             config = load(config_file_obj.read())
         logging.config.dictConfig(config)
-        bridge = AuctionsDataBridge(config, re_planning=params.re_planning)
+        if params.dry_run in (None, '-'):
+            dry_run = params.dry_run and sys.stdout
+        else:
+            dry_run = open(params.dry_run, 'w')
+        bridge = AuctionsDataBridge(config, re_planning=params.re_planning,
+                                    resync=params.resync, shard=params.shard,
+                                    shards=params.shards, dry_run=dry_run)
         bridge.run()
 
 
@@ -0,0 +1,118 @@
+from gevent import monkey
+monkey.patch_all()
+
+import logging
+import logging.config
+import os
+import signal
+import sys
+import argparse
+from gevent import spawn, spawn_later, sleep, joinall,\
+    signal as gevent_signal
+from gevent.subprocess import Popen
+from multiprocessing import cpu_count
+from time import time
+from yaml import load
+
+
+LOGGER = logging.getLogger(__name__)
+RESTART_DELAY = 1
+RESTART_DELAY_MAX = 60
+STOP_TIMEOUT = 30
+
+
+class DataBridgeSupervisor(object):
+
+    """Run and restart sharded auctions data bridge processes"""
+
+    def __init__(self, config_path, shards, bridge_args=()):
+        self.config_path = config_path
+        self.shards = shards
+        self.bridge_args = list(bridge_args)
+        self.processes = {}
+        self.stopping = False
+
+    def command(self, shard):
+        return [
+            sys.executable, '-m', 'openprocurement.auction.databridge',
+            self.config_path, '--shard', str(shard),
+            '--shards', str(self.shards)
+        ] + self.bridge_args
+
+    def supervise(self, shard):
+        """Run the shard process until the supervisor is stopped
+
+        Exited processes are restarted with growing delay, which is reset
+        once a process has worked longer than the maximal delay.
+        """
+        delay = RESTART_DELAY
+        while not self.stopping:
+            started = time()
+            process = self.processes[shard] = Popen(self.command(shard))
+            if self.stopping:
+                # started while the shards were being signalled
+                process.send_signal(signal.SIGTERM)
+            LOGGER.info('Started bridge shard {} with pid {}'.format(
+                shard, process.pid))
+            code = process.wait()
+            if self.stopping:
+                LOGGER.info('Bridge shard {} finished'.format(shard))
+                return code
+            if time() - started > RESTART_DELAY_MAX:
+                delay = RESTART_DELAY
+            LOGGER.error('Bridge shard {} exited with code {}, restart in '
+                         '{} sec.'.format(shard, code, delay))
+            sleep(delay)
+            delay = min(delay * 2, RESTART_DELAY_MAX)
+
+    def shutdown(self):
+        LOGGER.info('Stop bridge shards')
+        self.stopping = True
+        self.signal_processes(signal.SIGTERM)
+        spawn_later(STOP_TIMEOUT, self.signal_processes, signal.SIGKILL)
+
+    def signal_processes(self, signum):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signum)
+
+    def run(self):
+        gevent_signal(signal.SIGTERM, self.shutdown)
+        gevent_signal(signal.SIGINT, self.shutdown)
+        workers = [spawn(self.supervise, shard)
+                   for shard in range(self.shards)]
+        joinall(workers)
+        return max([worker.value or 0 for worker in workers] or [0])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='---- Auctions Bridge Supervisor ----')
+    parser.add_argument('config', type=str, help='Path to configuration file')
+    parser.add_argument(
+        '--shards', type=int, default=None,
+        help='Number of bridge processes, defaults to '
+             'main.shards from config or number of CPUs')
+    parser.add_argument(
+        '--re-planning', action='store_true', default=False,
+        help='Not ignore auctions which already scheduled')
+    parser.add_argument(
+        '--resync', action='store_true', default=False,
+        help='Ignore saved feed position and sync all tenders')
+    params = parser.parse_args()
+    if os.path.isfile(params.config):
+        with open(params.config) as config_file_obj:
+            config = load(config_file_obj.read())
+        logging.config.dictConfig(config)
+        shards = params.shards or config['main'].get('shards') or cpu_count()
+        bridge_args = []
+        if params.re_planning:
+            bridge_args.append('--re-planning')
+        if params.resync:
+            bridge_args.append('--resync')
+        supervisor = DataBridgeSupervisor(params.config, shards, bridge_args)
+        sys.exit(supervisor.run())
+
+
+if __name__ == "__main__":
+    main()
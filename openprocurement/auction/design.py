@@ -43,6 +43,17 @@ startDate_view = ViewDefinition(
 )
 
 
+endDate_by_tenderID_view = ViewDefinition(
+    'auctions',
+    'endDate_by_tenderID',
+    ''' function(doc) {
+            var end = new Date(doc.endDate||doc.stages[0].start).getTime()
+            emit(doc._id.split('_')[0], end);
+        }
+    '''
+)
+
+
 PreAnnounce_view = ViewDefinition(
     'auctions',
     'PreAnnounce',
@@ -54,9 +65,21 @@ PreAnnounce_view = ViewDefinition(
     '''
 )
 
+PreAnnounce_by_id_view = ViewDefinition(
+    'auctions',
+    'PreAnnounce_by_id',
+    ''' function(doc) {
+            if ((doc.stages.length - 2) == doc.current_stage){
+                emit(doc._id, null);
+            }
+        }
+    '''
+)
+
 
 def sync_design(db):
-    views = [endDate_view, startDate_view, PreAnnounce_view]
+    views = [endDate_view, startDate_view, endDate_by_tenderID_view,
+             PreAnnounce_view, PreAnnounce_by_id_view]
     for view in views:
         view.sync(db)
     while True:
@@ -1,19 +1,19 @@
+import json
+import os
 from apscheduler.executors.gevent import GeventExecutor
 from requests import get
 from .system import free_memory
 from gevent import sleep
 from logging import getLogger
-from random import random
-import consul
-import iso8601
 from datetime import timedelta, datetime
 from apscheduler.schedulers.gevent import GeventScheduler
 from gevent.subprocess import Popen
 from apscheduler.schedulers import SchedulerNotRunningError
 from uuid import uuid4
+from .planning import parse_start_date
+from .jobstore import HeapJobStore
+from .locks import lock_backend
 
-LOCK_RETRIES = 6
-SLEEP_BETWEEN_TRIES_LOCK = 10
 WORKER_TIME_RUN = 16 * 60
 
 AWS_META_DATA_URL = 'http://169.254.169.254/latest/meta-data/instance-id'
@@ -21,6 +21,7 @@ SERVER_NAME_PREFIX = 'AUCTION_WORKER_{}'
 
 MIN_AUCTION_START_TIME_RESERV = timedelta(seconds=60)
 MAX_AUCTION_START_TIME_RESERV = timedelta(seconds=15 * 60)
+SNAPSHOT_INTERVAL = 60  # seconds between schedule snapshots
 
 
 def get_server_name():
@@ -32,6 +33,69 @@ def get_server_name():
     return SERVER_NAME_PREFIX.format(suffix)
 
 
+def start_date_row(change):
+    """Build ``chronograph/start_date`` view row from the document change
+
+    Mirrors ``design_files/start_date.js`` for the changes feed source.
+
+    >>> row = start_date_row({'id': 'a', 'seq': 7, 'doc': {
+    ...     'current_stage': -1, 'stages': [{'start': '2100-01-01'}]}})
+    >>> row['id'], row['key'], sorted(row['value'].items())
+    ('a', 7, [('api_version', None), ('auction_type', 'default'), \
+('mode', ''), ('procurementMethodType', ''), ('start', '2100-01-01')])
+    """
+    doc = change['doc']
+    return {
+        'id': change['id'],
+        'key': change['seq'],
+        'value': {
+            'start': doc['stages'][0]['start'],
+            'mode': doc.get('mode') or '',
+            'api_version': doc.get('TENDERS_API_VERSION') or None,
+            'auction_type': doc.get('auction_type') or 'default',
+            'procurementMethodType': doc.get('procurementMethodType') or '',
+        }
+    }
+
+
+def sequence_number(seq):
+    """Number of CouchDB update sequence, an integer in CouchDB 1.x and
+    a ``"<number>-<opaque>"`` string since CouchDB 2.0
+
+    >>> sequence_number(12), sequence_number('12-g1AAAAEzeJzLYWBgYMpgTmHgz8tPSTV0MD')
+    (12, 12)
+    """
+    if isinstance(seq, (int, long)):
+        return seq
+    return int(str(seq).split('-', 1)[0])
+
+
+def save_schedule_snapshot(path, last_key, rows):
+    """Write scheduled view rows and the last read view key to ``path``
+
+    The file is replaced atomically, so a crash while saving keeps the
+    previous snapshot.
+    """
+    tmp_path = '{}.tmp'.format(path)
+    with open(tmp_path, 'w') as snapshot:
+        json.dump({'last_key': last_key, 'rows': rows}, snapshot)
+    os.rename(tmp_path, path)
+
+
+def load_schedule_snapshot(path):
+    """Read snapshot saved by ``save_schedule_snapshot``
+
+    :return: last view key and the rows, ``(0, [])`` if there is no
+             readable snapshot
+    """
+    try:
+        with open(path) as snapshot:
+            data = json.load(snapshot)
+        return data['last_key'], data['rows']
+    except (IOError, ValueError, KeyError, TypeError):
+        return 0, []
+
+
 class AuctionExecutor(GeventExecutor):
 
     def start(self, scheduler, alias):
@@ -76,9 +140,7 @@ class AuctionScheduler(GeventScheduler):
         self.server_name = server_name
         self.config = config
         self.execution_stopped = False
-        self.use_consul = self.config.get('main', {}).get('use_consul', True)
-        if self.use_consul:
-            self.consul = consul.Consul()
+        self.locks = lock_backend(self.config, server_name)
         self.logger = logger
         self._limit_pool_lock = self._create_lock()
         self._limit_auctions = self.config['main'].get('limit_auctions',
@@ -93,8 +155,11 @@ class AuctionScheduler(GeventScheduler):
     def _create_default_executor(self):
         return AuctionExecutor()
 
+    def _create_default_jobstore(self):
+        return HeapJobStore()
+
     def convert_datetime(self, datetime_stamp):
-        return iso8601.parse_date(datetime_stamp).astimezone(self.timezone)
+        return parse_start_date(datetime_stamp)[0].astimezone(self.timezone)
 
     def shutdown(self, SIGKILL=False, stop_chronograph=False):
         self.exit = True
@@ -109,6 +174,8 @@ class AuctionScheduler(GeventScheduler):
         except SchedulerNotRunningError:
             self.logger.debug('Scheduler is not running')
             response = False
+        if self.locks is not None:
+            self.locks.close()
 
         self.execution_stopped = True
         return response
@@ -152,44 +219,45 @@ class AuctionScheduler(GeventScheduler):
             return
         if not document_id:
             document_id = args[2]
-        sleep(random())
-        if self.use_consul:
-            i = LOCK_RETRIES
-            session = self.consul.session.create(behavior='delete', ttl=ttl)
-            while i > 0:
-                if self.consul.kv.put("auction_{}".format(document_id),
-                                      self.server_name, acquire=session):
-                    self.logger.info(
-                        "Run worker for document {}".format(document_id),
-                        extra={'MESSAGE_ID': 'CHRONOGRAPH_RUN_WORKER'})
-                    with self._limit_pool_lock:
-                        self._count_auctions += 1
-
-                    self._auction_fucn(args)
-
-                    self.logger.info("Finished {}".format(document_id))
-                    self.consul.session.destroy(session)
-                    with self._limit_pool_lock:
-                        self._count_auctions -= 1
-                    return
-                sleep(SLEEP_BETWEEN_TRIES_LOCK)
-                i -= 1
-
-            self.logger.debug("Locked on other server")
-            self.consul.session.destroy(session)
-        else:
+        if self.locks is None:
             self.logger.info("Run worker for document {}".format(document_id),
                              extra={'MESSAGE_ID': 'CHRONOGRAPH_RUN_WORKER'})
             self._auction_fucn(args)
+            return
+
+        lock = self.locks.acquire("auction_{}".format(document_id), ttl)
+        if lock is None:
+            self.logger.debug("Locked on other server")
+            return
+        self.logger.info("Run worker for document {}".format(document_id),
+                         extra={'MESSAGE_ID': 'CHRONOGRAPH_RUN_WORKER'})
+        with self._limit_pool_lock:
+            self._count_auctions += 1
+        try:
+            self._auction_fucn(args)
+        finally:
+            self.logger.info("Finished {}".format(document_id))
+            self.locks.release(lock)
+            with self._limit_pool_lock:
+                self._count_auctions -= 1
+
+    def update_job_args(self, job, args):
+        """Keep the start of the job, but run the worker with new ``args``"""
+        if job.kwargs['args'] != args:
+            job.modify(kwargs=dict(job.kwargs, args=args))
 
     def schedule_auction(self, document_id, view_value, args):
-        auction_start_date = self.convert_datetime(view_value['start'])
         if self._executors['default']._instances.get(document_id):
             return
         job = self.get_job(document_id)
+        if job and job.kwargs['start'] == view_value['start']:
+            self.update_job_args(job, args)
+            return
+        auction_start_date = self.convert_datetime(view_value['start'])
         if job:
-            job_auction_start_date = job.kwargs['start']
+            job_auction_start_date = self.convert_datetime(job.kwargs['start'])
             if job_auction_start_date == auction_start_date:
+                self.update_job_args(job, args)
                 return
             self.logger.warning("Changed start date: {}".format(document_id))
 
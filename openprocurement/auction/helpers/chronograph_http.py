@@ -1,7 +1,6 @@
 from flask import Flask
 from flask.json import dumps
 from gevent import spawn
-from consul import Consul
 
 
 chronograph_webapp = Flask(__name__)
@@ -18,8 +17,10 @@ def get_jobs():
 
 @chronograph_webapp.route("/active_locks")
 def get_active_locks():
-    client = Consul()
-    return dumps(client.kv.get('auction_', recurse=True)[1])
+    locks = chronograph_webapp.chronograph.scheduler.locks
+    if locks is None:
+        return dumps([])
+    return dumps(locks.active_locks('auction_'))
 
 
 @chronograph_webapp.route("/active_jobs")
@@ -1,30 +1,189 @@
+import httplib
+import json
 import socket
-from random import sample
+from random import shuffle
 from urlparse import urlparse
 from couchdb import Server, Session
+from couchdb.client import Row
 from couchdb.http import ResourceNotFound
-from time import sleep
+from time import sleep, time
 import sys
 import logging
 
 TRUE = True
 LOGGER = logging.getLogger(__name__)
+CHANGES_HEARTBEAT = 10000  # ms
+VIEW_BATCH = 1000
+VIEW_BATCH_MIN = 100
+VIEW_BATCH_MAX = 10000
+VIEW_BATCH_SECONDS = 1  # wanted duration of a batch request
+HOST_FAILURE_TIMEOUT = 60  # seconds to prefer other hosts after a failure
+DNS_TTL = 60  # seconds to use resolved hosts
+EWMA_ALPHA = 0.3
+ERROR_RATE_LIMIT = 0.5
+ENDPOINTS = {}  # server URL -> CouchEndpoints
+# retry a dropped connection once, other failures go to the next host
+ENDPOINT_RETRY_DELAYS = [0]
+
+
+class CouchEndpoints(object):
+    """CouchDB hosts resolved from the server URL and their health
+
+    Keeps a ``Server`` (and so a connection pool) per host, the moving
+    average of the request latency and of the error rate per host. The
+    error rate decays with ``HOST_FAILURE_TIMEOUT``, so failed hosts are
+    tried again later.
+    """
+
+    def __init__(self, server_url, dns_ttl=DNS_TTL):
+        self.server_url = server_url
+        self.hostname = urlparse(server_url).hostname
+        self.dns_ttl = dns_ttl
+        self.ips = []
+        self.resolved = 0
+        self.servers = {}
+        self.latency = {}
+        self.errors = {}  # ip -> (error rate, time of update)
+        self.failed = {}  # ip -> time of the last error
+
+    def resolve(self):
+        if not self.ips or time() - self.resolved > self.dns_ttl:
+            self.ips = list(set(
+                str(i[4][0]) for i in socket.getaddrinfo(self.hostname, 80)
+            ))
+            self.resolved = time()
+            for ip in set(self.servers) - set(self.ips):
+                del self.servers[ip]
+        return self.ips
+
+    def error_rate(self, ip, now=None):
+        rate, updated = self.errors.get(ip, (0.0, 0))
+        return rate * 0.5 ** (((now or time()) - updated) /
+                              float(HOST_FAILURE_TIMEOUT))
+
+    def ordered(self):
+        """Hosts to try: healthy ones by latency, then the failing ones"""
+        now = time()
+        ips = list(self.resolve())
+        shuffle(ips)
+        return sorted(ips, key=lambda ip: (
+            now - self.failed.get(ip, 0) < HOST_FAILURE_TIMEOUT or
+            self.error_rate(ip, now) > ERROR_RATE_LIMIT,
+            self.latency.get(ip, 0)
+        ))
+
+    def _update_errors(self, ip, error):
+        now = time()
+        self.errors[ip] = (self.error_rate(ip, now) * (1 - EWMA_ALPHA) +
+                           EWMA_ALPHA * error, now)
+
+    def observe(self, ip, latency):
+        if ip in self.latency:
+            latency = self.latency[ip] * (1 - EWMA_ALPHA) + \
+                EWMA_ALPHA * latency
+        self.latency[ip] = latency
+        self._update_errors(ip, 0)
+
+    def fail(self, ip):
+        self.failed[ip] = time()
+        self._update_errors(ip, 1)
+
+    def server(self, ip):
+        if ip not in self.servers:
+            self.servers[ip] = Server(
+                self.server_url.replace(self.hostname, ip),
+                session=Session(retry_delays=ENDPOINT_RETRY_DELAYS)
+            )
+        return self.servers[ip]
+
+    def database(self, database_name):
+        for ip in self.ordered():
+            started = time()
+            try:
+                database = self.server(ip)[database_name]
+            except socket.error:
+                self.fail(ip)
+                continue
+            self.observe(ip, time() - started)
+            return database
+        raise Exception("No route to any couchdb server")
+
+
+def couch_endpoints(server_url):
+    if server_url not in ENDPOINTS:
+        ENDPOINTS[server_url] = CouchEndpoints(server_url)
+    return ENDPOINTS[server_url]
+
+
+def _database_endpoints(database):
+    ip = urlparse(database.resource.url).hostname
+    for endpoints in ENDPOINTS.values():
+        if ip in endpoints.servers:
+            yield endpoints, ip
+
+
+def mark_failed(database):
+    """Remember connection error of the database host"""
+    for endpoints, ip in _database_endpoints(database):
+        endpoints.fail(ip)
+
+
+def observe_latency(database, latency):
+    for endpoints, ip in _database_endpoints(database):
+        endpoints.observe(ip, latency)
 
 
 def couchdb_dns_query_settings(server_url, database_name):
-    parsed_url = urlparse(server_url)
-    all_ips = set([str(i[4][0]) for i in socket.getaddrinfo(urlparse(server_url).hostname, 80)])
+    """Connect to the database on the best of the hosts resolved from
+    the URL, see ``CouchEndpoints``
+    """
+    return couch_endpoints(server_url).database(database_name)
+
+
+def stream_view(database, view_name, wrapper=None, **options):
+    """Iterate the rows of a view response as they are received
+
+    CouchDB sends every row of a view on its own line, so rows are parsed
+    line by line instead of loading the whole response first.
 
-    while all_ips:
-        selected_ip = set(sample(all_ips, 1))
-        all_ips -= selected_ip
-        couch_url = server_url.replace(parsed_url.hostname, selected_ip.pop())
+    :param view_name: the name of the view, ``design_docid/viewname``
+    :param wrapper: an optional callable that should be used to wrap the
+                    result rows
+    :param options: optional query string parameters
+    :return: row generator
+    """
+    design, name = view_name.split('/', 1)
+    params = dict(
+        (key, value if isinstance(value, basestring) else json.dumps(value))
+        for key, value in options.items()
+    )
+    started = time()
+    _, _, data = database.resource('_design', design, '_view', name).get(
+        **params)
+    observe_latency(database, time() - started)
+    if not data.chunked:
+        rows = json.loads(data.read())['rows']
+    else:
+        lines = (line.strip().rstrip(',') for line in data.iterchunks())
+        # skip the ``{"total_rows": ..., "rows": [`` and ``]}`` lines
+        rows = (json.loads(line) for line in lines
+                if line.startswith('{') and not line.endswith('['))
+    for row in rows:
+        row = Row(row)
+        yield wrapper(row) if wrapper else row
+
+
+def _timed(rows, spent):
+    """Yield ``rows``, adding the time taken to receive them to
+    ``spent[0]``, so the time the consumer takes is not counted"""
+    rows = iter(rows)
+    while True:
+        started = time()
         try:
-            server = Server(couch_url, session=Session(retry_delays=range(10)))
-            return server[database_name]
-        except socket.error:
-            continue
-    raise Exception("No route to any couchdb server")
+            row = next(rows)
+        finally:
+            spent[0] += time() - started
+        yield row
 
 
 def iterview(server_url, database_name, view_name, sleep_seconds=10, wrapper=None, **options):
@@ -33,7 +192,11 @@ def iterview(server_url, database_name, view_name, sleep_seconds=10, wrapper=Non
 
     Since the view's rows are fetched in batches any rows emitted for
     documents added, changed or deleted between requests may be missed or
-    repeated.
+    repeated. Rows are yielded while the batch is received and the batch
+    size is adapted to keep a request about ``VIEW_BATCH_SECONDS`` long,
+    not counting the time the consumer takes between rows.
+    After connection errors the view is read from the row following the
+    last yielded one, preferably from another host.
 
     :param name: the name of the view; for custom views, use the format
                  ``design_docid/viewname``, that is, the document ID of the
@@ -46,15 +209,21 @@ def iterview(server_url, database_name, view_name, sleep_seconds=10, wrapper=Non
     :return: row generator
     """
     database = couchdb_dns_query_settings(server_url, database_name)
-    start_key = 0
-    options['start_key'] = start_key
-    options['limit'] = 1000
+    options.setdefault('start_key', 0)
+    options['limit'] = VIEW_BATCH
     design_timeout = 2  # start timeout for view waiting
     while TRUE:
+        rows = 0
+        spent = [0]
         try:
-            rows = list(database.view(view_name, wrapper, **options))
-        except socket.error:
-            options['start_key'] = 0
+            for row in _timed(stream_view(database, view_name, **options),
+                              spent):
+                yield wrapper(row) if wrapper else row
+                rows += 1
+                options['start_key'] = row['key'] + 1
+        except (socket.error, httplib.HTTPException) as e:
+            LOGGER.warning('Couch connection error: {}'.format(repr(e)))
+            mark_failed(database)
             database = couchdb_dns_query_settings(server_url, database_name)
             continue
         except ResourceNotFound as e:
@@ -69,10 +238,63 @@ def iterview(server_url, database_name, view_name, sleep_seconds=10, wrapper=Non
             LOGGER.warning('Couch error: {}'.format(repr(e)))
             raise e
 
-        if len(rows) != 0:
-            for row in rows:
-                start_key = row['key']
-                yield row
-        else:
+        if rows == options['limit']:
+            if spent[0] < VIEW_BATCH_SECONDS / 2.0:
+                options['limit'] = min(options['limit'] * 2, VIEW_BATCH_MAX)
+            elif spent[0] > VIEW_BATCH_SECONDS:
+                options['limit'] = max(options['limit'] / 2, VIEW_BATCH_MIN)
+        elif rows == 0:
             sleep(sleep_seconds)
-        options['start_key'] = (start_key + 1)
+
+
+def iterchanges(server_url, database_name, view_name, since=0,
+                heartbeat=CHANGES_HEARTBEAT, wrapper=None):
+    """Iterate the continuous changes feed of the documents emitted by
+    a view, yielding one change at a time.
+
+    Unlike ``iterview`` the feed is not polled, changes are yielded as
+    soon as they are made. The feed resumes from the last seen sequence
+    after connection errors.
+
+    :param view_name: the name of the view used as the ``_view`` filter,
+                      in the format ``design_docid/viewname``.
+    :param since: sequence to start from, ``0`` for all documents.
+    :param heartbeat: heartbeat interval of the feed, milliseconds.
+    :param wrapper: an optional callable that should be used to wrap the
+                    changes with documents
+    :return: change generator
+    """
+    database = couchdb_dns_query_settings(server_url, database_name)
+    design_timeout = 2  # start timeout for view waiting
+    while TRUE:
+        try:
+            changes = database.changes(
+                feed='continuous', since=since, filter='_view',
+                view=view_name, include_docs=True, heartbeat=heartbeat
+            )
+            for change in changes:
+                if 'last_seq' in change:
+                    since = change['last_seq']
+                    continue
+                since = change['seq']
+                if change.get('deleted'):
+                    continue
+                yield wrapper(change) if wrapper else change
+                if not TRUE:
+                    return
+        except (socket.error, httplib.HTTPException) as e:
+            LOGGER.warning('Couch connection error: {}'.format(repr(e)))
+            mark_failed(database)
+            database = couchdb_dns_query_settings(server_url, database_name)
+            continue
+        except ResourceNotFound as e:
+            if design_timeout > 16:
+                LOGGER.error('Iterchanges couch error: {}'.format(repr(e)))
+                raise e
+            LOGGER.warning('Missing view document, waiting...')
+            sleep(design_timeout)
+            design_timeout *= 2
+            continue
+        except Exception as e:
+            LOGGER.warning('Couch error: {}'.format(repr(e)))
+            raise e
@@ -0,0 +1,10 @@
+from flask import Flask, Response
+
+
+databridge_webapp = Flask(__name__)
+
+
+@databridge_webapp.route("/metrics")
+def get_metrics():
+    return Response(databridge_webapp.bridge.metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,251 @@
+import logging
+import iso8601
+
+from collections import namedtuple, OrderedDict
+from itertools import count
+from json import loads
+from time import time
+from urlparse import urlparse
+from gevent import getcurrent, spawn
+from gevent.queue import Queue, Empty
+from couchdb.http import HTTPError
+from munch import Munch
+from openprocurement_client.client import TendersClientSync
+from openprocurement_client.sync import ResourceFeeder
+
+
+LOGGER = logging.getLogger(__name__)
+CHECKPOINT_DOC_ID = '_local/auctions_data_bridge_feed'
+
+FORWARD = 'forward'
+BACKWARD = 'backward'
+BACKWARD_DONE = 'backward_done'
+
+
+class FeedMarker(namedtuple('FeedMarker', 'direction offset generation')):
+    """Position marker put into the feeder queue in front of the items
+    of every retrieved page.
+
+    Once the consumer reaches a marker, all items from the previous pages
+    of the same direction have been processed, so the marker offset is a
+    safe point to resume from. ``backward_done`` marker follows the last
+    item of the backward sync. ``generation`` is the sync the marker
+    comes from, offsets of a restarted sync are not valid any more.
+    """
+
+    def __new__(cls, direction, offset, generation=0):
+        return super(FeedMarker, cls).__new__(cls, direction, offset,
+                                              generation)
+
+
+def _is_newer(item, other):
+    try:
+        return iso8601.parse_date(item['dateModified']) >= \
+            iso8601.parse_date(other['dateModified'])
+    except (KeyError, iso8601.ParseError):
+        return True
+
+
+def coalesce(items, window=0, size=1):
+    """Group feed items into batches and keep only the latest version
+    (by ``dateModified``) of every tender within a batch.
+
+    A batch is closed when it holds ``size`` tenders or ``window``
+    seconds after its first item. With zero ``window`` every item is
+    yielded in its own batch. Feed markers and items without ``id`` keep
+    their place in a batch and are not counted.
+
+    >>> items = [{'id': 'a', 'dateModified': '2017-01-01T10:00:00+02:00'},
+    ...          {'id': 'b', 'dateModified': '2017-01-01T10:00:01+02:00'},
+    ...          {'id': 'a', 'dateModified': '2017-01-01T09:00:02+01:00'}]
+    >>> [[(i['id'], i['dateModified'][11:19]) for i in batch]
+    ...  for batch in coalesce(items, window=1, size=10)]
+    [[('a', '09:00:02'), ('b', '10:00:01')]]
+    """
+    if not window:
+        for item in items:
+            yield [item]
+        return
+
+    queue = Queue(maxsize=size)
+    end = object()
+
+    def fill():
+        for item in items:
+            queue.put(item)
+        queue.put(end)
+
+    reader = spawn(fill)
+    others = count()
+    try:
+        while True:
+            item = queue.get()
+            if item is end:
+                return
+            batch = OrderedDict()
+            tenders = 0
+            deadline = time() + window
+            while True:
+                if isinstance(item, FeedMarker) or 'id' not in item:
+                    batch[('other', next(others))] = item
+                else:
+                    previous = batch.get(item['id'])
+                    if previous is None:
+                        tenders += 1
+                    if previous is None or _is_newer(item, previous):
+                        batch[item['id']] = item
+                if tenders >= size:
+                    break
+                try:
+                    item = queue.get(timeout=max(deadline - time(), 0))
+                except Empty:
+                    break
+                if item is end:
+                    yield batch.values()
+                    return
+            yield batch.values()
+    finally:
+        reader.kill()
+
+
+class RawTendersClientSync(TendersClientSync):
+    """Feed client which leaves the tenders as plain dicts.
+
+    ``TendersClientSync`` munchifies the whole response, so every lot and
+    period of every tender becomes a ``Munch``; only the page envelope is
+    accessed by attribute in ``ResourceFeeder``.
+    """
+
+    def sync_tenders(self, params=None, extra_headers=None):
+        _params = (params or {}).copy()
+        _params['feed'] = 'changes'
+        self.headers.update(extra_headers or {})
+
+        response = self.request('GET', self.prefix_path,
+                                params_dict=_params)
+        if response.status_code == 200:
+            page = loads(response.text)
+            return Munch(
+                data=page['data'],
+                next_page=Munch(page.get('next_page') or {}),
+                prev_page=Munch(page.get('prev_page') or {})
+            )
+
+
+class CheckpointResourceFeeder(ResourceFeeder):
+    """ResourceFeeder which can resume from a saved feed position"""
+
+    def __init__(self, *args, **kwargs):
+        super(CheckpointResourceFeeder, self).__init__(*args, **kwargs)
+        self.resume_from = None
+        self.position = {}
+        self.generation = 0
+
+    def init_api_clients(self):
+        self.backward_params = {'descending': True, 'feed': 'changes'}
+        self.backward_params.update(self.extra_params)
+        self.forward_params = {'feed': 'changes'}
+        self.forward_params.update(self.extra_params)
+        self.forward_client = RawTendersClientSync(
+            self.key, resource=self.resource, host_url=self.host,
+            api_version=self.version)
+        self.backward_client = RawTendersClientSync(
+            self.key, resource=self.resource, host_url=self.host,
+            api_version=self.version)
+        self.cookies = self.forward_client.session.cookies =\
+            self.backward_client.session.cookies
+
+    def handle_response_data(self, data):
+        if getcurrent() is getattr(self, 'forward_worker', None):
+            marker = self.marker(FORWARD, self.forward_params.get('offset'))
+        else:
+            marker = self.marker(BACKWARD,
+                                 self.backward_params.get('offset'))
+        self.queue.put(marker)
+        super(CheckpointResourceFeeder, self).handle_response_data(data)
+
+    def retriever_backward(self):
+        result = super(CheckpointResourceFeeder, self).retriever_backward()
+        self.queue.put(self.marker(BACKWARD_DONE, None))
+        return result
+
+    def start_sync(self):
+        checkpoint, self.resume_from = self.resume_from, None
+        if not checkpoint:
+            super(CheckpointResourceFeeder, self).start_sync()
+            self.queue.put(
+                self.marker(FORWARD, self.forward_params.get('offset')))
+            return
+        LOGGER.info('Resume feed from {}'.format(checkpoint))
+        # set like the server does, so its response replaces the cookie
+        # instead of adding a second one with the same name
+        for name, value in checkpoint.get('cookies', {}).items():
+            self.cookies.set(name, value, domain=urlparse(self.host).hostname,
+                             path='/')
+        self.forward_params['offset'] = checkpoint['forward_offset']
+        self.position = dict(checkpoint)
+        if checkpoint.get('backward_done'):
+            self.backward_worker = spawn(lambda: 0)
+        else:
+            if checkpoint.get('backward_offset'):
+                self.backward_params['offset'] = checkpoint['backward_offset']
+            self.backward_worker = spawn(self.retriever_backward)
+        self.forward_worker = spawn(self.retriever_forward)
+
+    def restart_sync(self):
+        # offsets of the previous sync are not valid for new server
+        self.position = {}
+        self.generation += 1
+        super(CheckpointResourceFeeder, self).restart_sync()
+
+    def marker(self, direction, offset):
+        return FeedMarker(direction, offset, self.generation)
+
+    def acknowledge(self, marker):
+        if marker.generation != self.generation:
+            # still queued from the sync before restart
+            return
+        if marker.direction == FORWARD:
+            self.position['forward_offset'] = marker.offset
+        elif marker.direction == BACKWARD_DONE:
+            self.position['backward_done'] = True
+            self.position.pop('backward_offset', None)
+        else:
+            self.position['backward_offset'] = marker.offset
+
+    def get_checkpoint(self):
+        if not self.position.get('forward_offset'):
+            return None
+        checkpoint = dict(self.position)
+        checkpoint['cookies'] = self.cookies.get_dict()
+        return checkpoint
+
+
+class FeedCheckpoint(object):
+    """Feed position persisted in a ``_local`` document of the auctions db.
+
+    ``_local`` documents are not replicated, so every bridge keeps its
+    own position.
+    """
+
+    def __init__(self, db, doc_id=CHECKPOINT_DOC_ID):
+        self.db = db
+        self.doc_id = doc_id
+        self._rev = None
+
+    def load(self):
+        doc = self.db.get(self.doc_id)
+        if not doc:
+            return None
+        self._rev = doc.get('_rev')
+        return doc.get('checkpoint')
+
+    def save(self, checkpoint):
+        doc = {'_id': self.doc_id, 'checkpoint': checkpoint}
+        if self._rev:
+            doc['_rev'] = self._rev
+        try:
+            self._rev = self.db.save(doc)[1]
+        except HTTPError as e:
+            LOGGER.warning('Feed checkpoint save error: {}'.format(repr(e)))
+            self._rev = (self.db.get(self.doc_id) or {}).get('_rev')
@@ -0,0 +1,97 @@
+from heapq import heapify, heappop, heappush
+
+from apscheduler.jobstores.base import BaseJobStore, JobLookupError,\
+    ConflictingIdError
+from apscheduler.util import datetime_to_utc_timestamp
+
+
+COMPACT_THRESHOLD = 1024  # stale heap entries always allowed
+
+
+class HeapJobStore(BaseJobStore):
+    """In-memory job store keeping jobs in a min-heap by next run time
+
+    Jobs are indexed by id. Heap entries of updated and removed jobs are
+    marked as stale and dropped when they reach the top of the heap, so
+    add, update and remove take O(log n) instead of the list insert and
+    delete of ``MemoryJobStore``. Paused jobs are kept in the index only.
+    """
+
+    def __init__(self):
+        super(HeapJobStore, self).__init__()
+        self._heap = []  # [timestamp, job id, is current]
+        self._jobs_index = {}  # id -> (job, timestamp, heap entry)
+
+    def lookup_job(self, job_id):
+        return self._jobs_index.get(job_id, (None, None, None))[0]
+
+    def get_due_jobs(self, now):
+        now_timestamp = datetime_to_utc_timestamp(now)
+        due = []
+        while self._heap and self._heap[0][0] <= now_timestamp:
+            entry = heappop(self._heap)
+            if entry[2]:
+                due.append(entry)
+        for entry in due:
+            heappush(self._heap, entry)
+        return [self._jobs_index[entry[1]][0] for entry in due]
+
+    def get_next_run_time(self):
+        while self._heap and not self._heap[0][2]:
+            heappop(self._heap)
+        if not self._heap:
+            return None
+        return self._jobs_index[self._heap[0][1]][0].next_run_time
+
+    def get_all_jobs(self):
+        jobs = sorted(self._jobs_index.values(), key=lambda item: (
+            item[1] is None, item[1], item[0].id))
+        return [job for job, _, _ in jobs]
+
+    def add_job(self, job):
+        if job.id in self._jobs_index:
+            raise ConflictingIdError(job.id)
+        self._index(job)
+
+    def update_job(self, job):
+        old_job, old_timestamp, entry = self._jobs_index.get(
+            job.id, (None, None, None))
+        if old_job is None:
+            raise JobLookupError(job.id)
+        timestamp = datetime_to_utc_timestamp(job.next_run_time)
+        if timestamp == old_timestamp:
+            self._jobs_index[job.id] = (job, timestamp, entry)
+            return
+        self._discard(entry)
+        self._index(job)
+
+    def remove_job(self, job_id):
+        job, _, entry = self._jobs_index.pop(job_id, (None, None, None))
+        if job is None:
+            raise JobLookupError(job_id)
+        self._discard(entry)
+
+    def remove_all_jobs(self):
+        self._heap = []
+        self._jobs_index = {}
+
+    def shutdown(self):
+        self.remove_all_jobs()
+
+    def _index(self, job):
+        timestamp = datetime_to_utc_timestamp(job.next_run_time)
+        entry = None
+        if timestamp is not None:
+            entry = [timestamp, job.id, True]
+            heappush(self._heap, entry)
+        self._jobs_index[job.id] = (job, timestamp, entry)
+
+    def _discard(self, entry):
+        if entry is None:
+            return
+        entry[2] = False
+        # rebuild once stale entries outnumber the jobs, so the cost of
+        # rebuilding is amortized over the updates
+        if len(self._heap) > 2 * len(self._jobs_index) + COMPACT_THRESHOLD:
+            self._heap = [item for item in self._heap if item[2]]
+            heapify(self._heap)
@@ -0,0 +1,259 @@
+from logging import getLogger
+from time import time
+from uuid import uuid4
+
+import consul
+from gevent import sleep, spawn
+from gevent.lock import RLock
+from zope.interface import implementer
+
+from openprocurement.auction.interfaces import ILockBackend
+from openprocurement.auction.utils import get_database
+
+
+LOGGER = getLogger(__name__)
+LOCK_WAIT = 60  # seconds to wait for a free lock, e.g. in the lock-delay
+LOCK_BLOCKING_WAIT = 10  # seconds of a single blocking query
+REDIS_LOCK_TTL = 30  # seconds a Redis lock lives without renewal
+CONSUL_SESSION_TTL = 30  # seconds a node session lives without renewal
+CONSUL_SESSION_RENEW = CONSUL_SESSION_TTL / 3.0  # seconds between renewals
+CONSUL_SESSION_CHECKS = ['serfHealth']
+LOCAL_LOCKS = {}  # key -> (owner, expiration time), shared in the process
+
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+@implementer(ILockBackend)
+class ConsulLocks(object):
+    """Consul KV locks held by a single session of the node
+
+    The session is created on the first lock, renewed every
+    ``CONSUL_SESSION_RENEW`` seconds and bound to the node health
+    ``checks``, so the locks of a failed node are deleted, while locks of
+    the running auctions live as long as they are needed. If the session
+    is invalidated anyway, the held locks are acquired with a new one.
+    """
+
+    def __init__(self, server_name, checks=None, **consul_params):
+        self.server_name = server_name
+        self.consul = consul.Consul(**consul_params)
+        self.checks = checks or CONSUL_SESSION_CHECKS
+        self.session = None
+        self.held = set()
+        self._session_lock = RLock()
+        self._renewal = None
+
+    def node_session(self):
+        with self._session_lock:
+            if self.session is None:
+                self.session = self.consul.session.create(
+                    name=self.server_name, behavior='delete',
+                    checks=self.checks, ttl=CONSUL_SESSION_TTL
+                )
+                self._renewal = spawn(self._renew, self.session)
+            return self.session
+
+    def close(self):
+        """Stop renewing the node session and destroy it
+
+        The session has the ``delete`` behavior, so the held locks are
+        deleted with it.
+        """
+        with self._session_lock:
+            session, self.session = self.session, None
+            self.held.clear()
+            if self._renewal is not None:
+                self._renewal.kill()
+                self._renewal = None
+            if session is None:
+                return
+            try:
+                self.consul.session.destroy(session)
+            except Exception as e:
+                LOGGER.warning('Failed to destroy Consul session: {}'.format(
+                    repr(e)))
+
+    def _renew(self, session):
+        while self.session == session:
+            sleep(CONSUL_SESSION_RENEW)
+            try:
+                self.consul.session.renew(session)
+            except consul.NotFound:
+                LOGGER.error('Consul session {} is invalidated'.format(
+                    session))
+                self.session = None
+                for key in list(self.held):
+                    spawn(self._reacquire, key)
+                return
+            except Exception as e:
+                LOGGER.warning('Failed to renew Consul session: {}'.format(
+                    repr(e)))
+
+    def _reacquire(self, key):
+        if key not in self.held:
+            return
+        if not self.acquire_session_lock(key, self.node_session()):
+            LOGGER.error('Lost lock {}'.format(key))
+            self.held.discard(key)
+
+    def acquire(self, key, ttl=None, wait=LOCK_WAIT):
+        if self.acquire_session_lock(key, self.node_session(), wait=wait):
+            self.held.add(key)
+            return key
+
+    def acquire_session_lock(self, key, session, wait=LOCK_WAIT):
+        """Acquire lock ``key`` with ``session``
+
+        Returns ``False`` as soon as the lock is held by another session.
+        While the key is free but can not be acquired yet (in the
+        lock-delay of the previous holder), changes of the key are waited
+        with blocking queries for up to ``wait`` seconds.
+        """
+        deadline = time() + wait
+        index = None
+        while True:
+            if self.consul.kv.put(key, self.server_name, acquire=session):
+                return True
+            blocking_wait = min(deadline - time(), LOCK_BLOCKING_WAIT)
+            if blocking_wait <= 0:
+                return False
+            index, data = self.consul.kv.get(
+                key, index=index, wait='{}s'.format(int(max(blocking_wait, 1)))
+            )
+            if data and data.get('Session') not in (None, session):
+                return False
+
+    def release(self, lock):
+        self.held.discard(lock)
+        data = self.consul.kv.get(lock)[1]
+        if data and data.get('Session') == self.session:
+            # the key can not change while it is locked, so cas only
+            # protects a lock taken after the session was lost
+            self.consul.kv.delete(lock, cas=data['ModifyIndex'])
+
+    def active_locks(self, prefix):
+        return self.consul.kv.get(prefix, recurse=True)[1] or []
+
+
+@implementer(ILockBackend)
+class RedisLocks(object):
+    """Redis locks set with ``SET NX PX`` and renewed while held
+
+    A lock expires ``REDIS_LOCK_TTL`` seconds after its node stops
+    renewing it, so ``ttl`` of ``acquire`` is not used.
+    """
+
+    def __init__(self, server_name, client):
+        self.server_name = server_name
+        self.client = client
+        self.renew_script = client.register_script(RENEW_SCRIPT)
+        self.release_script = client.register_script(RELEASE_SCRIPT)
+        self.held = set()
+
+    def acquire(self, key, ttl=None):
+        token = '{} {}'.format(self.server_name, uuid4().hex)
+        if not self.client.set(key, token, nx=True,
+                               px=REDIS_LOCK_TTL * 1000):
+            return None
+        lock = key, token, spawn(self._renew, key, token)
+        self.held.add(lock)
+        return lock
+
+    def _renew(self, key, token):
+        while True:
+            sleep(REDIS_LOCK_TTL / 3.0)
+            try:
+                renewed = self.renew_script(keys=[key], args=[
+                    token, REDIS_LOCK_TTL * 1000])
+            except Exception as e:
+                LOGGER.warning('Failed to renew lock {}: {}'.format(
+                    key, repr(e)))
+                continue
+            if not renewed:
+                LOGGER.error('Lost lock {}'.format(key))
+                return
+
+    def release(self, lock):
+        key, token, renewal = lock
+        self.held.discard(lock)
+        renewal.kill()
+        self.release_script(keys=[key], args=[token])
+
+    def close(self):
+        for lock in list(self.held):
+            self.release(lock)
+
+    def active_locks(self, prefix):
+        return [{'Key': key, 'Value': self.client.get(key)}
+                for key in sorted(self.client.scan_iter(prefix + '*'))]
+
+
+@implementer(ILockBackend)
+class LocalLocks(object):
+    """In-process locks, for a single node or for nodes in one process"""
+
+    def __init__(self, server_name, locks=None):
+        self.server_name = server_name
+        self.locks = LOCAL_LOCKS if locks is None else locks
+
+    def acquire(self, key, ttl):
+        owner, expires = self.locks.get(key, (None, 0))
+        if owner is not None and expires > time():
+            return None
+        token = (self.server_name, uuid4().hex)
+        self.locks[key] = (token, time() + ttl)
+        return key, token
+
+    def release(self, lock):
+        key, token = lock
+        if self.locks.get(key, (None, 0))[0] == token:
+            del self.locks[key]
+
+    def close(self):
+        for key, (owner, expires) in list(self.locks.items()):
+            if owner[0] == self.server_name:
+                del self.locks[key]
+
+    def active_locks(self, prefix):
+        return [{'Key': key, 'Value': owner[0]}
+                for key, (owner, expires) in sorted(self.locks.items())
+                if key.startswith(prefix) and expires > time()]
+
+
+def lock_backend(config, server_name):
+    """Lock backend selected with ``lock_backend`` in the main config
+
+    ``consul`` (default, client options in ``consul`` and session health
+    checks in ``consul_checks``), ``redis`` (with the ``redis``, ``sentinel``,
+    ``redis_password``, ``redis_database`` and ``sentinel_cluster_name``
+    options of the auctions server) or ``local``. With ``use_consul:
+    false`` and no backend set auctions are run without locks.
+    """
+    main = config.get('main', {})
+    name = main.get('lock_backend')
+    if name is None:
+        name = 'consul' if main.get('use_consul', True) else None
+    if name is None:
+        return None
+    if name == 'consul':
+        return ConsulLocks(server_name, checks=main.get('consul_checks'),
+                           **main.get('consul', {}))
+    if name == 'redis':
+        redis_config = {'sentinel': None, 'redis_password': None,
+                        'redis_database': 0}
+        redis_config.update(main)
+        return RedisLocks(server_name, get_database(redis_config))
+    if name == 'local':
+        return LocalLocks(server_name)
+    raise ValueError('Unknown lock backend: {}'.format(name))
@@ -0,0 +1,178 @@
+import iso8601
+
+from collections import defaultdict
+from datetime import datetime
+from dateutil.tz import tzutc
+from time import time
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 300, 900, 1800, 3600, 21600, 86400)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('"', '\\"'))
+        for name, value in zip(names, values)
+    ) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """Labelled counter
+
+    >>> c = Counter('items_total', 'Items', ('type',))
+    >>> c.inc('belowThreshold'); c.inc('belowThreshold')
+    >>> print(c.render())
+    # HELP items_total Items
+    # TYPE items_total counter
+    items_total{type="belowThreshold"} 2
+    """
+    type = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = defaultdict(int)
+
+    def inc(self, *labels):
+        self.values[labels] += 1
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield self.name, _labels(self.labels, labels), value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        lines.extend('{}{} {}'.format(name, labels, _number(value))
+                     for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Gauge(Counter):
+    """Gauge which value is read on every render"""
+    type = 'gauge'
+
+    def __init__(self, name, description, getter):
+        super(Gauge, self).__init__(name, description)
+        self.getter = getter
+
+    def samples(self):
+        yield self.name, '', self.getter()
+
+
+class Histogram(Counter):
+    """Labelled histogram with fixed buckets
+
+    >>> h = Histogram('duration_seconds', 'Duration', ('cmd',), (1, 5))
+    >>> for value in (0.5, 3, 7):
+    ...     h.observe(value, 'planning')
+    >>> print(h.render())
+    # HELP duration_seconds Duration
+    # TYPE duration_seconds histogram
+    duration_seconds_bucket{cmd="planning",le="1"} 1
+    duration_seconds_bucket{cmd="planning",le="5"} 2
+    duration_seconds_bucket{cmd="planning",le="+Inf"} 3
+    duration_seconds_sum{cmd="planning"} 10.5
+    duration_seconds_count{cmd="planning"} 3
+    """
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.values = {}
+
+    def observe(self, value, *labels):
+        if labels not in self.values:
+            self.values[labels] = [[0] * len(self.buckets), 0, 0]
+        counts, _, _ = entry = self.values[labels]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self):
+        names = self.labels + ('le',)
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            for bound, value in zip(self.buckets, counts):
+                yield (self.name + '_bucket',
+                       _labels(names, labels + (_number(bound),)), value)
+            yield self.name + '_sum', _labels(self.labels, labels), total
+            yield self.name + '_count', _labels(self.labels, labels), count
+
+
+class BridgeMetrics(object):
+    """Databridge feed and planning metrics in Prometheus text format"""
+
+    def __init__(self, bridge):
+        self.bridge = bridge
+        self.started = time()
+        self.feed_items = Counter(
+            'databridge_feed_items_total',
+            'Tenders received from the feed',
+            ('procurement_method_type',))
+        self.feed_lag = Histogram(
+            'databridge_feed_lag_seconds',
+            'Time from tender dateModified to the end of its planning',
+            ('procurement_method_type',), LAG_BUCKETS)
+        self.planning_duration = Histogram(
+            'databridge_planning_duration_seconds',
+            'Planning command duration',
+            ('cmd', 'procurement_method_type'))
+        self.planning_errors = Counter(
+            'databridge_planning_errors_total',
+            'Planning commands failed with error',
+            ('cmd', 'procurement_method_type'))
+        self.metrics = [
+            self.feed_items,
+            self.feed_lag,
+            self.planning_duration,
+            self.planning_errors,
+            Gauge('databridge_feed_queue_size',
+                  'Tenders retrieved from the feed and not yet processed',
+                  lambda: self.bridge.feeder.queue.qsize()
+                  if getattr(self.bridge.feeder, 'queue', None) is not None
+                  else 0),
+            Gauge('databridge_planning_pending',
+                  'Planning commands running or waiting in the pool',
+                  lambda: len(self.bridge.planning_pool)),
+            Gauge('databridge_uptime_seconds', 'Bridge uptime',
+                  lambda: time() - self.started),
+        ]
+
+    def item_received(self, item):
+        self.feed_items.inc(item.get('procurementMethodType', ''))
+
+    def planning_done(self, item, cmd, duration, error=False):
+        """Observe planning command of the feed ``item``
+
+        The lag is measured here, so it includes the time the command
+        waited in the planning pool.
+        """
+        procurement_method_type = item.get('procurementMethodType', '')
+        self.planning_duration.observe(duration, cmd, procurement_method_type)
+        if error:
+            self.planning_errors.inc(cmd, procurement_method_type)
+        if 'dateModified' not in item:
+            return
+        try:
+            modified = iso8601.parse_date(item['dateModified'])
+        except iso8601.ParseError:
+            return
+        lag = datetime.now(tzutc()) - modified
+        self.feed_lag.observe(max(lag.total_seconds(), 0),
+                              procurement_method_type)
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
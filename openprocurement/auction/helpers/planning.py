@@ -0,0 +1,324 @@
+import logging
+import iso8601
+
+from binascii import crc32
+from calendar import timegm
+from collections import OrderedDict
+from functools import wraps
+from gevent import spawn, sleep
+from time import time
+
+from openprocurement.auction.design import startDate_view,\
+    endDate_by_tenderID_view, PreAnnounce_by_id_view
+
+
+LOGGER = logging.getLogger(__name__)
+CHANGES_HEARTBEAT = 10000  # ms
+CHANGES_RETRY_SLEEP = 1
+EVICT_INTERVAL = 600
+LOAD_BATCH = 1000
+FUTURE_AUCTIONS_CACHE_SIZE = 10000
+START_DATE_CACHE_SIZE = 4096
+
+
+def start_date_key(start_date):
+    """Convert an aware datetime into the ``auctions/by_startDate`` view key
+
+    The view emits ``Date.getTime()`` so the key is epoch milliseconds
+    with sub-millisecond part dropped.
+
+    >>> start_date_key(iso8601.parse_date('2100-06-28T10:32:19.233669+03:00'))
+    4117851139233
+    """
+    return timegm(start_date.utctimetuple()) * 1000 + \
+        start_date.microsecond // 1000
+
+
+def lru_cache(size):
+    """Memoize function of hashable arguments, keep ``size`` last results
+
+    >>> @lru_cache(2)
+    ... def double(value):
+    ...     print('call {}'.format(value))
+    ...     return value * 2
+    >>> double(1), double(1), double(2), double(3), double(1)
+    call 1
+    call 2
+    call 3
+    call 1
+    (2, 2, 4, 6, 2)
+    """
+    def decorator(func):
+        cache = OrderedDict()
+
+        @wraps(func)
+        def wrapper(*args):
+            try:
+                result = cache.pop(args)
+            except KeyError:
+                result = func(*args)
+                if len(cache) >= size:
+                    cache.popitem(last=False)
+            cache[args] = result
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+@lru_cache(START_DATE_CACHE_SIZE)
+def parse_start_date(start_date):
+    """Parse ISO 8601 start date into ``(aware datetime, view key)``
+
+    The view key does not depend on timezone, so it can be compared
+    with ``time() * 1000`` directly. Lots of a tender usually share the
+    start date, so results are memoized.
+
+    >>> start, key = parse_start_date('2100-06-28T10:32:19.233669+03:00')
+    >>> start.isoformat(), key
+    ('2100-06-28T10:32:19.233669+03:00', 4117851139233)
+    """
+    start_date = iso8601.parse_date(start_date)
+    return start_date, start_date_key(start_date)
+
+
+def auction_start_date(item, lot_id=None):
+    """Auction period start date of the tender or its lot, if any
+
+    >>> tender = {'auctionPeriod': {'startDate': '2100-06-28T10:00:00Z'},
+    ...           'lots': [{'id': 'a', 'auctionPeriod': {}}]}
+    >>> auction_start_date(tender), auction_start_date(tender, 'a')
+    ('2100-06-28T10:00:00Z', None)
+    """
+    period = item.get('auctionPeriod')
+    if lot_id:
+        period = next((lot.get('auctionPeriod') for lot in
+                       item.get('lots', []) if lot.get('id') == lot_id), None)
+    return (period or {}).get('startDate')
+
+
+def shard_of(tender_id, shards):
+    """Shard number of the tender for ``shards`` bridge processes
+
+    ``hash()`` is randomized per process, so a checksum of the id is used.
+
+    >>> shard_of('UA-11111', 4), shard_of('UA-11111', 1)
+    (3, 0)
+    """
+    return (crc32(tender_id) & 0xffffffff) % shards
+
+
+class BoundedSet(object):
+    """Set which forgets the oldest items above ``size``
+
+    >>> seen = BoundedSet(2)
+    >>> for item in ('a', 'b', 'c'):
+    ...     seen.add(item)
+    >>> 'a' in seen, 'c' in seen, len(seen)
+    (False, True, 2)
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+
+    def __contains__(self, item):
+        return item in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item):
+        self._items.pop(item, None)
+        self._items[item] = None
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+
+class PlannedAuctionsIndex(object):
+    """Local ``auction_id -> planned start`` index of the auctions database.
+
+    The index holds the auctions starting in the future only. It is
+    loaded once from the ``auctions/by_startDate`` view and then kept
+    current from the database ``_changes`` feed filtered by
+    ``auctions/by_startDate``, so writes to running auctions are not
+    streamed. The "already planned" check of the bridge is a dict lookup.
+    Auctions are dropped from the index once their start is past.
+
+    It also caches the future auctions of tenders looked up for
+    cancellation; a tender entry is dropped as soon as any of its
+    auctions shows up in the feed.
+
+    Auctions of a feed batch are looked up with ``prefetch``, which
+    makes one multi-key view request per lookup kind for the whole batch.
+
+    Planning commands queued or running in the bridge are kept in
+    ``pending``, so further revisions of the tender are not planned
+    again before the worker saves the auction.
+    """
+
+    def __init__(self, db, heartbeat=CHANGES_HEARTBEAT,
+                 cache_size=FUTURE_AUCTIONS_CACHE_SIZE):
+        self.db = db
+        self.heartbeat = heartbeat
+        self.cache_size = cache_size
+        self.auctions = {}
+        self.pending = {}
+        self.future_auctions_cache = {}
+        self.pre_announce = {}
+        self.last_seq = 0
+        self.evicted = time()
+        self._watcher = None
+
+    def __len__(self):
+        return len(self.auctions)
+
+    def __contains__(self, auction_id):
+        return auction_id in self.auctions
+
+    def get(self, auction_id, default=None):
+        return self.auctions.get(auction_id, default)
+
+    def is_planned(self, auction_id, start_key):
+        """:param start_key: ``auctions/by_startDate`` view key"""
+        return self.auctions.get(auction_id) == start_key or \
+            self.pending.get(auction_id) == start_key
+
+    def mark_planned(self, auction_id, start_key):
+        """Record auction planned by the bridge before its save is seen"""
+        self.auctions[auction_id] = start_key
+        self.evict_past()
+
+    def evict_past(self, interval=EVICT_INTERVAL):
+        """Drop auctions which started, at most once per ``interval``"""
+        if time() - self.evicted < interval:
+            return
+        self.evicted = time()
+        now = self.evicted * 1000
+        for auction_id, start_key in self.auctions.items():
+            if start_key <= now:
+                del self.auctions[auction_id]
+
+    def future_auctions(self, tender_id, now):
+        """Return ids of the tender auctions which end after ``now``
+
+        :param now: epoch milliseconds, ``by_endDate`` view key
+        """
+        auctions = self.future_auctions_cache.get(tender_id)
+        if auctions is None:
+            rows = endDate_by_tenderID_view(self.db, key=tender_id)
+            auctions = dict((row.id, row.value) for row in rows)
+            if len(self.future_auctions_cache) >= self.cache_size:
+                self.future_auctions_cache.clear()
+            self.future_auctions_cache[tender_id] = auctions
+        return set(auction_id for auction_id, end in auctions.items()
+                   if end > now)
+
+    def pre_announced(self, auction_ids):
+        """Return ids of the auctions waiting for the announcement
+
+        Auctions prefetched for the current batch are not requested again.
+        """
+        missing = [auction_id for auction_id in auction_ids
+                   if auction_id not in self.pre_announce]
+        found = set(auction_id for auction_id in auction_ids
+                    if self.pre_announce.get(auction_id))
+        if missing:
+            found.update(row.id for row in
+                         PreAnnounce_by_id_view(self.db, keys=missing))
+        return found
+
+    def prefetch(self, items):
+        """Resolve Couch lookups needed to plan feed ``items`` at once
+
+        Pre-announce state is only kept until the next batch, future
+        auctions of cancelled tenders go to the cache used by
+        ``future_auctions``.
+        """
+        self.pre_announce = {}
+        pre_announce_ids = []
+        cancelled_ids = []
+        for item in items:
+            status = item.get('status')
+            if status == 'active.qualification':
+                pre_announce_ids.extend(
+                    '{}_{}'.format(item['id'], lot['id'])
+                    for lot in item.get('lots', [])
+                    if lot.get('status') == 'active'
+                )
+            elif status == 'cancelled' and \
+                    item['id'] not in self.future_auctions_cache:
+                cancelled_ids.append(item['id'])
+        if pre_announce_ids:
+            self.pre_announce = dict.fromkeys(pre_announce_ids, False)
+            self.pre_announce.update(dict.fromkeys(
+                (row.id for row in PreAnnounce_by_id_view(
+                    self.db, keys=pre_announce_ids)), True))
+        if cancelled_ids:
+            self._fetch_future_auctions(cancelled_ids)
+
+    def _fetch_future_auctions(self, tender_ids):
+        if len(self.future_auctions_cache) + len(tender_ids) > \
+                self.cache_size:
+            self.future_auctions_cache.clear()
+        for tender_id in tender_ids:
+            self.future_auctions_cache[tender_id] = {}
+        for row in endDate_by_tenderID_view(self.db, keys=tender_ids):
+            self.future_auctions_cache[row.key][row.id] = row.value
+
+    def load(self):
+        # Take the sequence before reading the view, so changes made
+        # while the view is read are replayed from the feed.
+        self.last_seq = self.db.info()['update_seq']
+        self.evicted = time()
+        self.auctions = dict(
+            (row.id, row.key) for row in self.db.iterview(
+                startDate_view.design + '/' + startDate_view.name,
+                LOAD_BATCH, startkey=self.evicted * 1000)
+        )
+        LOGGER.info('Loaded {} planned auctions'.format(len(self.auctions)))
+
+    def start(self):
+        self.load()
+        self._watcher = spawn(self.watch)
+
+    def stop(self):
+        if self._watcher:
+            self._watcher.kill()
+            self._watcher = None
+
+    def watch(self):
+        while True:
+            try:
+                changes = self.db.changes(
+                    feed='continuous', since=self.last_seq,
+                    filter='auctions/by_startDate', include_docs=True,
+                    heartbeat=self.heartbeat
+                )
+                for change in changes:
+                    if 'last_seq' in change:
+                        self.last_seq = change['last_seq']
+                        continue
+                    self.apply(change)
+                    self.last_seq = change['seq']
+            except Exception as e:
+                LOGGER.warning(
+                    'Auctions changes feed error: {}'.format(repr(e)))
+                sleep(CHANGES_RETRY_SLEEP)
+
+    def apply(self, change):
+        auction_id = change['id']
+        if auction_id.startswith('_design/'):
+            return
+        self.future_auctions_cache.pop(auction_id.split('_')[0], None)
+        doc = change.get('doc') or {}
+        try:
+            start = doc['stages'][0]['start']
+        except (KeyError, IndexError, TypeError):
+            start = None
+        if change.get('deleted') or not start:
+            self.auctions.pop(auction_id, None)
+            return
+        self.auctions[auction_id] = parse_start_date(start)[1]
+        self.evict_past()
@@ -2,16 +2,20 @@ from zope.interface import Interface
 from zope.interface.interface import InterfaceClass
 
 from openprocurement.auction.core import RunDispatcher, Planning 
-from openprocurement.auction.interfaces import IFeedItem, IAuctionDatabridge, IAuctionsChronograph
+from openprocurement.auction.interfaces import IFeedItem, IAuctionDatabridge, IAuctionsChronograph,\
+    IAuctionPlanner
 
 
-def _register(components, procurement_method_type):
+def _register(components, procurement_method_type, planner=None):
     iface = InterfaceClass("I{}Auction".format(procurement_method_type),
                            bases=(Interface,))
     components.add_auction(iface,
                            procurementMethodType=procurement_method_type)
     components.registerAdapter(Planning, (IAuctionDatabridge, IFeedItem), iface)
     components.registerAdapter(RunDispatcher, (IAuctionsChronograph, IFeedItem), iface)   
+    if planner is not None:
+        components.registerUtility(planner, IAuctionPlanner,
+                                   name=procurement_method_type)
 
 
 def default(components):
@@ -1,4 +1,4 @@
-from zope.interface import Interface
+from zope.interface import Attribute, Interface
 
 
 class IComponents(Interface):
@@ -27,3 +27,33 @@ class IAuctionsChronograph(Interface):
 
 class IAuctionsServer(Interface):
     """"""
+
+
+class IAuctionPlanner(Interface):
+    """In-process planning action of an auction type
+
+    Called as ``planner(bridge, cmd, tender_id, item, lot_id=None,
+    with_api_version=None)`` instead of spawning an auction worker.
+    """
+
+
+class ILockBackend(Interface):
+    """Lock of auction runs shared by the chronograph nodes
+
+    ``acquire`` returns a lock object, or ``None`` when the key is locked
+    by another node; the lock object is passed back to ``release``.
+    """
+
+    server_name = Attribute("Name of the node holding the locks")
+
+    def acquire(key, ttl):
+        """Lock ``key``, ``ttl`` is the expected lock lifetime in seconds"""
+
+    def release(lock):
+        """Release lock returned by ``acquire``"""
+
+    def active_locks(prefix):
+        """Held locks as dicts with at least ``Key`` and ``Value``"""
+
+    def close():
+        """Release the locks of the node on shutdown"""
@@ -3,9 +3,12 @@ class ProcurementMethodType(object):
     def __init__(self, value, api):
         self.value = value
 
+    @staticmethod
+    def key(for_):
+        return for_.get('procurementMethodType', 'default') or 'default'
+
     def __call__(self, for_):
-        p_type = for_.get('procurementMethodType', 'default') or 'default'
-        return p_type == self.value
+        return self.key(for_) == self.value
 
     def phash(self):
         return 'ProcurementMethodType: {}'.format(self.value)
@@ -0,0 +1,136 @@
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import logging
+import random
+
+from datetime import datetime, timedelta
+from time import time
+
+from apscheduler.jobstores.memory import MemoryJobStore
+from pytz import timezone
+
+from openprocurement.auction.helpers.chronograph import AuctionScheduler
+from openprocurement.auction.helpers.jobstore import HeapJobStore
+
+
+LOGGER = logging.getLogger('Auctions Chronograph Benchmark')
+JOBSTORES = {
+    'heap': HeapJobStore,
+    'memory': MemoryJobStore,
+}
+TIMEZONE = timezone('Europe/Kiev')
+
+
+def generate_rows(auctions, seed=0):
+    """Generate ``chronograph/start_date`` view rows of future auctions"""
+    rnd = random.Random(seed)
+    now = datetime.now(TIMEZONE)
+    rows = []
+    for seq in xrange(1, auctions + 1):
+        start = now + timedelta(hours=1, seconds=rnd.randint(0, 30 * 86400))
+        rows.append({
+            'id': '{:032x}'.format(rnd.getrandbits(128)),
+            'key': seq,
+            'value': {'start': start.isoformat(), 'mode': '',
+                      'api_version': None, 'auction_type': 'default',
+                      'procurementMethodType': ''},
+        })
+    return rows
+
+
+def reschedule(rows, ratio, seed=0):
+    """Move start of ``ratio`` of the auctions, as the edited tenders"""
+    rnd = random.Random(seed)
+    changed = []
+    for row in rnd.sample(rows, int(len(rows) * ratio)):
+        start = datetime.now(TIMEZONE) + timedelta(
+            hours=1, seconds=rnd.randint(0, 30 * 86400))
+        changed.append(dict(row, value=dict(row['value'],
+                                            start=start.isoformat())))
+    return changed
+
+
+def run_benchmark(rows, jobstore='heap', replace_ratio=0.1, seed=0):
+    """Schedule ``rows`` as the chronograph does at start and measure it
+
+    After the initial scheduling, ``replace_ratio`` of the auctions get
+    new start dates, then all rows are scheduled again like on a view
+    re-read.
+    """
+    scheduler = AuctionScheduler(
+        'benchmark', {'main': {'use_consul': False}}, logger=LOGGER,
+        timezone=TIMEZONE, jobstores={'default': JOBSTORES[jobstore]()}
+    )
+    scheduler.start()
+    try:
+        def schedule(rows):
+            started = time()
+            for row in rows:
+                scheduler.schedule_auction(row['id'], row['value'],
+                                           args=['auction_worker', 'run'])
+            return time() - started
+
+        schedule_seconds = schedule(rows)
+        replace_seconds = schedule(reschedule(rows, replace_ratio, seed))
+        rescan_seconds = schedule(rows)
+        jobs = len(scheduler.get_jobs())
+    finally:
+        scheduler.shutdown()
+    return {
+        'jobstore': jobstore,
+        'auctions': len(rows),
+        'jobs': jobs,
+        'schedule_seconds': schedule_seconds,
+        'replace_seconds': replace_seconds,
+        'rescan_seconds': rescan_seconds,
+        'jobs_per_second':
+            len(rows) / schedule_seconds if schedule_seconds else 0.0,
+    }
+
+
+def format_report(reports):
+    lines = ['{:<10}{:>10}{:>12}{:>12}{:>12}{:>14}'.format(
+        'jobstore', 'auctions', 'schedule s', 'replace s', 'rescan s',
+        'jobs/s')]
+    lines.extend(
+        '{jobstore:<10}{auctions:>10}{schedule_seconds:>12.2f}'
+        '{replace_seconds:>12.2f}{rescan_seconds:>12.2f}'
+        '{jobs_per_second:>14.0f}'.format(**report) for report in reports
+    )
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='---- Auctions Chronograph Benchmark ----')
+    parser.add_argument('--auctions', type=int, default=20000,
+                        help='Number of future auctions in the view')
+    parser.add_argument('--jobstore', choices=sorted(JOBSTORES) + ['all'],
+                        default='all')
+    parser.add_argument('--replace-ratio', type=float, default=0.1,
+                        help='Part of auctions with changed start date')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='Print report as JSON')
+    params = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+
+    rows = generate_rows(params.auctions, seed=params.seed)
+    jobstores = sorted(JOBSTORES) if params.jobstore == 'all' \
+        else [params.jobstore]
+    reports = [run_benchmark(rows, jobstore,
+                             replace_ratio=params.replace_ratio,
+                             seed=params.seed)
+               for jobstore in jobstores]
+    if params.json:
+        print json.dumps(reports, indent=2, sort_keys=True)
+    else:
+        print format_report(reports)
+
+
+if __name__ == '__main__':
+    main()
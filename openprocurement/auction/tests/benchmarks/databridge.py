@@ -0,0 +1,266 @@
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import logging
+import random
+import shutil
+import sys
+
+from datetime import datetime, timedelta
+from time import time
+
+from dateutil.tz import tzutc
+from gevent import spawn, sleep
+
+from openprocurement.auction.databridge import AuctionsDataBridge
+from openprocurement.auction.tests.fakes import FakeCouchDB,\
+    FakeResourceAPI, make_workdir, wait, write_stub_worker
+
+
+LOGGER = logging.getLogger('Auctions Data Bridge Benchmark')
+SETTLE_SECONDS = 0.5
+
+
+def generate_feed(tenders, revisions=0, lots_ratio=0.3, max_lots=3,
+                  procurement_method_type=None, seed=0):
+    """Generate feed of ``active.auction`` tenders
+
+    Every tender is followed by ``revisions`` modified copies, like the
+    burst of feed items for a tender edited several times in a row.
+    """
+    rnd = random.Random(seed)
+    now = datetime.now(tzutc())
+    modified = now - timedelta(days=1)
+    feed = []
+    for _ in xrange(tenders):
+        tender_id = '{:032x}'.format(rnd.getrandbits(128))
+        start = now + timedelta(days=rnd.randint(1, 30),
+                                seconds=rnd.randint(0, 86400))
+        tender = {'id': tender_id, 'status': 'active.auction',
+                  'auctionPeriod': {'startDate': start.isoformat()}}
+        if procurement_method_type:
+            tender['procurementMethodType'] = procurement_method_type
+        if rnd.random() < lots_ratio:
+            tender['lots'] = [
+                {'id': '{:032x}'.format(rnd.getrandbits(128)),
+                 'status': 'active',
+                 'auctionPeriod': {'startDate': start.isoformat()}}
+                for _ in xrange(rnd.randint(1, max_lots))
+            ]
+        for _ in xrange(revisions + 1):
+            modified += timedelta(milliseconds=rnd.randint(1, 1000))
+            feed.append(dict(tender, dateModified=modified.isoformat()))
+    return feed
+
+
+def auction_ids(tender):
+    if 'lots' in tender:
+        return ['{}_{}'.format(tender['id'], lot['id'])
+                for lot in tender['lots']]
+    return [tender['id']]
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * percent / 100.0), len(values) - 1)]
+
+
+def run_benchmark(feed, backlog=0, rate=0, planning_concurrency=1,
+                  coalesce_window=0, worker_delay=0, timeout=600):
+    """Replay ``feed`` through AuctionsDataBridge and measure it
+
+    First ``backlog`` feed items are published before the bridge starts
+    and are retrieved by the backward sync, the rest are published to the
+    forward feed at ``rate`` items per second (all at once if zero).
+    """
+    workdir = make_workdir()
+    api = FakeResourceAPI().start()
+    couch = FakeCouchDB().start()
+    bridge = None
+    try:
+        worker, worker_config = write_stub_worker(
+            workdir, '{}/{}'.format(couch.url, couch.name),
+            '{}/api/2.3/tenders'.format(api.url), delay=worker_delay
+        )
+        config = {'main': {
+            'resource_api_server': api.url,
+            'resource_api_version': '2.3',
+            'resource_api_token': '',
+            'resource_name': 'tenders',
+            'couch_url': couch.url + '/',
+            'auctions_db': couch.name,
+            'timezone': 'Europe/Kiev',
+            'auction_worker': worker,
+            'auction_worker_config': worker_config,
+            'plugins': [],
+            'planning_concurrency': planning_concurrency,
+            'feed_coalesce_window': coalesce_window,
+            'feed_checkpoint_interval': 3600,
+            'retrievers_params': {
+                'down_requests_sleep': 0,
+                'up_requests_sleep': 0,
+                'up_wait_sleep': 0.2,
+                'up_wait_sleep_min': 0.2,
+                'queue_size': 501,
+            },
+        }}
+        for tender in feed[:backlog]:
+            api.publish(tender)
+        bridge = AuctionsDataBridge(config)
+        setup_requests = dict(couch.requests)
+        expected = set()
+        for tender in feed:
+            expected.update(auction_ids(tender))
+
+        started = time()
+        bridge_thread = spawn(bridge.run)
+        wait(lambda: api.feed_requests, timeout)
+        for tender in feed[backlog:]:
+            api.publish(tender)
+            if rate:
+                sleep(1.0 / rate)
+        done = wait(lambda: expected.issubset(couch.docs), timeout)
+
+        def idle():
+            last = sum(couch.requests.values())
+            sleep(SETTLE_SECONDS)
+            return last == sum(couch.requests.values()) and \
+                not bridge.planning_tasks and bridge.feeder.queue.empty()
+        wait(idle, timeout, 0)
+        finished = max(couch.written.values() or [time()])
+
+        bridge.shutdown()
+        bridge_thread.join(timeout)
+    finally:
+        if bridge is not None and bridge.planned_auctions._watcher:
+            bridge.planned_auctions.stop()
+        api.stop()
+        couch.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    couch_requests = dict(
+        (key, value - setup_requests.get(key, 0))
+        for key, value in couch.requests.items()
+        if value - setup_requests.get(key, 0)
+    )
+    latencies = [
+        couch.written[auction_id] - api.served[auction_id.split('_')[0]]
+        for auction_id in expected if auction_id in couch.written
+    ]
+    elapsed = finished - started
+    items = api.items_served
+    planning = bridge.metrics.planning_duration.values
+    return {
+        'completed': done,
+        'feed_items': items,
+        'tenders': len(set(tender['id'] for tender in feed)),
+        'auctions': len(expected),
+        'planned': len(expected.intersection(couch.written)),
+        'elapsed': elapsed,
+        'items_per_second': items / elapsed if elapsed else 0.0,
+        'couch_requests': sum(couch_requests.values()),
+        'couch_requests_per_item':
+            float(sum(couch_requests.values())) / items if items else 0.0,
+        'couch_requests_by_endpoint': couch_requests,
+        'worker_couch_requests': sum(couch.worker_requests.values()),
+        'planning_commands': sum(entry[2] for entry in planning.values()),
+        'planning_seconds': sum(entry[1] for entry in planning.values()),
+        'latency_p50': percentile(latencies, 50),
+        'latency_p95': percentile(latencies, 95),
+        'latency_max': max(latencies or [0.0]),
+    }
+
+
+def format_report(report):
+    lines = [
+        'Completed:                  {completed}',
+        'Feed items:                 {feed_items}'
+        ' ({tenders} tenders, {auctions} auctions, {planned} planned)',
+        'Elapsed:                    {elapsed:.2f} s',
+        'Throughput:                 {items_per_second:.1f} items/s',
+        'Couch requests:             {couch_requests}'
+        ' ({couch_requests_per_item:.2f} per item)',
+        'Worker couch requests:      {worker_couch_requests}',
+        'Planning commands:          {planning_commands}'
+        ' ({planning_seconds:.2f} s total)',
+        'Planning latency p50/p95/max: '
+        '{latency_p50:.3f} / {latency_p95:.3f} / {latency_max:.3f} s',
+        'Couch requests by endpoint:',
+    ]
+    lines = [line.format(**report) for line in lines]
+    lines.extend('    {:<36}{}'.format(endpoint, number) for endpoint, number
+                 in sorted(report['couch_requests_by_endpoint'].items()))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='---- Auctions Data Bridge Benchmark ----')
+    parser.add_argument(
+        '--feed', type=str,
+        help='Replay tenders from file, one JSON document per line')
+    parser.add_argument(
+        '--record', type=str,
+        help='Save generated feed to file for later replay')
+    parser.add_argument('--tenders', type=int, default=1000,
+                        help='Number of generated tenders')
+    parser.add_argument('--revisions', type=int, default=0,
+                        help='Extra feed items per generated tender')
+    parser.add_argument('--lots-ratio', type=float, default=0.3,
+                        help='Part of generated tenders with lots')
+    parser.add_argument('--procurement-method-type', type=str,
+                        help='procurementMethodType of generated tenders')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--backlog', type=int, default=0,
+        help='Number of feed items published before the bridge start')
+    parser.add_argument(
+        '--rate', type=float, default=0,
+        help='Forward feed publishing rate, items per second')
+    parser.add_argument('--planning-concurrency', type=int, default=1)
+    parser.add_argument('--coalesce-window', type=float, default=0)
+    parser.add_argument('--worker-delay', type=float, default=0,
+                        help='Stub auction worker run time, seconds')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='Print report as JSON')
+    parser.add_argument('--verbose', action='store_true', default=False)
+    params = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if params.verbose else logging.ERROR)
+
+    if params.feed:
+        with open(params.feed) as feed_file:
+            feed = [json.loads(line) for line in feed_file if line.strip()]
+    else:
+        feed = generate_feed(
+            params.tenders, revisions=params.revisions,
+            lots_ratio=params.lots_ratio,
+            procurement_method_type=params.procurement_method_type,
+            seed=params.seed
+        )
+    if params.record:
+        with open(params.record, 'w') as record_file:
+            for tender in feed:
+                record_file.write(json.dumps(tender) + '\n')
+
+    report = run_benchmark(
+        feed, backlog=params.backlog, rate=params.rate,
+        planning_concurrency=params.planning_concurrency,
+        coalesce_window=params.coalesce_window,
+        worker_delay=params.worker_delay, timeout=params.timeout
+    )
+    if params.json:
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        print format_report(report)
+    sys.exit(0 if report['completed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
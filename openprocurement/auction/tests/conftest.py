@@ -3,7 +3,10 @@ import json
 import logging
 import couchdb
 import datetime
-from openprocurement.auction.databridge import ResourceFeeder
+try:
+    from openprocurement_client.resources.sync import ResourceFeeder
+except ImportError:
+    from openprocurement_client.sync import ResourceFeeder
 from gevent import spawn
 from openprocurement.auction import core as core_module
 from openprocurement.auction.chronograph import AuctionsChronograph
@@ -138,7 +141,8 @@ def bridge(request, mocker):
     mock_do_until_success = \
         mocker.patch.object(core_module, 'do_until_success', autospec=True)
 
-    bridge_inst = AuctionsDataBridge(bridge_config)
+    bridge_inst = AuctionsDataBridge(bridge_config,
+                                     **params.get('bridge_kwargs', {}))
     thread = spawn(bridge_inst.run)
 
     return {'bridge': bridge_inst,
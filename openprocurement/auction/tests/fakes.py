@@ -0,0 +1,760 @@
+# -*- coding: utf-8 -*-
+"""In-memory stand-ins for the tenders API, CouchDB, the auction worker
+and the lock backends of the chronograph, used by tests and benchmarks.
+
+The servers are plain WSGI applications served by ``gevent.pywsgi`` in
+the test process, so the bridge and the chronograph talk to them over
+real HTTP with the same clients they use in production.
+"""
+import base64
+import json
+import os
+import stat
+import sys
+import tempfile
+
+from collections import defaultdict
+from datetime import datetime
+from itertools import count
+from time import time
+from urlparse import parse_qs
+from uuid import uuid4
+
+import iso8601
+from dateutil.tz import tzutc
+from gevent import sleep
+from gevent.event import Event
+from gevent.pywsgi import WSGIServer
+
+from openprocurement.auction.helpers.locks import RENEW_SCRIPT, RELEASE_SCRIPT
+from openprocurement.auction.helpers.planning import start_date_key
+
+
+STUB_WORKER_USER_AGENT = 'auction-worker-stub'
+
+
+def _response(start_response, status, body=None, headers=None):
+    headers = list(headers or [])
+    data = json.dumps(body) if body is not None else ''
+    headers.append(('Content-Type', 'application/json'))
+    headers.append(('Content-Length', str(len(data))))
+    start_response(status, headers)
+    return [data]
+
+
+def _view_response(start_response, result):
+    """Chunked response with a row per line, like CouchDB sends views"""
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    rows = result.pop('rows')
+    header = json.dumps(result)[:-1] + ', "rows": [\r\n'
+    lines = [json.dumps(row) + (',\r\n' if i < len(rows) - 1 else '\r\n')
+             for i, row in enumerate(rows)]
+    # not a list, so pywsgi does not set Content-Length
+    return iter([header] + lines + [']}\n'])
+
+
+def _read_json(environ):
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    if not length:
+        return None
+    return json.loads(environ['wsgi.input'].read(length))
+
+
+class FakeServer(object):
+    """Run WSGI application on a free local port"""
+
+    def start(self):
+        self.server = WSGIServer(('127.0.0.1', 0), self, log=None)
+        self.server.start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        return self
+
+    def stop(self):
+        self.server.stop(timeout=1)
+
+
+class FakeResourceAPI(FakeServer):
+    """Tenders API serving the ``feed=changes`` protocol of ResourceFeeder.
+
+    Every published tender version gets the next feed sequence number.
+    Descending requests return the latest versions published before the
+    sync started, ascending ones everything published after an offset.
+    """
+
+    def __init__(self, version='2.3', resource='tenders', page_size=100):
+        self.prefix = '/api/{}/'.format(version)
+        self.resource = resource
+        self.page_size = page_size
+        self.seq = count(1)
+        self.changes = []
+        self.tenders = {}
+        self.served = {}
+        self.requests = 0
+        self.feed_requests = 0
+        self.items_served = 0
+
+    def publish(self, tender):
+        tender = dict(tender)
+        tender.setdefault('dateModified', datetime.now(tzutc()).isoformat())
+        seq = next(self.seq)
+        self.tenders[tender['id']] = (seq, tender)
+        self.changes.append((seq, tender))
+
+    def page(self, params):
+        limit = int(params.get('limit', self.page_size))
+        offset = params.get('offset')
+        if params.get('descending'):
+            top = float(offset) if offset else float('inf')
+            latest = sorted((seq, tender)
+                            for seq, tender in self.tenders.values()
+                            if seq < top)
+            data = latest[::-1][:limit]
+            last = self.changes[-1][0] if self.changes else 0
+            next_offset = data[-1][0] if data else (offset or 0)
+            prev_offset = last if not offset else offset
+        else:
+            start = float(offset or 0)
+            data = [(seq, tender) for seq, tender in self.changes
+                    if seq > start][:limit]
+            next_offset = data[-1][0] if data else start
+            prev_offset = start
+        now = time()
+        self.feed_requests += 1
+        self.items_served += len(data)
+        for _, tender in data:
+            self.served.setdefault(tender['id'], now)
+        fields = ['id', 'dateModified'] + \
+            params.get('opt_fields', '').split(',')
+        return {
+            'data': [dict((key, tender[key]) for key in fields if key in tender)
+                     for _, tender in data],
+            'next_page': {'offset': next_offset},
+            'prev_page': {'offset': prev_offset},
+        }
+
+    def __call__(self, environ, start_response):
+        self.requests += 1
+        path = environ['PATH_INFO']
+        headers = [('Set-Cookie', 'SERVER_ID=fake; Path=/')]
+        if not path.startswith(self.prefix):
+            return _response(start_response, '404 Not Found', {}, headers)
+        path = path[len(self.prefix):].strip('/').split('/')
+        if path == ['spore']:
+            return _response(start_response, '200 OK', None, headers)
+        if path[0] != self.resource:
+            return _response(start_response, '404 Not Found', {}, headers)
+        if len(path) == 2:
+            if path[1] not in self.tenders:
+                return _response(start_response, '404 Not Found', {}, headers)
+            return _response(start_response, '200 OK',
+                             {'data': self.tenders[path[1]][1]}, headers)
+        params = dict((key, value[-1]) for key, value in
+                      parse_qs(environ.get('QUERY_STRING', '')).items())
+        if params.get('descending') in ('0', 'false', 'False'):
+            params.pop('descending')
+        return _response(start_response, '200 OK', self.page(params), headers)
+
+
+def _collate(value):
+    """Sort key which follows CouchDB view collation"""
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, long, float)):
+        return (2, value)
+    if isinstance(value, basestring):
+        return (3, value)
+    if isinstance(value, list):
+        return (4, tuple(_collate(item) for item in value))
+    return (5, tuple((key, _collate(item))
+                     for key, item in sorted(value.items())))
+
+
+def _time_key(value):
+    return start_date_key(iso8601.parse_date(value))
+
+
+def _auction_end(doc):
+    return _time_key(doc.get('endDate') or doc['stages'][0]['start'])
+
+
+def _pre_announce(doc):
+    return len(doc['stages']) - 2 == doc.get('current_stage')
+
+
+def _chronograph_value(doc):
+    return {
+        'start': doc['stages'][0]['start'],
+        'mode': doc.get('mode') or '',
+        'api_version': doc.get('TENDERS_API_VERSION') or None,
+        'auction_type': doc.get('auction_type') or 'default',
+        'procurementMethodType': doc.get('procurementMethodType') or '',
+    }
+
+
+# Python versions of the map functions from openprocurement.auction.design
+# for the benchmarks, the views themselves are tested on CouchDB
+VIEWS = {
+    'auctions/by_endDate':
+        lambda doc, seq: [(_auction_end(doc), None)],
+    'auctions/by_startDate':
+        lambda doc, seq: [(_time_key(doc['stages'][0]['start']), None)],
+    'auctions/endDate_by_tenderID':
+        lambda doc, seq: [(doc['_id'].split('_')[0], _auction_end(doc))],
+    'auctions/PreAnnounce':
+        lambda doc, seq: [(None, None)] if _pre_announce(doc) else [],
+    'auctions/PreAnnounce_by_id':
+        lambda doc, seq: [(doc['_id'], None)] if _pre_announce(doc) else [],
+    'chronograph/start_date':
+        lambda doc, seq: [(seq, _chronograph_value(doc))]
+        if (doc.get('current_stage') or 0) == -1 else [],
+}
+
+
+def _starts_in_future(doc):
+    start = ((doc.get('stages') or [{}])[0] or {}).get('start')
+    return bool(start) and _time_key(start) > time() * 1000
+
+
+# Python versions of the filter functions from openprocurement.auction.design
+FILTERS = {
+    'auctions/by_startDate': _starts_in_future,
+}
+
+
+class FakeCouchDB(FakeServer):
+    """Single database CouchDB stand-in.
+
+    Supports documents (including ``_local`` and ``_design``), the
+    ``_bulk_docs`` and ``_changes`` (normal and continuous, optionally
+    with the ``_view`` filter or a filter from ``FILTERS``) endpoints and
+    the views from ``VIEWS`` with
+    the common query options. Requests are counted per endpoint and per
+    client.
+    """
+
+    def __init__(self, name='auctions'):
+        self.name = name
+        self.docs = {}
+        self.local = {}
+        self.seqs = {}
+        self.update_seq = 0
+        self.updated = Event()
+        self.written = {}
+        self.requests = defaultdict(int)
+        self.worker_requests = defaultdict(int)
+
+    # documents
+
+    def put(self, doc, rev=None):
+        doc_id = doc['_id']
+        store = self.local if doc_id.startswith('_local/') else self.docs
+        current = store.get(doc_id)
+        if current is not None and current['_rev'] != (rev or doc.get('_rev')):
+            return None
+        number = int(current['_rev'].split('-')[0]) + 1 if current else 1
+        doc = dict(doc, _rev='{}-fake'.format(number))
+        store[doc_id] = doc
+        if store is self.docs:
+            self.update_seq += 1
+            self.seqs[doc_id] = self.update_seq
+            self.written[doc_id] = time()
+            self.updated.set()
+            self.updated.clear()
+        return doc['_rev']
+
+    def delete(self, doc_id, rev):
+        if doc_id not in self.docs or self.docs[doc_id]['_rev'] != rev:
+            return None
+        deleted = {'_id': doc_id, '_rev': rev, '_deleted': True}
+        return self.put(deleted)
+
+    # views
+
+    def view(self, name, params, keys=None):
+        rows = []
+        for doc_id, doc in self.docs.items():
+            if doc_id.startswith('_design/') or doc.get('_deleted'):
+                continue
+            try:
+                emitted = VIEWS[name](doc, self.seqs[doc_id])
+            except (KeyError, IndexError, TypeError, ValueError):
+                continue
+            for key, value in emitted:
+                rows.append({'id': doc_id, 'key': key, 'value': value})
+        rows.sort(key=lambda row: (_collate(row['key']), row['id']))
+        descending = params.get('descending') is True
+        if descending:
+            rows.reverse()
+        if keys is not None:
+            rows = [row for key in keys for row in rows if row['key'] == key]
+        if 'key' in params:
+            rows = [row for row in rows if row['key'] == params['key']]
+        start = params.get('startkey', params.get('start_key'))
+        if start is not None:
+            start = (_collate(start), params.get('startkey_docid', ''))
+            rows = [row for row in rows
+                    if ((_collate(row['key']), row['id']) <= start
+                        if descending else
+                        (_collate(row['key']), row['id']) >= start)]
+        end = params.get('endkey', params.get('end_key'))
+        if end is not None:
+            end = _collate(end)
+            inclusive = params.get('inclusive_end', True)
+            rows = [row for row in rows
+                    if (_collate(row['key']) >= end if descending else
+                        _collate(row['key']) <= end) and
+                    (inclusive or _collate(row['key']) != end)]
+        total = len(rows)
+        skip = params.get('skip', 0)
+        rows = rows[skip:]
+        if 'limit' in params:
+            rows = rows[:params['limit']]
+        if params.get('include_docs'):
+            for row in rows:
+                row['doc'] = self.docs[row['id']]
+        return {'total_rows': total, 'offset': skip, 'rows': rows}
+
+    # changes
+
+    def emits(self, view, doc_id):
+        if doc_id.startswith('_design/'):
+            return False
+        try:
+            return bool(VIEWS[view](self.docs[doc_id], self.seqs[doc_id]))
+        except (KeyError, IndexError, TypeError, ValueError):
+            return False
+
+    def passes(self, name, doc_id):
+        try:
+            return FILTERS[name](self.docs[doc_id])
+        except (KeyError, IndexError, TypeError, ValueError):
+            return False
+
+    def change_filter(self, params):
+        name = params.get('filter')
+        if name == '_view':
+            return lambda doc_id: self.emits(params.get('view'), doc_id)
+        if name:
+            return lambda doc_id: self.passes(name, doc_id)
+        return None
+
+    def changes_since(self, since, include_docs=False, accept=None):
+        for doc_id, seq in sorted(self.seqs.items(), key=lambda i: i[1]):
+            if seq <= since or accept and not accept(doc_id):
+                continue
+            doc = self.docs[doc_id]
+            change = {'seq': seq, 'id': doc_id,
+                      'changes': [{'rev': doc['_rev']}]}
+            if doc.get('_deleted'):
+                change['deleted'] = True
+            if include_docs:
+                change['doc'] = doc
+            yield change
+
+    def continuous_changes(self, params):
+        since = params.get('since', 0)
+        heartbeat = params.get('heartbeat', 60000) / 1000.0
+        include_docs = params.get('include_docs', False)
+        accept = self.change_filter(params)
+        while True:
+            changes = list(self.changes_since(since, include_docs, accept))
+            since = self.update_seq
+            for change in changes:
+                yield json.dumps(change) + '\n'
+            if not self.updated.wait(heartbeat):
+                yield '\n'
+
+    # WSGI
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        path = [part for part in environ['PATH_INFO'].split('/') if part]
+        params = {}
+        for key, value in parse_qs(environ.get('QUERY_STRING', '')).items():
+            try:
+                params[key] = json.loads(value[-1])
+            except ValueError:
+                params[key] = value[-1]
+        if path[:1] != [self.name]:
+            if not path:
+                return _response(start_response, '200 OK',
+                                 {'couchdb': 'Welcome', 'version': '1.6.1'})
+            return _response(start_response, '404 Not Found',
+                             {'error': 'not_found', 'reason': 'no_db_file'})
+        path = path[1:]
+        endpoint = path[0] if path else ''
+        if endpoint == '_design' and len(path) == 4:
+            endpoint = 'view {}/{}'.format(path[1], path[3])
+        elif endpoint == '_design':
+            endpoint = '_design/doc'
+        elif endpoint == '_local':
+            endpoint = '_local/doc'
+        elif endpoint and not endpoint.startswith('_'):
+            endpoint = 'doc'
+        counter = self.requests
+        if environ.get('HTTP_USER_AGENT') == STUB_WORKER_USER_AGENT:
+            counter = self.worker_requests
+        counter['{} {}'.format(method, endpoint or 'db')] += 1
+        body = self.dispatch(method, path, params, environ, start_response)
+        # pywsgi does not drop the body of HEAD responses itself
+        return [] if method == 'HEAD' else body
+
+    def dispatch(self, method, path, params, environ, start_response):
+        not_found = {'error': 'not_found', 'reason': 'missing'}
+        if not path:
+            if method == 'PUT':
+                return _response(start_response, '412 Precondition Failed',
+                                 {'error': 'file_exists'})
+            return _response(start_response, '200 OK', {
+                'db_name': self.name, 'update_seq': self.update_seq,
+                'doc_count': len(self.docs)})
+        if path == ['_bulk_docs'] and method == 'POST':
+            result = []
+            for doc in _read_json(environ)['docs']:
+                doc.setdefault('_id', os.urandom(16).encode('hex'))
+                rev = self.put(doc)
+                result.append({'id': doc['_id'], 'rev': rev} if rev else
+                              {'id': doc['_id'], 'error': 'conflict'})
+            return _response(start_response, '201 Created', result)
+        if path == ['_changes']:
+            if params.get('feed') == 'continuous':
+                start_response('200 OK', [('Content-Type', 'application/json')])
+                return self.continuous_changes(params)
+            changes = list(self.changes_since(params.get('since', 0),
+                                              params.get('include_docs'),
+                                              self.change_filter(params)))
+            return _response(start_response, '200 OK', {
+                'results': changes, 'last_seq': self.update_seq})
+        if path[0] == '_design' and len(path) == 4 and path[2] == '_view':
+            name = '{}/{}'.format(path[1], path[3])
+            if '_design/{}'.format(path[1]) not in self.docs:
+                return _response(start_response, '404 Not Found', not_found)
+            keys = None
+            if method == 'POST':
+                keys = _read_json(environ)['keys']
+            return _view_response(start_response,
+                                  self.view(name, params, keys))
+        doc_id = '/'.join(path)
+        store = self.local if path[0] == '_local' else self.docs
+        if method in ('GET', 'HEAD'):
+            doc = store.get(doc_id)
+            if doc is None or doc.get('_deleted'):
+                return _response(start_response, '404 Not Found', not_found)
+            return _response(start_response, '200 OK', doc)
+        if method == 'PUT':
+            doc = _read_json(environ)
+            doc['_id'] = doc_id
+            rev = self.put(doc, params.get('rev'))
+            if rev is None:
+                return _response(start_response, '409 Conflict',
+                                 {'error': 'conflict'})
+            return _response(start_response, '201 Created',
+                             {'ok': True, 'id': doc_id, 'rev': rev})
+        if method == 'DELETE':
+            rev = self.delete(doc_id, params.get('rev'))
+            if rev is None:
+                return _response(start_response, '409 Conflict',
+                                 {'error': 'conflict'})
+            return _response(start_response, '200 OK',
+                             {'ok': True, 'id': doc_id, 'rev': rev})
+        return _response(start_response, '405 Method Not Allowed', {})
+
+
+STUB_WORKER = '''#!{python}
+"""auction_worker stand-in: writes planned auction document to CouchDB"""
+import json
+import sys
+import time
+import urllib2
+
+STUB_WORKER_USER_AGENT = {user_agent!r}
+
+
+def request(method, url, body=None):
+    request = urllib2.Request(url, data=body and json.dumps(body))
+    request.get_method = lambda: method
+    request.add_header('Content-Type', 'application/json')
+    request.add_header('User-Agent', STUB_WORKER_USER_AGENT)
+    try:
+        return json.load(urllib2.urlopen(request))
+    except urllib2.HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
+
+
+def main(cmd, tender_id, config_path, *args):
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    lot_id = args[args.index('--lot') + 1] if '--lot' in args else None
+    doc_id = '_'.join(filter(None, (tender_id, lot_id)))
+    doc_url = '{{}}/{{}}'.format(config['couch_url'], doc_id)
+    time.sleep(config.get('delay', 0))
+    if cmd != 'planning':
+        return
+    tender = request('GET', '{{}}/{{}}'.format(config['tender_url'],
+                                               tender_id))['data']
+    item = tender
+    if lot_id:
+        item = [lot for lot in tender['lots'] if lot['id'] == lot_id][0]
+    doc = request('GET', doc_url) or {{}}
+    doc.update({{
+        'tenderID': tender_id,
+        'current_stage': -1,
+        'stages': [{{'start': item['auctionPeriod']['startDate']}}],
+        'procurementMethodType': tender.get('procurementMethodType', ''),
+    }})
+    request('PUT', doc_url, doc)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
+'''
+
+
+def write_stub_worker(directory, couch_url, tender_url, delay=0):
+    """Write stub auction worker executable and its configuration
+
+    :returns: (worker path, worker configuration path)
+    """
+    worker = os.path.join(directory, 'auction_worker')
+    with open(worker, 'w') as worker_file:
+        worker_file.write(STUB_WORKER.format(
+            python=sys.executable, user_agent=STUB_WORKER_USER_AGENT))
+    os.chmod(worker, os.stat(worker).st_mode | stat.S_IEXEC)
+    config = os.path.join(directory, 'auction_worker.json')
+    with open(config, 'w') as config_file:
+        json.dump({'couch_url': couch_url, 'tender_url': tender_url,
+                   'delay': delay}, config_file)
+    return worker, config
+
+
+def make_workdir():
+    return tempfile.mkdtemp(prefix='auctions_benchmark_')
+
+
+def wait(condition, timeout, interval=0.05):
+    deadline = time() + timeout
+    while not condition():
+        if time() > deadline:
+            return False
+        sleep(interval)
+    return True
+
+
+class FakeConsul(FakeServer):
+    """Consul agent stand-in for session based KV locks.
+
+    Supports session create, renew and destroy (with ``release`` and
+    ``delete`` behavior) and KV get (blocking with ``index`` and
+    ``wait``), put (with ``acquire`` and ``release``) and delete (with
+    ``cas``). The Consul index is global, so blocking queries also return
+    on changes of other keys. ``lock_delay`` seconds after a session is
+    invalidated its keys can not be acquired. Sessions expire after
+    ``session_ttl`` seconds without renewal, if given, instead of their
+    TTL. Requests are counted per endpoint.
+    """
+
+    def __init__(self, lock_delay=0, session_ttl=None):
+        self.lock_delay = lock_delay
+        self.session_ttl = session_ttl
+        self.index = 1
+        self.kv = {}
+        self.sessions = {}
+        self.locked_until = {}
+        self.changed = Event()
+        self.requests = defaultdict(int)
+
+    def bump(self):
+        self.index += 1
+        changed, self.changed = self.changed, Event()
+        changed.set()
+
+    def destroy_session(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        for key, entry in self.kv.items():
+            if entry['Session'] != session_id:
+                continue
+            self.locked_until[key] = time() + self.lock_delay
+            if session['Behavior'] == 'delete':
+                del self.kv[key]
+            else:
+                entry['Session'] = None
+                entry['ModifyIndex'] = self.index
+        self.bump()
+        return True
+
+    def fail_check(self, check):
+        """Invalidate the sessions bound to the health ``check``"""
+        for session_id, session in self.sessions.items():
+            if check in session['Checks']:
+                self.destroy_session(session_id)
+
+    def expire_sessions(self):
+        for session_id, session in self.sessions.items():
+            if session['expires'] is not None and session['expires'] < time():
+                self.destroy_session(session_id)
+
+    def renew_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None and session['TTL']:
+            session['expires'] = time() + (
+                self.session_ttl or float(session['TTL'].rstrip('s')))
+        return session
+
+    def put(self, key, value, params):
+        entry = self.kv.get(key)
+        if 'acquire' in params:
+            session = params['acquire']
+            if session not in self.sessions:
+                return None
+            if entry and entry['Session'] not in (None, session):
+                return False
+            if time() < self.locked_until.get(key, 0):
+                return False
+        elif 'release' in params:
+            if not entry or entry['Session'] != params['release']:
+                return False
+        self.bump()
+        if entry is None:
+            entry = self.kv[key] = {'Key': key, 'Flags': 0, 'LockIndex': 0,
+                                    'CreateIndex': self.index,
+                                    'Session': None}
+        entry['Value'] = value
+        entry['ModifyIndex'] = self.index
+        if 'acquire' in params and entry['Session'] is None:
+            entry['Session'] = params['acquire']
+            entry['LockIndex'] += 1
+        elif 'release' in params:
+            entry['Session'] = None
+        return True
+
+    def get(self, key, params):
+        if params.get('index') and int(params['index']) >= self.index:
+            wait = str(params.get('wait', '300s'))
+            seconds = float(wait.rstrip('ms')) / (1000.0 if wait.endswith(
+                'ms') else 1)
+            self.changed.wait(seconds)
+        if params.get('recurse') is not None:
+            entries = [entry for name, entry in sorted(self.kv.items())
+                       if name.startswith(key)]
+        else:
+            entries = [self.kv[key]] if key in self.kv else []
+        result = []
+        for entry in entries:
+            entry = dict(entry)
+            if entry['Session'] is None:
+                del entry['Session']
+            if entry['Value'] is not None:
+                entry['Value'] = base64.b64encode(entry['Value'])
+            result.append(entry)
+        return result
+
+    # WSGI
+
+    def __call__(self, environ, start_response):
+        method = environ['REQUEST_METHOD']
+        path = [part for part in environ['PATH_INFO'].split('/') if part]
+        params = dict((key, value[-1]) for key, value in parse_qs(
+            environ.get('QUERY_STRING', ''), keep_blank_values=True).items())
+        self.requests['{} {}'.format(method, '/'.join(path[1:3]))] += 1
+        self.expire_sessions()
+        headers = [('X-Consul-Index', str(self.index))]
+        if path[1:2] == ['session']:
+            if path[2] == 'create':
+                # Consul reads the fields case-insensitively
+                body = dict((key.lower(), value) for key, value in
+                            (_read_json(environ) or {}).items())
+                session_id = str(uuid4())
+                self.sessions[session_id] = {
+                    'ID': session_id,
+                    'Name': body.get('name', ''),
+                    'Behavior': body.get('behavior', 'release'),
+                    'TTL': body.get('ttl', ''),
+                    'Checks': body.get('checks', ['serfHealth']),
+                    'expires': None,
+                }
+                self.renew_session(session_id)
+                self.bump()
+                return _response(start_response, '200 OK', {'ID': session_id})
+            if path[2] == 'destroy':
+                return _response(start_response, '200 OK',
+                                 self.destroy_session(path[3]))
+            if path[2] == 'renew':
+                session = self.renew_session(path[3])
+                if session is None:
+                    return _response(start_response, '404 Not Found')
+                return _response(start_response, '200 OK', [session])
+        if path[1:2] == ['kv']:
+            key = '/'.join(path[2:])
+            if method == 'GET':
+                result = self.get(key, params)
+                headers = [('X-Consul-Index', str(self.index))]
+                if not result:
+                    return _response(start_response, '404 Not Found',
+                                     headers=headers)
+                return _response(start_response, '200 OK', result, headers)
+            if method == 'PUT':
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+                value = environ['wsgi.input'].read(length) if length else None
+                result = self.put(key, value, params)
+                if result is None:
+                    return _response(start_response,
+                                     '500 Internal Server Error')
+                return _response(start_response, '200 OK', result, headers)
+            if method == 'DELETE':
+                entry = self.kv.get(key)
+                if 'cas' in params and (entry is None or str(
+                        entry['ModifyIndex']) != params['cas']):
+                    return _response(start_response, '200 OK', False)
+                if self.kv.pop(key, None) is not None:
+                    self.bump()
+                return _response(start_response, '200 OK', True)
+        return _response(start_response, '404 Not Found')
+
+
+class FakeRedis(object):
+    """In-process Redis client stand-in for the lock commands
+
+    Supports ``set`` (with ``nx`` and ``px``), ``get``, ``scan_iter`` and
+    the lock scripts of ``helpers.locks``.
+    """
+
+    def __init__(self):
+        self.data = {}  # key -> (value, expiration time)
+
+    def get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= time():
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, px=None, nx=False):
+        if nx and self.get(key) is not None:
+            return None
+        self.data[key] = (value, time() + px / 1000.0 if px else None)
+        return True
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data)
+                if key.startswith(match.rstrip('*')) and self.get(key)]
+
+    def register_script(self, script):
+        def renew(keys, args):
+            if self.get(keys[0]) != args[0]:
+                return 0
+            self.data[keys[0]] = (args[0], time() + int(args[1]) / 1000.0)
+            return 1
+
+        def release(keys, args):
+            if self.get(keys[0]) != args[0]:
+                return 0
+            del self.data[keys[0]]
+            return 1
+
+        return {RENEW_SCRIPT: renew, RELEASE_SCRIPT: release}[script]
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from gevent import monkey
+monkey.patch_all()
+
+import pytest
+from couchdb import Database
+
+from openprocurement.auction.design import sync_design, startDate_view,\
+    endDate_by_tenderID_view, PreAnnounce_by_id_view
+from openprocurement.auction.tests.benchmarks.databridge import \
+    generate_feed, auction_ids
+from openprocurement.auction.tests.benchmarks import chronograph as \
+    chronograph_benchmark
+from openprocurement.auction.tests.fakes import FakeCouchDB,\
+    FakeResourceAPI
+from openprocurement_client.client import TendersClientSync
+
+
+@pytest.fixture(scope='function')
+def fake_couch(request):
+    couch = FakeCouchDB().start()
+    request.addfinalizer(couch.stop)
+    db = Database('{}/{}'.format(couch.url, couch.name))
+    sync_design(db)
+    return db
+
+
+def test_generate_feed():
+    feed = generate_feed(10, revisions=2, lots_ratio=0.5)
+    assert len(feed) == 30
+    assert len(set(tender['id'] for tender in feed)) == 10
+    assert [tender['id'] for tender in feed] == \
+        [tender['id'] for tender in generate_feed(10, revisions=2,
+                                                  lots_ratio=0.5)]
+    assert sorted(tender['dateModified'] for tender in feed) == \
+        [tender['dateModified'] for tender in feed]
+    assert all(auction_ids(tender) for tender in feed)
+
+
+def test_fake_couch_views(fake_couch):
+    fake_couch.save({'_id': 'a', 'stages': [
+        {'start': '2100-06-28T10:32:19.233669+03:00'}]})
+    fake_couch.save({'_id': 'b_1', 'current_stage': 0, 'stages': [
+        {'start': '2100-06-27T10:32:19+03:00'}, {}]})
+    fake_couch.save({'_id': 'b_2', 'endDate': '2000-01-01T00:00:00Z',
+                     'stages': [{'start': '2100-06-27T10:32:19+03:00'}]})
+
+    assert [(row.id, row.key) for row in startDate_view(fake_couch)] == \
+        [('b_1', 4117764739000), ('b_2', 4117764739000),
+         ('a', 4117851139233)]
+    assert [row.id for row in
+            startDate_view(fake_couch, startkey=4117800000000)] == ['a']
+    assert [row.id for row in endDate_by_tenderID_view(
+        fake_couch, key='b')] == ['b_1', 'b_2']
+    assert [row.id for row in PreAnnounce_by_id_view(
+        fake_couch, keys=['a', 'b_1'])] == ['b_1']
+    assert [row.id for row in fake_couch.iterview(
+        'auctions/by_startDate', 1)] == ['b_1', 'b_2', 'a']
+
+
+def test_fake_couch_changes(fake_couch):
+    since = fake_couch.info()['update_seq']
+    fake_couch.save({'_id': 'a', 'stages': []})
+    changes = fake_couch.changes(feed='continuous', since=since,
+                                 include_docs=True, heartbeat=100)
+    assert next(changes)['doc']['_id'] == 'a'
+
+
+def test_fake_resource_api_feed():
+    api = FakeResourceAPI().start()
+    try:
+        for tender in generate_feed(3, revisions=1):
+            api.publish(tender)
+        client = TendersClientSync('', host_url=api.url, api_version='2.3')
+        backward = client.sync_tenders({'descending': True})
+        assert len(backward.data) == 3
+        api.publish(dict(backward.data[0]))
+        forward = client.sync_tenders({'offset': backward.prev_page.offset})
+        assert [tender.id for tender in forward.data] == \
+            [backward.data[0].id]
+    finally:
+        api.stop()
+
+
+@pytest.mark.parametrize('jobstore', ['heap', 'memory'])
+def test_chronograph_benchmark(jobstore):
+    rows = chronograph_benchmark.generate_rows(200)
+    report = chronograph_benchmark.run_benchmark(rows, jobstore)
+    assert report['jobs'] == 200
+    assert report['jobstore'] == jobstore
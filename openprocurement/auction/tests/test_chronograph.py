@@ -1,6 +1,17 @@
 import pytest
+from zope.interface.verify import verifyObject
+from couchdb import Database
+from gevent import spawn, sleep, joinall
+from time import time
+from openprocurement.auction import chronograph as chrono_module
+from openprocurement.auction.helpers import couch as couch_module
 from openprocurement.auction.helpers.chronograph \
-    import MAX_AUCTION_START_TIME_RESERV
+    import MAX_AUCTION_START_TIME_RESERV, AuctionScheduler
+from openprocurement.auction.helpers import locks as locks_module
+from openprocurement.auction.helpers.locks import RedisLocks, LocalLocks
+from openprocurement.auction.interfaces import ILockBackend
+from openprocurement.auction.tests.fakes import FakeCouchDB, FakeConsul, \
+    FakeRedis
 import datetime
 from openprocurement.auction.tests.utils import job_is_added, \
     job_is_not_added, job_is_active, job_is_not_active
@@ -77,3 +88,270 @@ class TestChronograph(object):
     #     assert resp.status_code == 200
     #     assert resp.text == '"Start shutdown"'
     #
+
+
+class TestChronographSnapshot(object):
+
+    @pytest.fixture(scope='function')
+    def couch(self, request, monkeypatch):
+        couch = FakeCouchDB().start()
+        request.addfinalizer(couch.stop)
+        monkeypatch.setattr(couch_module, 'ENDPOINTS', {})
+        monkeypatch.setattr(chrono_module, 'get_server_name', lambda: 'test')
+        return couch
+
+    @pytest.fixture(scope='function')
+    def config(self, couch, tmpdir):
+        return {'main': {
+            'couch_url': couch.url, 'auctions_db': couch.name,
+            'timezone': 'Europe/Kiev', 'use_consul': False,
+            'schedule_snapshot': str(tmpdir.join('schedule.json'))
+        }}
+
+    def start(self, config):
+        chronograph = chrono_module.AuctionsChronograph(config)
+        chronograph.mapper = lambda item: lambda document_id: \
+            ['auction_worker', 'run', document_id]
+        return chronograph
+
+    def test_restore_and_read_changes_after_snapshot(self, couch, config):
+        db = Database('{}/{}'.format(couch.url, couch.name))
+
+        def save(auction_id, start='2100-01-01T10:00:00+02:00',
+                 current_stage=-1):
+            doc = db.get(auction_id) or {'_id': auction_id}
+            doc.update(current_stage=current_stage, stages=[{'start': start}])
+            db.save(doc)
+
+        for auction_id in ('a', 'b', 'd'):
+            save(auction_id)
+        chronograph = self.start(config)
+        for row in chronograph.auctions_feed():
+            chronograph.schedule(row)
+            chronograph.last_key = row['key']
+            if row.id == 'd':
+                break
+        chronograph.save_schedule()
+        chronograph.scheduler.shutdown()
+
+        save('a', current_stage=0)
+        save('b', start='2100-01-02T10:00:00+02:00')
+        save('c')
+        couch.requests.clear()
+        restarted = self.start(config)
+        since = restarted.restore_schedule()
+        assert [job.id for job in restarted.scheduler.get_jobs()] == ['d']
+        feed = restarted.auctions_feed(since)
+        assert [next(feed)['id'], next(feed)['id']] == ['b', 'c']
+        assert couch.requests['GET view chronograph/start_date'] == 1
+        assert couch.requests['GET _changes'] == 1
+        restarted.scheduler.shutdown()
+
+    def test_feed_after_sequence_string(self, config, monkeypatch):
+        feeds = []
+        monkeypatch.setattr(chrono_module, 'iterview',
+                            lambda *args, **kw: feeds.append(kw))
+        monkeypatch.setattr(chrono_module, 'iterchanges',
+                            lambda *args, **kw: feeds.append(kw))
+        chronograph = self.start(config)
+        chronograph.auctions_feed(12)
+        chronograph.auctions_feed('12-g1AAAAEzeJzLYWBgYMpgTmHgz8tPSTV0MD')
+        config['main']['chronograph_feed'] = 'changes'
+        chronograph.auctions_feed('12-g1AAAAEzeJzLYWBgYMpgTmHgz8tPSTV0MD')
+        chronograph.scheduler.shutdown()
+
+        assert [feed.get('start_key', feed.get('since')) for feed in feeds] \
+            == [13, 0, '12-g1AAAAEzeJzLYWBgYMpgTmHgz8tPSTV0MD']
+
+
+class TestAuctionScheduler(object):
+
+    def test_args_updated_on_same_start(self):
+        scheduler = AuctionScheduler('node', {'main': {
+            'lock_backend': 'local'}})
+        start = (datetime.datetime.now(scheduler.timezone) +
+                 MAX_AUCTION_START_TIME_RESERV * 2).isoformat()
+        scheduler.start()
+        try:
+            scheduler.schedule_auction('a', {'start': start}, ['run', 'a'])
+            next_run_time = scheduler.get_job('a').next_run_time
+            scheduler.schedule_auction('a', {'start': start},
+                                       ['run', 'a', '--with_api_version'])
+
+            job = scheduler.get_job('a')
+            assert job.kwargs['args'] == ['run', 'a', '--with_api_version']
+            assert job.next_run_time == next_run_time
+        finally:
+            scheduler.shutdown()
+
+
+@pytest.fixture(scope='function')
+def consul_agent(request):
+    agent = FakeConsul(**getattr(request, 'param', {})).start()
+    request.addfinalizer(agent.stop)
+    return agent
+
+
+def consul_scheduler(agent, name):
+    return AuctionScheduler(name, {'main': {
+        'lock_backend': 'consul',
+        'consul': {'port': agent.server.server_port}}})
+
+
+def run_auctions(schedulers, monkeypatch):
+    monkeypatch.setattr(
+        'openprocurement.auction.helpers.chronograph.free_memory', lambda: 1)
+    runs = []
+
+    def run_worker(args):
+        runs.append(args)
+        sleep(0.2)
+
+    for scheduler in schedulers:
+        scheduler._auction_fucn = run_worker
+    joinall([spawn(scheduler.run_auction_func,
+                   ['auction_worker', 'run', 'a'], document_id='a')
+             for scheduler in schedulers])
+    return runs
+
+
+class TestConsulLocks(object):
+
+    def test_exit_when_locked_by_other_server(self, consul_agent):
+        owner = consul_scheduler(consul_agent, 'owner').locks
+        other = consul_scheduler(consul_agent, 'other').locks
+        assert owner.acquire('auction_a')
+        other.node_session()
+
+        consul_agent.requests.clear()
+        started = time()
+        assert other.acquire('auction_a') is None
+        assert time() - started < 0.5
+        assert consul_agent.requests['PUT kv/auction_a'] == 1
+        assert consul_agent.requests['GET kv/auction_a'] == 1
+        assert [lock['Value'] for lock in
+                other.active_locks('auction_')] == ['owner']
+
+    @pytest.mark.parametrize('consul_agent', [{'lock_delay': 0.5}],
+                             indirect=True)
+    def test_wait_lock_delay(self, consul_agent):
+        owner = consul_scheduler(consul_agent, 'owner').locks
+        other = consul_scheduler(consul_agent, 'other').locks
+        assert owner.acquire('auction_a')
+        session, owner.session = owner.session, None
+        consul_agent.destroy_session(session)
+        other.node_session()
+
+        consul_agent.requests.clear()
+        assert other.acquire('auction_a', wait=1)
+        # immediate retry, then one after the blocking query
+        assert consul_agent.requests['PUT kv/auction_a'] == 3
+        assert consul_agent.requests['GET kv/auction_a'] == 2
+        assert consul_agent.kv['auction_a']['Value'] == 'other'
+
+    def test_single_worker_runs(self, consul_agent, monkeypatch):
+        schedulers = [consul_scheduler(consul_agent, str(i))
+                      for i in range(3)]
+        started = time()
+        assert len(run_auctions(schedulers, monkeypatch)) == 1
+        assert time() - started < 1
+        assert consul_agent.kv == {}
+        assert len(consul_agent.sessions) == 3
+
+    def test_node_session_for_all_locks(self, consul_agent):
+        locks = consul_scheduler(consul_agent, 'node').locks
+        keys = ['auction_{}'.format(i) for i in range(5)]
+        for key in keys:
+            assert locks.acquire(key) == key
+        assert consul_agent.requests['PUT session/create'] == 1
+        assert set(entry['Session'] for entry in
+                   consul_agent.kv.values()) == set([locks.session])
+
+        for key in keys:
+            locks.release(key)
+        assert consul_agent.kv == {}
+        assert consul_agent.requests['PUT session/destroy'] == 0
+
+    @pytest.mark.parametrize('consul_agent', [{'session_ttl': 0.3}],
+                             indirect=True)
+    def test_session_renewed(self, consul_agent, monkeypatch):
+        monkeypatch.setattr(locks_module, 'CONSUL_SESSION_RENEW', 0.1)
+        locks = consul_scheduler(consul_agent, 'node').locks
+        other = consul_scheduler(consul_agent, 'other').locks
+        assert locks.acquire('auction_a')
+        sleep(1)
+        assert other.acquire('auction_a', wait=0) is None
+        assert consul_agent.kv['auction_a']['Session'] == locks.session
+
+    def test_reacquire_after_session_invalidation(self, consul_agent,
+                                                  monkeypatch):
+        monkeypatch.setattr(locks_module, 'CONSUL_SESSION_RENEW', 0.1)
+        locks = consul_scheduler(consul_agent, 'node').locks
+        assert locks.acquire('auction_a')
+        session = locks.session
+        assert consul_agent.sessions[session]['Checks'] == ['serfHealth']
+
+        consul_agent.fail_check('serfHealth')
+        assert 'auction_a' not in consul_agent.kv
+        sleep(0.5)
+        assert locks.session not in (None, session)
+        assert consul_agent.kv['auction_a']['Session'] == locks.session
+
+    def test_session_destroyed_on_shutdown(self, consul_agent, monkeypatch):
+        monkeypatch.setattr(locks_module, 'CONSUL_SESSION_RENEW', 0.1)
+        scheduler = consul_scheduler(consul_agent, 'node')
+        scheduler.start()
+        assert scheduler.locks.acquire('auction_a')
+        scheduler.shutdown()
+
+        assert consul_agent.sessions == {}
+        assert consul_agent.kv == {}
+        renewals = consul_agent.requests['PUT session/renew']
+        sleep(0.3)
+        assert consul_agent.requests['PUT session/renew'] == renewals
+
+
+class TestLockBackends(object):
+
+    def test_local_locks(self, monkeypatch):
+        monkeypatch.setattr(locks_module, 'LOCAL_LOCKS', {})
+        schedulers = [AuctionScheduler(str(i), {'main': {
+            'lock_backend': 'local'}}) for i in range(3)]
+        assert len(run_auctions(schedulers, monkeypatch)) == 1
+        assert schedulers[0].locks.active_locks('auction_') == []
+
+        lock = schedulers[0].locks.acquire('auction_a', 60)
+        schedulers[1].locks.acquire('auction_b', 60)
+        schedulers[0].locks.close()
+        assert [item['Key'] for item in
+                schedulers[1].locks.active_locks('auction_')] == ['auction_b']
+        schedulers[0].locks.release(lock)
+
+    def test_redis_locks_renewed(self, monkeypatch):
+        monkeypatch.setattr(locks_module, 'REDIS_LOCK_TTL', 0.3)
+        client = FakeRedis()
+        owner = RedisLocks('owner', client)
+        other = RedisLocks('other', client)
+
+        lock = owner.acquire('auction_a')
+        assert lock
+        sleep(0.5)
+        assert other.acquire('auction_a') is None
+        assert [item['Value'].split()[0] for item in
+                other.active_locks('auction_')] == ['owner']
+
+        owner.release(lock)
+        assert other.active_locks('auction_') == []
+        assert other.acquire('auction_a')
+
+        other.close()
+        assert other.active_locks('auction_') == []
+
+    def test_backends_provide_interface(self, consul_agent):
+        for locks in (consul_scheduler(consul_agent, 'node').locks,
+                      RedisLocks('node', FakeRedis()), LocalLocks('node')):
+            assert verifyObject(ILockBackend, locks)
+
+    def test_unknown_backend(self):
+        with pytest.raises(ValueError):
+            AuctionScheduler('node', {'main': {'lock_backend': 'zookeeper'}})
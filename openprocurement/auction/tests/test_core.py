@@ -1,13 +1,82 @@
-from openprocurement.auction.core import compoenents
+from zope.interface import Interface, implementer
+from zope.interface.interface import InterfaceClass
+
+from openprocurement.auction.components import AuctionComponents
+from openprocurement.auction.interfaces import IFeedItem, IAuctionDatabridge
+from openprocurement.auction.predicates import ProcurementMethodType
+from openprocurement.auction.utils import FeedItem
+
+
+def make_components(*types):
+    components = AuctionComponents()
+    components.add_predicate('procurementMethodType', ProcurementMethodType)
+    for type_ in types:
+        register(components, type_)
+    return components
+
+
+def register(components, type_):
+    iface = InterfaceClass('I{}Auction'.format(type_), bases=(Interface,))
+    components.add_auction(iface, procurementMethodType=type_)
+    components.registerAdapter(Adapter, (IAuctionDatabridge, IFeedItem),
+                               iface)
+    return iface
+
+
+class Adapter(object):
+    def __init__(self, for_, item):
+        self.for_ = for_
+        self.item = item
+
+
+@implementer(IAuctionDatabridge)
+class Bridge(object):
+    pass
 
 
 class TestDispatch(object):
 
     def test_predicate(self):
-        pass
+        predicate = ProcurementMethodType('default', None)
+        assert predicate(FeedItem({}))
+        assert predicate(FeedItem({'procurementMethodType': ''}))
+        assert not predicate(FeedItem({'procurementMethodType': 'esco'}))
+        assert ProcurementMethodType.key(FeedItem({})) == 'default'
+
+    def test_match_cached(self, mocker):
+        components = make_components('default', 'esco')
+        lookup = mocker.spy(components._dispatch, 'lookup')
+
+        for _ in range(3):
+            assert components.match(FeedItem({})).getName() == \
+                'IdefaultAuction'
+            assert components.match(
+                FeedItem({'procurementMethodType': 'esco'})).getName() == \
+                'IescoAuction'
+            assert components.match(
+                FeedItem({'procurementMethodType': 'other'})) is None
+
+        assert lookup.call_count == 3
 
     def test_plugin_load(self):
-        pass
+        components = make_components('default')
+        item = FeedItem({'procurementMethodType': 'esco'})
+        assert components.match(item) is None
+        assert components.query_auction(Bridge(), item) is None
+
+        register(components, 'esco')
+
+        assert components.match(item).getName() == 'IescoAuction'
+        assert isinstance(components.query_auction(Bridge(), item), Adapter)
 
     def test_adapters(self):
-        pass
+        components = make_components('default')
+        bridge = Bridge()
+        item = FeedItem({'id': 'a'})
+
+        adapter = components.query_auction(bridge, item)
+        assert isinstance(adapter, Adapter)
+        assert adapter.for_ is bridge and adapter.item is item
+        assert components.query_auction(object(), item) is None
+        adapter = components.query_auction(bridge, FeedItem({'id': 'b'}))
+        assert adapter.item['id'] == 'b'
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+from gevent import monkey
+monkey.patch_all()
+
+import pytest
+import socket
+from couchdb import Database
+from gevent import spawn, sleep
+from gevent.queue import Queue
+from gevent.server import StreamServer
+from time import time
+
+from openprocurement.auction.design import sync_design_chronograph
+from openprocurement.auction.helpers.chronograph import start_date_row
+from openprocurement.auction.helpers import couch as couch_module
+from openprocurement.auction.helpers.couch import iterchanges, iterview,\
+    CouchEndpoints
+from openprocurement.auction.tests.fakes import FakeCouchDB
+
+
+START = '2100-06-28T10:32:19.233669+03:00'
+
+
+@pytest.fixture(scope='function')
+def couch(request):
+    couch = FakeCouchDB().start()
+    request.addfinalizer(couch.stop)
+    sync_design_chronograph(Database('{}/{}'.format(couch.url, couch.name)))
+    return couch
+
+
+def auction_doc(auction_id, current_stage=-1):
+    return {'_id': auction_id, 'current_stage': current_stage,
+            'mode': 'test', 'stages': [{'start': START}]}
+
+
+class TestIterchanges(object):
+
+    def test_view_changes(self, couch):
+        db = Database('{}/{}'.format(couch.url, couch.name))
+        db.save(auction_doc('a'))
+        db.save(auction_doc('b', current_stage=0))
+        rows = Queue()
+        reader = spawn(lambda: [rows.put(row) for row in iterchanges(
+            couch.url, couch.name, 'chronograph/start_date',
+            heartbeat=100, wrapper=start_date_row)])
+        try:
+            row = rows.get(timeout=1)
+            assert row['id'] == 'a'
+            assert row['value']['start'] == START
+            assert row['value']['mode'] == 'test'
+
+            started = time()
+            db.save(auction_doc('c'))
+            assert rows.get(timeout=1)['id'] == 'c'
+            assert time() - started < 0.5
+            assert rows.empty()
+            assert couch.requests['GET _changes'] == 1
+        finally:
+            reader.kill()
+
+
+class TestIterview(object):
+
+    def test_adaptive_batches(self, couch, monkeypatch):
+        monkeypatch.setattr(couch_module, 'VIEW_BATCH', 100)
+        db = Database('{}/{}'.format(couch.url, couch.name))
+        db.update([auction_doc('{:03}'.format(i)) for i in range(250)])
+
+        rows = []
+        for row in iterview(couch.url, couch.name, 'chronograph/start_date',
+                            sleep_seconds=0):
+            rows.append(row)
+            if len(rows) == 250:
+                break
+
+        assert [row.id for row in rows] == \
+            ['{:03}'.format(i) for i in range(250)]
+        assert rows[0]['value']['start'] == START
+        assert couch.requests['GET view chronograph/start_date'] == 2
+
+    def test_slow_consumer_not_counted(self, couch, monkeypatch):
+        monkeypatch.setattr(couch_module, 'VIEW_BATCH', 100)
+        monkeypatch.setattr(couch_module, 'VIEW_BATCH_SECONDS', 0.2)
+        db = Database('{}/{}'.format(couch.url, couch.name))
+        db.update([auction_doc('{:03}'.format(i)) for i in range(250)])
+
+        rows = 0
+        for row in iterview(couch.url, couch.name, 'chronograph/start_date',
+                            sleep_seconds=0):
+            rows += 1
+            if rows == 50:
+                sleep(0.3)
+            if rows == 250:
+                break
+
+        assert couch.requests['GET view chronograph/start_date'] == 2
+
+    def test_resume_after_connection_error(self, couch, monkeypatch):
+        monkeypatch.setattr(couch_module, 'ENDPOINTS', {})
+        stream_view = couch_module.stream_view
+        failures = [socket.error('Connection reset by peer')]
+
+        def failing_stream_view(database, view_name, **options):
+            for i, row in enumerate(stream_view(database, view_name,
+                                                **options)):
+                if i == 2 and failures:
+                    raise failures.pop()
+                yield row
+
+        monkeypatch.setattr(couch_module, 'stream_view', failing_stream_view)
+        db = Database('{}/{}'.format(couch.url, couch.name))
+        db.update([auction_doc(str(i)) for i in range(5)])
+
+        rows = []
+        for row in iterview(couch.url, couch.name, 'chronograph/start_date',
+                            sleep_seconds=0):
+            rows.append(row.id)
+            if len(rows) == 5:
+                break
+
+        assert rows == ['0', '1', '2', '3', '4']
+        assert couch.requests['GET view chronograph/start_date'] == 2
+        assert '127.0.0.1' in couch_module.ENDPOINTS[couch.url].failed
+
+
+class TestCouchEndpoints(object):
+
+    def test_failover_and_latency(self, couch):
+        # nothing listens on 127.0.0.2 port of the fake
+        endpoints = CouchEndpoints(couch.url)
+        endpoints.ips = ['127.0.0.2', '127.0.0.1']
+        endpoints.resolved = time()
+        endpoints.latency = {'127.0.0.2': 0.001, '127.0.0.1': 0.1}
+        assert endpoints.ordered() == ['127.0.0.2', '127.0.0.1']
+
+        db = endpoints.database(couch.name)
+        assert db.resource.url == '{}/{}'.format(couch.url, couch.name)
+        assert endpoints.ordered() == ['127.0.0.1', '127.0.0.2']
+        assert endpoints.error_rate('127.0.0.2') > 0
+        assert endpoints.latency['127.0.0.1'] < 0.1
+
+        endpoints.failed['127.0.0.2'] = 0
+        endpoints.errors['127.0.0.2'] = (1, 0)
+        assert endpoints.ordered() == ['127.0.0.2', '127.0.0.1']
+
+    def test_failover_without_session_retries(self, couch):
+        # 127.0.0.2 drops every connection on the port of the fake
+        dropping = StreamServer(('127.0.0.2', couch.server.server_port),
+                                lambda sock, address: sock.close())
+        dropping.start()
+        try:
+            endpoints = CouchEndpoints(couch.url)
+            endpoints.ips = ['127.0.0.2', '127.0.0.1']
+            endpoints.resolved = time()
+            endpoints.latency = {'127.0.0.2': 0.001, '127.0.0.1': 0.1}
+            started = time()
+            db = endpoints.database(couch.name)
+        finally:
+            dropping.stop()
+
+        assert time() - started < 1
+        assert db.resource.url == '{}/{}'.format(couch.url, couch.name)
+        assert '127.0.0.2' in endpoints.failed
+
+    def test_sessions_reused_and_dns_ttl(self, couch, monkeypatch):
+        resolved = []
+
+        def getaddrinfo(host, port):
+            resolved.append(host)
+            return [(2, 1, 6, '', ('127.0.0.1', port))]
+
+        monkeypatch.setattr(couch_module.socket, 'getaddrinfo', getaddrinfo)
+        endpoints = CouchEndpoints(couch.url, dns_ttl=60)
+        first = endpoints.database(couch.name)
+        second = endpoints.database(couch.name)
+        assert first.resource.session is second.resource.session
+        assert resolved == ['127.0.0.1']
+
+        endpoints.dns_ttl = 0
+        endpoints.database(couch.name)
+        assert len(resolved) == 2
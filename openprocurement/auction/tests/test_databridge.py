@@ -3,13 +3,15 @@
 from gevent import monkey
 monkey.patch_all()
 
+import json
 import logging
+import sys
 from mock import MagicMock, call
 import pytest
 from openprocurement.auction.databridge import AuctionsDataBridge
 from openprocurement.auction.utils import FeedItem
 from openprocurement.auction.tests.utils import test_bridge_config, \
-    test_bridge_config_error_port
+    test_bridge_config_error_port, databridge_conf_file_path
 from urlparse import urljoin
 from pytest import raises
 from copy import deepcopy
@@ -20,7 +22,12 @@ from openprocurement.auction.tests.utils import \
 from openprocurement.auction import core as core_module
 from openprocurement.auction.databridge import LOGGER as databridge_logger
 from openprocurement.auction.core import LOGGER
+from openprocurement.auction.interfaces import IAuctionPlanner
+from openprocurement.auction.helpers.feeder import FeedMarker
+from openprocurement.auction.helpers.databridge_http import databridge_webapp
 from StringIO import StringIO
+from gevent import sleep
+from gevent.event import Event
 
 LOGGER.setLevel(logging.DEBUG)
 
@@ -151,6 +158,230 @@ class TestDataBridgeFeedItem(object):
         )
 
 
+class TestDataBridgeFeedCheckpoint(object):
+    @pytest.mark.parametrize(
+        'bridge', [({'tenders': [FeedMarker('forward', 'offset'), {}]})],
+        indirect=['bridge'])
+    def test_markers_are_not_planned(self, db, bridge):
+        """
+        Test checks that feed position markers update the feed position
+        and are not passed to the mapper.
+        """
+        mock_mapper = MagicMock()
+        bridge['bridge'].mapper = mock_mapper
+
+        bridge['bridge_thread'].join(0.1)
+
+        assert mock_mapper.call_count == 1
+        assert bridge['bridge'].feeder.position == {'forward_offset': 'offset'}
+
+    def test_markers_acknowledged_after_planning(self, db, bridge):
+        """
+        Test checks that a marker is acknowledged only after the planning
+        commands queued before it are done, and markers are acknowledged
+        in order.
+        """
+        planned = Event()
+
+        def planning(cmd, item_id, lot_id=None):
+            planned.wait()
+
+        bridge_inst = bridge['bridge']
+        bridge_inst.schedule_planning(planning, 'planning', ID, None)
+        bridge_inst.process_item(FeedMarker('forward', 'first'))
+        bridge_inst.process_item(FeedMarker('forward', 'second'))
+        sleep(0.01)
+        assert bridge_inst.feeder.position == {}
+
+        planned.set()
+        bridge_inst.acknowledgement.join()
+        assert bridge_inst.feeder.position == {'forward_offset': 'second'}
+
+    def test_feed_error_raised(self, db, bridge):
+        """
+        Test checks that an error of the feed loop is raised from run,
+        after the feed position is saved.
+        """
+        bridge['mock_resource_items'].side_effect = ValueError('feed')
+
+        bridge['bridge_thread'].join(1)
+
+        assert isinstance(bridge['bridge_thread'].exception, ValueError)
+
+    def test_save_and_load_checkpoint(self, db, bridge):
+        checkpoint = {'forward_offset': 'offset', 'cookies': {'SERVER_ID': 'a'}}
+        bridge['bridge'].feed_checkpoint.save(checkpoint)
+        bridge['bridge'].feed_checkpoint.save(checkpoint)
+
+        assert bridge['bridge'].feed_checkpoint.load() == checkpoint
+
+
+test_bridge_coalesce_config = deepcopy(test_bridge_config)
+test_bridge_coalesce_config['main']['feed_coalesce_window'] = 0.05
+
+
+class TestDataBridgeFeedCoalesce(object):
+    @pytest.mark.parametrize(
+        'bridge', [({'tenders': [
+            {'id': 'a', 'dateModified': '2017-01-01T10:00:00+02:00'},
+            {'id': 'a', 'dateModified': '2017-01-01T10:00:02+02:00'},
+            {'id': 'b', 'dateModified': '2017-01-01T10:00:01+02:00'},
+            {'id': 'a', 'dateModified': '2017-01-01T10:00:01+02:00'}],
+            'bridge_config': test_bridge_coalesce_config})],
+        indirect=['bridge'])
+    def test_latest_item_version_planned(self, db, bridge):
+        """
+        Test checks that only the latest version of the tender within
+        the coalescing window is passed to the mapper.
+        """
+        mock_mapper = MagicMock(return_value=None)
+        bridge['bridge'].mapper = mock_mapper
+
+        bridge['bridge_thread'].join(0.2)
+
+        assert [(call[0][0]['id'], call[0][0]['dateModified'][11:19])
+                for call in mock_mapper.call_args_list] == \
+            [('a', '10:00:02'), ('b', '10:00:01')]
+
+
+class TestDataBridgeShards(object):
+    @pytest.mark.parametrize(
+        'bridge', [({'tenders': [tender_data_active_auction['tender_data_no_lots']]})],
+        indirect=['bridge'])
+    @pytest.mark.parametrize('shard, calls', [(0, 0), (1, 1)])
+    def test_tenders_of_other_shards_skipped(self, db, bridge, shard, calls):
+        """
+        Test checks that the bridge plans only the tenders of its shard.
+        """
+        bridge['bridge'].shard = shard
+        bridge['bridge'].shards = 2
+
+        bridge['bridge_thread'].join(0.1)
+
+        assert bridge['mock_do_until_success'].call_count == calls
+
+    @pytest.mark.parametrize('location, args', [
+        ('127.0.0.1:9100', (9102, '127.0.0.1')), (9100, (9102,))])
+    def test_web_app_port_of_shard(self, db, mocker, location, args):
+        """
+        Test checks that every shard serves the web app on its own port.
+        """
+        mock_listener = mocker.patch.object(databridge_module, 'get_lisener')
+        mocker.patch.object(databridge_module, 'WSGIServer')
+        config = deepcopy(test_bridge_config)
+        config['main']['web_app'] = location
+
+        AuctionsDataBridge(config, shard=2, shards=3)
+
+        mock_listener.assert_called_once_with(*args)
+
+
+class TestDataBridgeMetrics(object):
+    @pytest.mark.parametrize(
+        'bridge', [({'tenders': [tender_data_active_auction['tender_data_no_lots']]})],
+        indirect=['bridge'])
+    def test_metrics_endpoint(self, db, bridge):
+        """
+        Test checks that feed items and planning commands are counted
+        and served by the metrics endpoint.
+        """
+        bridge['bridge_thread'].join(0.1)
+
+        databridge_webapp.bridge = bridge['bridge']
+        response = databridge_webapp.test_client().get('/metrics')
+        assert response.status_code == 200
+        assert 'databridge_feed_items_total{procurement_method_type=""} 1' \
+            in response.data
+        assert 'databridge_planning_duration_seconds_count' \
+            '{cmd="planning",procurement_method_type=""} 1' in response.data
+
+    def test_worker_failure_counted(self, db, bridge):
+        """
+        Test checks that a planning command failed after all worker
+        retries is counted as error, its lag is measured and the auction
+        is not taken as planned.
+        """
+        bridge['mock_do_until_success'].return_value = None
+        bridge_inst = bridge['bridge']
+        bridge_inst.process_item(dict(
+            tender_data_active_auction['tender_data_no_lots'],
+            dateModified='2017-06-28T10:32:19.233669+03:00'))
+        bridge_inst.planning_pool.join()
+
+        metrics = bridge_inst.metrics.render()
+        assert 'databridge_planning_errors_total' \
+            '{cmd="planning",procurement_method_type=""} 1' in metrics
+        assert 'databridge_feed_lag_seconds_count' \
+            '{procurement_method_type=""} 1' in metrics
+        assert bridge_inst.planned_auctions.get(ID) is None
+
+
+class TestDataBridgeDryRun(object):
+    @pytest.mark.parametrize(
+        'bridge', [({'tenders': [tender_data_active_auction['tender_data_with_lots']],
+                     'bridge_kwargs': {'dry_run': StringIO()}})],
+        indirect=['bridge'])
+    def test_plan_written_instead_of_worker_call(self, db, bridge):
+        """
+        Test checks that in dry run mode planning commands are written as
+        JSON lines, auction workers are not called and the tender is not
+        planned again for the same date.
+        """
+        bridge['bridge_thread'].join(0.1)
+        tender = bridge['tenders'][0]
+        bridge['bridge'].process_item(tender)
+        bridge['bridge'].planning_pool.join()
+
+        assert bridge['mock_do_until_success'].call_count == 0
+        plan = [json.loads(line) for line in
+                bridge['bridge'].dry_run.getvalue().splitlines()]
+        assert plan == [
+            {'cmd': 'planning', 'tender_id': tender['id'],
+             'lot_id': lot['id'], 'start': lot['auctionPeriod']['startDate']}
+            for lot in tender['lots']
+        ]
+
+    @pytest.mark.parametrize(
+        'bridge', [({'bridge_kwargs': {'dry_run': StringIO()}})],
+        indirect=['bridge'])
+    def test_feed_replayed(self, db, bridge):
+        """
+        Test checks that dry run reads the feed from the start and does
+        not save the feed position.
+        """
+        bridge_inst = bridge['bridge']
+        checkpoint = {'forward_offset': 'offset', 'cookies': {}}
+        bridge_inst.feed_checkpoint.save(checkpoint)
+        bridge_inst.feeder.position = {'forward_offset': 'other'}
+
+        bridge['bridge_thread'].join(1)
+
+        assert bridge_inst.feeder.resume_from is None
+        assert bridge_inst.feed_checkpoint.load() == checkpoint
+
+    @pytest.mark.parametrize('dry_run, stdout', [('-', True), ('plan', False)])
+    def test_command_line(self, mocker, tmpdir, dry_run, stdout):
+        mock_bridge = mocker.patch.object(databridge_module,
+                                          'AuctionsDataBridge')
+        mocker.patch('logging.config.dictConfig')
+        plan = tmpdir.join('plan')
+        plan.write('previous run\n')
+        mocker.patch('sys.argv', [
+            'auctions_data_bridge', '--dry-run',
+            str(plan) if dry_run == 'plan' else dry_run,
+            databridge_conf_file_path])
+
+        databridge_module.main()
+
+        dry_run = mock_bridge.call_args[1]['dry_run']
+        if stdout:
+            assert dry_run is sys.stdout
+        else:
+            dry_run.close()
+            assert dry_run.mode == 'w'
+            assert plan.read() == ''
+
+
 class TestDataBridgePlanning(object):
     @pytest.mark.parametrize(
         'bridge', [({'tenders': [{}]}), ({'tenders': [tender_data_templ]}),
@@ -296,6 +527,204 @@ class TestForDataBridgePositive(object):
         )
 
 
+class TestDataBridgeInProcessPlanner(object):
+    @pytest.mark.parametrize(
+        'bridge', [({'tenders': [tender_data_active_auction['tender_data_no_lots']]})],
+        indirect=['bridge'])
+    def test_planner_used_instead_of_worker(self, db, bridge):
+        """
+        Test checks that registered in-process planner is called with
+        the bridge and the worker subprocess is not started.
+        """
+        planner = MagicMock(return_value=True)
+        core_module.components.registerUtility(
+            planner, IAuctionPlanner, name='default')
+        try:
+            bridge['bridge_thread'].join(0.1)
+        finally:
+            core_module.components.unregisterUtility(
+                planner, IAuctionPlanner, name='default')
+
+        assert planner.call_count == 1
+        assert planner.call_args[0][:3] == (bridge['bridge'], 'planning', ID)
+        assert bridge['mock_do_until_success'].call_count == 0
+
+    @pytest.mark.parametrize(
+        'bridge', [({'tenders': [tender_data_active_auction['tender_data_no_lots']]})],
+        indirect=['bridge'])
+    def test_planner_error_fallback_to_worker(self, db, bridge):
+        planner = MagicMock(side_effect=Exception('Planner error'))
+        core_module.components.registerUtility(
+            planner, IAuctionPlanner, name='default')
+        try:
+            bridge['bridge_thread'].join(0.1)
+        finally:
+            core_module.components.unregisterUtility(
+                planner, IAuctionPlanner, name='default')
+
+        assert planner.call_count == 1
+        assert bridge['mock_do_until_success'].call_count == 1
+
+
+class TestDataBridgePlanningPool(object):
+    def test_same_auction_commands_run_in_order(self, db, bridge):
+        """
+        Test checks that commands for the same auction are executed
+        one after another in the order they were scheduled.
+        """
+        calls = []
+
+        def planning(cmd, item_id, lot_id=None):
+            calls.append(('start', cmd))
+            sleep(0.01)
+            calls.append(('end', cmd))
+
+        bridge_inst = bridge['bridge']
+        bridge_inst.schedule_planning(planning, 'planning', ID, LOT_ID)
+        bridge_inst.schedule_planning(planning, 'cancel', ID, LOT_ID)
+        bridge_inst.planning_pool.join()
+
+        assert calls == [('start', 'planning'), ('end', 'planning'),
+                         ('start', 'cancel'), ('end', 'cancel')]
+        assert bridge_inst.planning_tasks == {}
+
+    def test_pending_planning_not_scheduled_again(self, db, bridge):
+        """
+        Test checks that a planning on the start date of the queued or
+        running planning of the auction is skipped, while a planning on
+        another date is chained to it.
+        """
+        tender = tender_data_active_auction['tender_data_no_lots']
+        moved = deepcopy(tender)
+        moved['auctionPeriod']['startDate'] = '2100-06-29T10:32:19+03:00'
+        calls = []
+
+        def planning_of(item):
+            planning = MagicMock(side_effect=lambda cmd, item_id, lot_id:
+                                 calls.append(item['auctionPeriod']))
+            planning.item = item
+            return planning
+
+        bridge_inst = bridge['bridge']
+        first = bridge_inst.schedule_planning(planning_of(tender),
+                                              'planning', ID, None)
+        assert bridge_inst.schedule_planning(planning_of(tender),
+                                             'planning', ID, None) is first
+        bridge_inst.schedule_planning(planning_of(moved), 'planning', ID, None)
+        bridge_inst.planning_pool.join()
+
+        assert calls == [tender['auctionPeriod'], moved['auctionPeriod']]
+
+    def test_tender_revisions_planned_once(self, db, bridge):
+        """
+        Test checks that further revisions of a tender are not planned
+        again, both while the planning is queued and after it is done,
+        before the worker save shows up in the auctions database.
+        """
+        bridge_inst = bridge['bridge']
+        tender = tender_data_active_auction['tender_data_no_lots']
+        bridge_inst.process_item(dict(tender, dateModified='1'))
+        bridge_inst.process_item(dict(tender, dateModified='2'))
+        bridge_inst.planning_pool.join()
+        bridge_inst.process_item(dict(tender, dateModified='3'))
+        bridge_inst.planning_pool.join()
+
+        assert bridge['mock_do_until_success'].call_count == 1
+        assert bridge_inst.planned_auctions.get(ID) == 4117851139233
+        assert bridge_inst.planned_auctions.pending == {}
+
+
+re_planning_docs = [
+    {'_id': tender_id, 'stages': [{'start': start}]}
+    for tender_id, start in (
+        ('t1', '2100-06-28T10:00:00+03:00'),
+        ('t2_l1', '2100-06-28T11:00:00+03:00'),
+        ('t2_l2', '2100-06-28T11:00:00+03:00'),
+        ('t3', '2000-06-28T10:00:00+03:00'),
+        ('t4', '2100-06-28T12:00:00+03:00'),
+    )
+]
+test_bridge_re_planning_config = deepcopy(test_bridge_config)
+test_bridge_re_planning_config['main']['re_planning_concurrency'] = 2
+
+
+class TestDataBridgeRePlanning(object):
+    @pytest.fixture(scope='function')
+    def re_planned(self, bridge, mocker):
+        """Tender ids fetched for re-planning and their planning commands"""
+        fetched, commands = [], []
+        running = [0]
+        running_max = [0]
+
+        def get_tender_data(url, session=None):
+            tender_id = url.rsplit('/', 1)[1]
+            fetched.append(tender_id)
+            running[0] += 1
+            running_max[0] = max(running_max[0], running[0])
+            sleep(0.05)
+            running[0] -= 1
+            return {'data': {'id': tender_id}}
+
+        def mapper(feed):
+            lots = [None] if feed['id'] != 't2' else ['l1', 'l2']
+            return [('planning', feed['id'], lot_id) for lot_id in lots]
+
+        mocker.patch.object(databridge_module, 'get_tender_data',
+                            side_effect=get_tender_data)
+        mocker.patch.object(databridge_module, 'RE_PLANNING_BATCH', 1)
+        bridge_inst = bridge['bridge']
+        bridge_inst.mapper = mapper
+        bridge_inst.run_planning = MagicMock(
+            side_effect=lambda planning, *command: commands.append(command))
+        return bridge_inst, fetched, commands, running_max
+
+    @pytest.mark.parametrize('db', [re_planning_docs], indirect=['db'])
+    def test_future_auctions_re_planned(self, db, re_planned):
+        """
+        Test checks that the auctions database is scanned in batches
+        from now on and every tender is re-planned once, even with
+        several auctions.
+        """
+        bridge_inst, fetched, commands, running_max = re_planned
+        bridge_inst.run_re_planning()
+
+        assert sorted(fetched) == ['t1', 't2', 't4']
+        assert sorted(commands) == [('planning', 't1', None),
+                                    ('planning', 't2', 'l1'),
+                                    ('planning', 't2', 'l2'),
+                                    ('planning', 't4', None)]
+
+    @pytest.mark.parametrize('db', [re_planning_docs], indirect=['db'])
+    @pytest.mark.parametrize(
+        'bridge', [({'bridge_config': test_bridge_re_planning_config})],
+        indirect=['bridge'])
+    def test_re_planning_concurrency(self, db, bridge, re_planned):
+        """
+        Test checks that tenders are re-planned in a pool of
+        ``re_planning_concurrency`` size.
+        """
+        bridge_inst, fetched, commands, running_max = re_planned
+        bridge_inst.run_re_planning()
+
+        assert len(fetched) == 3
+        assert running_max[0] == 2
+
+    @pytest.mark.parametrize('db', [re_planning_docs], indirect=['db'])
+    def test_seen_tenders_not_re_planned(self, db, re_planned):
+        """
+        Test checks that tenders already re-planned are skipped, also
+        by the next scan.
+        """
+        bridge_inst, fetched, commands, running_max = re_planned
+        bridge_inst.tenders_ids_list.add('t1')
+        bridge_inst.run_re_planning()
+        bridge_inst.run_re_planning()
+
+        assert sorted(fetched) == ['t2', 't4']
+        assert 't2_l1' in bridge_inst.tenders_ids_list
+        assert 't2' in bridge_inst.tenders_ids_list
+
+
 # TODO: should be refactored
 class TestForDataBridgeNegative(object):
     @pytest.mark.parametrize(
@@ -332,6 +761,21 @@ class TestForDataBridgeNegative(object):
     #     # TODO Write test
     #     pass
 
+    @pytest.mark.parametrize(
+        'db, bridge',
+        [([{'_id': ID, 'stages': [{'start': '2100-06-28T10:32:19.233669+03:00'}]}],
+          {'tenders': [tender_data_active_auction['planned_on_the_same_date']]})],
+        indirect=['db', 'bridge'])
+    def test_active_auction_planned_on_the_same_date_index(self, db, bridge):
+        """
+        Tender already planned on the same date is found in the planned
+        auctions index and is not planned again
+        """
+        bridge['bridge_thread'].join(0.1)
+
+        assert bridge['bridge'].planned_auctions.get(ID) == 4117851139233
+        assert bridge['mock_do_until_success'].call_count == 0
+
     @pytest.mark.parametrize(
         'bridge', [({'tenders': [tender_data_active_qualification['no_active_status_in_lot']]})],
         indirect=['bridge'])
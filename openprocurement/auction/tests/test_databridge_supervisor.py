@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from gevent import monkey
+monkey.patch_all()
+
+import sys
+from gevent import spawn, sleep, Timeout
+
+import openprocurement.auction.databridge_supervisor as supervisor_module
+from openprocurement.auction.databridge_supervisor import \
+    DataBridgeSupervisor
+
+
+class CommandSupervisor(DataBridgeSupervisor):
+    def __init__(self, codes, **kwargs):
+        super(CommandSupervisor, self).__init__('config.yaml', len(codes),
+                                                **kwargs)
+        self.codes = codes
+        self.started = []
+
+    def command(self, shard):
+        self.started.append(shard)
+        if not self.codes[shard]:
+            return [sys.executable, '-c', 'import time; time.sleep(30)']
+        code = self.codes[shard].pop(0)
+        return [sys.executable, '-c', 'import sys; sys.exit({})'.format(code)]
+
+
+def test_command():
+    supervisor = DataBridgeSupervisor('config.yaml', 4, ['--resync'])
+    assert supervisor.command(2)[-6:] == \
+        ['config.yaml', '--shard', '2', '--shards', '4', '--resync']
+
+
+def test_exited_shard_restarted(mocker):
+    mocker.patch.object(supervisor_module, 'RESTART_DELAY', 0.01)
+    supervisor = CommandSupervisor({0: [1, 0], 1: []})
+    runner = spawn(supervisor.run)
+    with Timeout(5):
+        while len(supervisor.started) < 4:
+            sleep(0.05)
+
+    supervisor.shutdown()
+    runner.join(5)
+
+    assert runner.ready()
+    assert sorted(supervisor.started) == [0, 0, 0, 1]
+
+
+def test_shutdown_stops_shards():
+    supervisor = DataBridgeSupervisor('config.yaml', 2)
+    supervisor.command = lambda shard: \
+        [sys.executable, '-c', 'import time; time.sleep(30)']
+    runner = spawn(supervisor.run)
+    runner.join(0.5)
+
+    supervisor.shutdown()
+    runner.join(5)
+
+    assert runner.ready()
+    assert all(process.poll() is not None
+               for process in supervisor.processes.values())
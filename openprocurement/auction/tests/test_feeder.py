@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from gevent import monkey
+monkey.patch_all()
+
+import pytest
+
+from openprocurement.auction.helpers.feeder import RawTendersClientSync, \
+    CheckpointResourceFeeder, FeedMarker, FORWARD, coalesce
+from openprocurement.auction.tests.fakes import FakeResourceAPI
+
+
+def test_raw_client_keeps_plain_dicts():
+    api = FakeResourceAPI().start()
+    try:
+        api.publish({'id': 'a', 'lots': [{'id': 'b', 'status': 'active'}]})
+        client = RawTendersClientSync('', host_url=api.url, api_version='2.3')
+        page = client.sync_tenders({'descending': True, 'opt_fields': 'lots'})
+    finally:
+        api.stop()
+
+    assert page.next_page.offset == page.prev_page.offset == 1
+    assert type(page.data[0]) is dict
+    assert type(page.data[0]['lots'][0]) is dict
+    assert page.data[0]['lots'] == [{'id': 'b', 'status': 'active'}]
+
+
+def test_coalesce_counts_tenders_only():
+    marker = FeedMarker(FORWARD, 'offset')
+    items = [{'id': 'a'}, marker, {}, {'id': 'a'}, {}, {'id': 'b'},
+             {'id': 'c'}]
+    batches = list(coalesce(iter(items), window=1, size=2))
+    assert batches == [[{'id': 'a'}, marker, {}, {}, {'id': 'b'}],
+                       [{'id': 'c'}]]
+
+
+@pytest.fixture(scope='function')
+def api(request):
+    api = FakeResourceAPI(page_size=1).start()
+    request.addfinalizer(api.stop)
+    for tender_id in ('a', 'b'):
+        api.publish({'id': tender_id})
+    return api
+
+
+@pytest.fixture(scope='function')
+def feeder(request, api):
+    feeder = CheckpointResourceFeeder(
+        host=api.url, version='2.3', key='', resource='tenders',
+        extra_params={'mode': '_all_'},
+        retrievers_params={'down_requests_sleep': 0, 'up_requests_sleep': 0,
+                           'up_wait_sleep': 0.01, 'queue_size': 100}
+    )
+
+    def stop():
+        for worker in ('forward_worker', 'backward_worker'):
+            if hasattr(feeder, worker):
+                getattr(feeder, worker).kill()
+
+    request.addfinalizer(stop)
+    return feeder
+
+
+def read(feeder, items, count):
+    """Read ``count`` tenders, acknowledging the markers on the way"""
+    read_items = []
+    for item in items:
+        if isinstance(item, FeedMarker):
+            feeder.acknowledge(item)
+            read_items.append((item.direction, item.offset))
+            continue
+        read_items.append(item['id'])
+        count -= 1
+        if not count:
+            return read_items
+
+
+def test_markers_precede_page_items(api, feeder):
+    items = feeder.get_resource_items()
+
+    assert read(feeder, items, 2) == [
+        ('backward', None), 'b', ('forward', 2), ('backward', 2), 'a']
+    assert feeder.get_checkpoint() == {
+        'forward_offset': 2, 'backward_offset': 2,
+        'cookies': {'SERVER_ID': 'fake'}}
+
+    api.publish({'id': 'c'})
+
+    assert read(feeder, items, 1) == [
+        ('backward_done', None), ('forward', 2), 'c']
+    assert feeder.get_checkpoint() == {
+        'forward_offset': 2, 'backward_done': True,
+        'cookies': {'SERVER_ID': 'fake'}}
+
+
+def test_resume_from_checkpoint(api, feeder):
+    api.publish({'id': 'c'})
+    checkpoint = {'forward_offset': 2, 'backward_done': True,
+                  'cookies': {'SERVER_ID': 'fake'}}
+    feeder.resume_from = checkpoint
+
+    assert read(feeder, feeder.get_resource_items(), 1) == [
+        ('forward', 2), 'c']
+    assert feeder.get_checkpoint() == checkpoint
+    assert feeder.resume_from is None
+
+
+def test_markers_of_restarted_sync_dropped(api, feeder):
+    items = feeder.get_resource_items()
+    stale = next(items)
+    feeder.restart_sync()
+
+    feeder.acknowledge(stale)
+    feeder.acknowledge(FeedMarker(FORWARD, 1))
+    assert feeder.position == {}
+
+    feeder.acknowledge(feeder.marker(FORWARD, 2))
+    assert feeder.position == {'forward_offset': 2}
@@ -0,0 +1,86 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+from apscheduler.jobstores.base import JobLookupError, ConflictingIdError
+from apscheduler.jobstores.memory import MemoryJobStore
+from pytz import utc
+
+from openprocurement.auction.helpers import jobstore as jobstore_module
+from openprocurement.auction.helpers.jobstore import HeapJobStore
+
+
+NOW = datetime(2100, 1, 1, tzinfo=utc)
+
+
+class Job(object):
+    def __init__(self, id, next_run_time):
+        self.id = id
+        self.next_run_time = next_run_time
+
+
+def run_time(minutes):
+    return None if minutes is None else NOW + timedelta(minutes=minutes)
+
+
+def state(store):
+    return ([job.id for job in store.get_all_jobs()],
+            [job.id for job in store.get_due_jobs(run_time(50))],
+            store.get_next_run_time())
+
+
+class TestHeapJobStore(object):
+
+    def test_order_and_lookup(self):
+        store = HeapJobStore()
+        for job_id, minutes in [('c', 30), ('a', 10), ('p', None),
+                                ('b', 10), ('d', 60)]:
+            store.add_job(Job(job_id, run_time(minutes)))
+
+        assert [job.id for job in store.get_all_jobs()] == \
+            ['a', 'b', 'c', 'd', 'p']
+        assert [job.id for job in store.get_due_jobs(run_time(30))] == \
+            ['a', 'b', 'c']
+        assert store.get_next_run_time() == run_time(10)
+        assert store.lookup_job('p').next_run_time is None
+        assert store.lookup_job('x') is None
+        with pytest.raises(ConflictingIdError):
+            store.add_job(Job('a', run_time(1)))
+
+    def test_update_and_remove(self):
+        store = HeapJobStore()
+        store.add_job(Job('a', run_time(10)))
+        store.add_job(Job('b', run_time(20)))
+
+        store.update_job(Job('a', run_time(30)))
+        assert store.get_next_run_time() == run_time(20)
+        store.remove_job('b')
+        assert store.get_next_run_time() == run_time(30)
+        assert [job.id for job in store.get_due_jobs(run_time(40))] == ['a']
+        store.update_job(Job('a', None))
+        assert store.get_next_run_time() is None
+        assert [job.id for job in store.get_all_jobs()] == ['a']
+
+        with pytest.raises(JobLookupError):
+            store.remove_job('b')
+        with pytest.raises(JobLookupError):
+            store.update_job(Job('b', run_time(1)))
+
+    def test_same_as_memory_store(self, monkeypatch):
+        monkeypatch.setattr(jobstore_module, 'COMPACT_THRESHOLD', 10)
+        rnd = random.Random(0)
+        heap, memory = HeapJobStore(), MemoryJobStore()
+        for _ in range(2000):
+            job = Job('job{}'.format(rnd.randint(0, 50)),
+                      run_time(rnd.choice([None] + range(100))))
+            if memory.lookup_job(job.id) is None:
+                heap.add_job(job)
+                memory.add_job(job)
+            elif rnd.random() < 0.3:
+                heap.remove_job(job.id)
+                memory.remove_job(job.id)
+            else:
+                heap.update_job(job)
+                memory.update_job(job)
+            assert state(heap) == state(memory)
+        assert len(heap._heap) <= 2 * len(heap._jobs_index) + 10
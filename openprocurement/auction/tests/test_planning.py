@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from gevent import monkey
+monkey.patch_all()
+
+import pytest
+from collections import Counter
+from gevent import sleep, Timeout
+
+from openprocurement.auction.design import sync_design, startDate_view, \
+    PreAnnounce_by_id_view, endDate_by_tenderID_view
+from openprocurement.auction.helpers import planning as planning_module
+from openprocurement.auction.helpers.planning import PlannedAuctionsIndex
+
+
+FUTURE = '2100-06-28T10:32:19+03:00'
+PAST = '2000-06-28T10:32:19+03:00'
+
+
+@pytest.fixture(scope='function')
+def index(db, mocker):
+    sync_design(db)
+    db.save({'_id': 'a_1', 'current_stage': 0, 'stages': [{'start': PAST}, {}]})
+    db.save({'_id': 'a_2', 'current_stage': 0, 'stages': [{'start': PAST}]})
+    db.save({'_id': 'b_1', 'stages': [{'start': FUTURE}]})
+    db.save({'_id': 'b_2', 'stages': [{'start': PAST}]})
+    db.save({'_id': 'c', 'stages': [{'start': FUTURE}]})
+    views = mocker.patch.object(db, 'view', wraps=db.view)
+    return PlannedAuctionsIndex(db), views
+
+
+def view_requests(views):
+    return dict(Counter(call[0][0] for call in views.call_args_list))
+
+
+class TestPlanningViews(object):
+
+    def test_start_date_view(self, index):
+        index, views = index
+        rows = startDate_view(index.db, startkey=962177539001)
+        assert [(row.id, row.key) for row in rows] == [
+            ('b_1', 4117851139000), ('c', 4117851139000)]
+
+    def test_pre_announce_by_id_view(self, index):
+        index, views = index
+        rows = PreAnnounce_by_id_view(index.db, keys=['a_1', 'a_2', 'd_1'])
+        assert [row.id for row in rows] == ['a_1']
+
+    def test_end_date_by_tender_id_view(self, index):
+        index, views = index
+        index.db.save({'_id': 'bb_1', 'stages': [{'start': FUTURE}]})
+        rows = endDate_by_tenderID_view(index.db, key='b')
+        assert [(row.id, row.value) for row in rows] == [
+            ('b_1', 4117851139000), ('b_2', 962177539000)]
+
+
+class TestPlannedAuctionsIndexLoad(object):
+
+    def test_load_future_auctions(self, index, mocker):
+        index, views = index
+        mocker.patch.object(planning_module, 'LOAD_BATCH', 1)
+        index.load()
+        assert index.auctions == {'b_1': 4117851139000, 'c': 4117851139000}
+        assert view_requests(views) == {'auctions/by_startDate': 2}
+
+    def test_past_auctions_evicted(self, index):
+        index, views = index
+        index.mark_planned('b_1', 4117851139000)
+        index.mark_planned('b_2', 962177539000)
+        assert 'b_2' in index
+        index.evict_past(interval=0)
+        assert index.auctions == {'b_1': 4117851139000}
+
+    def test_watch_future_auctions(self, index):
+        index, views = index
+        index.start()
+        try:
+            index.db.save({'_id': 'd_1', 'stages': [{'start': PAST}]})
+            index.db.save({'_id': 'd_2', 'stages': [{'start': FUTURE}]})
+            with Timeout(5):
+                while 'd_2' not in index:
+                    sleep(0.05)
+        finally:
+            index.stop()
+        assert 'd_1' not in index
+
+
+class TestPlannedAuctionsIndexFutureAuctions(object):
+
+    def test_future_auctions_of_tender(self, index):
+        index, views = index
+        index.db.save({'_id': 'bb_1', 'stages': [{'start': FUTURE}]})
+        assert index.future_auctions('b', 0) == set(['b_1', 'b_2'])
+        assert index.future_auctions('b', 962177539000) == set(['b_1'])
+        assert index.future_auctions('d', 0) == set()
+        assert view_requests(views) == {'auctions/endDate_by_tenderID': 2}
+
+    def test_future_auctions_dropped_on_change(self, index):
+        index, views = index
+        assert index.future_auctions('b', 0) == set(['b_1', 'b_2'])
+        index.apply({'id': 'b_3', 'doc': {'stages': [{'start': FUTURE}]}})
+        index.db.save({'_id': 'b_3', 'stages': [{'start': FUTURE}]})
+        assert index.future_auctions('b', 0) == set(['b_1', 'b_2', 'b_3'])
+        assert sum(view_requests(views).values()) == 2
+
+
+class TestPlannedAuctionsIndexPrefetch(object):
+
+    def test_batch_lookups(self, index):
+        index, views = index
+        index.prefetch([
+            {'id': 'a', 'status': 'active.qualification',
+             'lots': [{'id': '1', 'status': 'active'},
+                      {'id': '2', 'status': 'active'},
+                      {'id': '3', 'status': 'cancelled'}]},
+            {'id': 'b', 'status': 'cancelled'},
+            {'id': 'c', 'status': 'cancelled'},
+            {'id': 'd', 'status': 'active.auction'},
+        ])
+        assert view_requests(views) == {
+            'auctions/PreAnnounce_by_id': 1,
+            'auctions/endDate_by_tenderID': 1,
+        }
+
+        assert index.pre_announced(['a_1', 'a_2']) == set(['a_1'])
+        assert index.future_auctions('b', 0) == set(['b_1', 'b_2'])
+        assert index.future_auctions('b', 4117764739001) == set(['b_1'])
+        assert index.future_auctions('c', 0) == set(['c'])
+        assert sum(view_requests(views).values()) == 2
+
+    def test_lookup_without_prefetch(self, index):
+        index, views = index
+        index.prefetch([{'id': 'a', 'status': 'active.qualification',
+                         'lots': [{'id': '2', 'status': 'active'}]}])
+        assert index.pre_announced(['a_1', 'a_2']) == set(['a_1'])
+        assert index.future_auctions('b', 0) == set(['b_1', 'b_2'])
+        assert sum(view_requests(views).values()) == 3
+
+        index.prefetch([])
+        assert index.pre_announced(['a_2']) == set()
+        assert sum(view_requests(views).values()) == 4
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import json
+import pickle
+from copy import deepcopy
+
+from openprocurement.auction.interfaces import IFeedItem
+from openprocurement.auction.utils import FeedItem
+from openprocurement.auction.tests.utils import tender_data_active_auction
+
+
+class TestFeedItem(object):
+
+    def test_provides_interface(self):
+        assert IFeedItem.providedBy(FeedItem({}))
+
+    def test_wraps_tender(self):
+        data = deepcopy(tender_data_active_auction['tender_data_with_lots'])
+        item = FeedItem(data)
+
+        assert item == data
+        assert item.toDict() == data
+        assert type(item.toDict()['lots'][0]) is dict
+        assert item['lots'][0]['id'] == data['lots'][0]['id']
+        assert item.lots[0].auctionPeriod.startDate == \
+            data['lots'][0]['auctionPeriod']['startDate']
+        assert item.lots is item['lots']
+
+    def test_lazy_nested(self):
+        data = {'id': 'a', 'lots': [{'id': 'b'}], 'tags': ['x']}
+        item = FeedItem(data)
+        assert type(dict.__getitem__(item, 'lots')[0]) is dict
+
+        item.get('id')
+        assert item['tags'] == ['x']
+        assert type(dict.__getitem__(item, 'lots')[0]) is dict
+        assert item['lots'][0].id == 'b'
+        assert type(data['lots'][0]) is dict
+        assert not hasattr(item, '__dict__')
+
+    def test_nested_changes_kept(self):
+        item = FeedItem({'id': 'a', 'lots': [{'id': 'b'}],
+                         'auctionPeriod': {}})
+        item.lots.append({'id': 'c'})
+        item.lots[0].status = 'active'
+        item.auctionPeriod['startDate'] = '2017-01-01T10:00:00+02:00'
+
+        assert item.toDict() == {
+            'id': 'a',
+            'lots': [{'id': 'b', 'status': 'active'}, {'id': 'c'}],
+            'auctionPeriod': {'startDate': '2017-01-01T10:00:00+02:00'}}
+
+    def test_dict_compatible(self):
+        item = FeedItem({'id': 'a', 'lots': [{'id': 'b'}]})
+        item.lots[0].id
+        copied = item.copy()
+
+        assert isinstance(item, dict)
+        assert json.loads(json.dumps(item)) == {'id': 'a',
+                                                'lots': [{'id': 'b'}]}
+        assert type(copied) is FeedItem and copied == item
+        assert pickle.loads(pickle.dumps(item)) == item
+        assert deepcopy(item) == item
+        assert [lot.id for lot in item.get('lots')] == ['b']
+        assert dict(item.items())['lots'][0].id == 'b'
+
+    def test_mapping_protocol(self):
+        item = FeedItem({'id': 'a'})
+        item.status = 'active.auction'
+        item['lots'] = []
+
+        assert dict(item) == {'id': 'a', 'status': 'active.auction',
+                              'lots': []}
+        assert item.get('missing') is None
+        assert 'status' in item and 'missing' not in item
+        assert '{0[id]}'.format(item) == 'a'
+        del item.status
+        assert 'status' not in item
+        assert getattr(item, 'missing', None) is None
@@ -21,7 +21,6 @@ from pkg_resources import parse_version
 from restkit.wrappers import BodyWrapper
 from barbecue import chef
 from fractions import Fraction
-from munch import Munch
 from zope.interface import implementer
 
 from openprocurement.auction.interfaces import IFeedItem
@@ -439,6 +438,104 @@ def prepare_auction_worker_cmd(_for, tender_id, cmd, item,
     return params
 
 
+def _lazy(value):
+    if type(value) is dict:
+        return LazyMapping(value)
+    if type(value) is list and any(type(i) is dict for i in value):
+        return _LazyList(_lazy(i) for i in value)
+    return value
+
+
+def _plain(value):
+    if isinstance(value, dict):
+        return dict((k, _plain(v)) for k, v in dict.iteritems(value))
+    if isinstance(value, list):
+        return [_plain(i) for i in value]
+    return value
+
+
+class _LazyList(list):
+    """List whose nested dicts are already wrapped"""
+    __slots__ = ()
+
+
+class LazyMapping(dict):
+    """Dict with attribute access, like ``Munch``, which wraps nested
+    values on first access only.
+
+    Only the top level keys are copied, so reading a couple of fields of
+    a big tender does not walk all its lots. A nested dict or a list of
+    dicts is wrapped when it is read and stored back in place of the raw
+    value, so changes made through the wrapper are kept.
+
+    >>> item = LazyMapping({'id': 'a', 'lots': [{'id': 'b'}]})
+    >>> item.id, item['lots'][0].id, item.lots is item['lots']
+    ('a', 'b', True)
+    >>> item.lots.append({'id': 'c'})
+    >>> item.toDict() == {'id': 'a', 'lots': [{'id': 'b'}, {'id': 'c'}]}
+    True
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        wrapped = _lazy(value)
+        if wrapped is not value:
+            dict.__setitem__(self, key, wrapped)
+        return wrapped
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        return _lazy(dict.pop(self, key, *default))
+
+    def itervalues(self):
+        for key in self:
+            yield self[key]
+
+    def iteritems(self):
+        for key in self:
+            yield key, self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def copy(self):
+        return type(self)(self)
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, dict.__repr__(self))
+
+    def toDict(self):
+        """Plain dict copy of the item (``Munch`` compatible name)"""
+        return _plain(self)
+
+
 @implementer(IFeedItem)
-class FeedItem(Munch):
+class FeedItem(LazyMapping):
     """"""
+    __slots__ = ()
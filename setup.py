@@ -44,7 +44,13 @@ entry_points = {
     'console_scripts': [
         'auctions_chronograph = openprocurement.auction.chronograph:main',
         'auctions_data_bridge = openprocurement.auction.databridge:main',
-        'auction_test = openprocurement.auction.tests.main:main [test]'
+        'auctions_data_bridge_supervisor = '
+        'openprocurement.auction.databridge_supervisor:main',
+        'auction_test = openprocurement.auction.tests.main:main [test]',
+        'auctions_data_bridge_benchmark = '
+        'openprocurement.auction.tests.benchmarks.databridge:main [test]',
+        'auctions_chronograph_benchmark = '
+        'openprocurement.auction.tests.benchmarks.chronograph:main [test]'
     ],
     'paste.app_factory': [
         'auctions_server = openprocurement.auction.app:make_auctions_app',